@@ -0,0 +1,146 @@
+"""End-to-end latency benchmarks against the mock OpenAI server.
+
+Each scenario runs chatcli as a subprocess, exactly as a user would, and
+measures:
+
+* TTFT: time from starting chatcli until the first byte of the answer.
+* Overhead per token: wall time not accounted for by the mock server's
+  configured delays, divided by the number of tokens streamed.
+* Wall: total time until chatcli exits.
+
+    python -m benchmarks.bench_streaming --ttft 0.1 --tokens-per-sec 200
+"""
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+
+from .mock_openai import (
+    add_config_arguments,
+    answer_tokens,
+    base_url,
+    config_from_args,
+    start_server,
+)
+
+SCENARIOS = {
+    "chat": [(["chat", "--quick"], "What is the answer?")],
+    "answer": [
+        (["add", "--role", "user"], "What is the answer?"),
+        (["answer"], ""),
+    ],
+    "plugins": [(["chat", "--quick", "-p", "pyeval"], "evaluate: 6 * 7")],
+}
+
+
+def run_chatcli(args, stdin, env, cwd):
+    """Run chatcli, returning (seconds to first output, seconds to exit)."""
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "chatcli_gpt", *args],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        env=env,
+        cwd=cwd,
+    )
+    process.stdin.write(stdin.encode())
+    process.stdin.close()
+
+    first_output = None
+    while os.read(process.stdout.fileno(), 4096):
+        if first_output is None:
+            first_output = time.perf_counter() - start
+    process.wait()
+    wall = time.perf_counter() - start
+
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.read().decode())
+    return first_output or wall, wall
+
+
+def server_time(config, tokens):
+    """Time the mock server spends waiting to produce a single answer."""
+    generation = len(tokens) / config.tokens_per_sec if config.tokens_per_sec else 0
+    return config.ttft + generation
+
+
+def expected_requests(scenario, config):
+    if scenario == "plugins":
+        code = SCENARIOS[scenario][0][1]
+        return [
+            answer_tokens([{"content": code}], config),
+            answer_tokens([{"content": "RESULT:"}], config),
+        ]
+    return [answer_tokens([{"content": ""}], config)]
+
+
+def bench_scenario(scenario, config, env, repeat):
+    ttfts = []
+    overheads = []
+    walls = []
+    requests = expected_requests(scenario, config)
+    tokens = sum(len(request) for request in requests)
+    waiting = sum(server_time(config, request) for request in requests)
+
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as cwd:
+            run_chatcli(["init"], "", env, cwd)
+            *setup, (args, stdin) = SCENARIOS[scenario]
+            for setup_args, setup_stdin in setup:
+                run_chatcli(setup_args, setup_stdin, env, cwd)
+            ttft, wall = run_chatcli(args, stdin, env, cwd)
+
+        ttfts.append(ttft)
+        walls.append(wall)
+        overheads.append((wall - waiting) / tokens)
+
+    return {
+        "scenario": scenario,
+        "ttft": statistics.median(ttfts),
+        "overhead_per_token": statistics.median(overheads),
+        "wall": statistics.median(walls),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--scenario", choices=SCENARIOS, action="append", help="Default: all."
+    )
+    add_config_arguments(parser)
+    args = parser.parse_args(argv)
+
+    config = config_from_args(args)
+    server = start_server(config)
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": base_url(server),
+        "OPENAI_API_KEY": "mock",
+        "CHATCLI_DAEMON": "0",
+        "PYTHONPATH": os.pathsep.join(
+            filter(None, [str(Path(__file__).parents[1]), os.environ.get("PYTHONPATH")])
+        ),
+    }
+
+    print(
+        f"{'scenario':10} {'ttft (ms)':>10} {'overhead/token (ms)':>20} {'wall (ms)':>10}"
+    )
+    for scenario in args.scenario or SCENARIOS:
+        result = bench_scenario(scenario, config, env, args.repeat)
+        print(
+            f"{result['scenario']:10}"
+            f" {result['ttft'] * 1000:10.1f}"
+            f" {result['overhead_per_token'] * 1000:20.3f}"
+            f" {result['wall'] * 1000:10.1f}"
+        )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import os
+from pathlib import Path
+import pytest
+from click.testing import CliRunner
+import chatcli_gpt.models
+from chatcli_gpt.cli import cli
+
+from .generate_log import write_log
+
+pytest.importorskip("pytest_benchmark")
+
+BENCH_ENTRIES = [
+    int(size) for size in os.environ.get("CHATCLI_BENCH_ENTRIES", "10000").split(",")
+]
+
+
+@pytest.fixture(scope="session", params=BENCH_ENTRIES, ids=lambda size: f"{size}")
+def large_log(request, tmp_path_factory):
+    path = tmp_path_factory.mktemp("logs") / f"{request.param}.chatcli.log"
+    write_log(path, request.param)
+    return path
+
+
+@pytest.fixture()
+def chatcli(large_log, tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        chatcli_gpt.models, "MODEL_CACHE", Path(tmp_path / "models.json")
+    )
+    runner = CliRunner()
+
+    def chatcli(*args):
+        result = runner.invoke(
+            cli, [*args, "--log-file", str(large_log)], catch_exceptions=False
+        )
+        assert result.exit_code == 0, result.output
+        return result
+
+    return chatcli
@@ -0,0 +1,171 @@
+"""Generate a large, realistic chatcli log for benchmarking.
+
+    python -m benchmarks.generate_log --entries 100000 big.chatcli.log
+
+Entries use the current (0.4) log format. The generated history mixes the
+patterns a real log accumulates: new conversations started from
+personalities, long threads continued over many turns, retries, tags, and
+usage and completion blobs on every answer. Memory use is bounded by the
+number of open threads, not the size of the log.
+"""
+import json
+import random
+import argparse
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+
+LOG_FILE_VERSION = "0.4"
+
+PERSONALITIES = {
+    "default": "You are a helpful, expert linux user and programmer.",
+    "code": "You only answer questions with a single example code block.",
+    "commit": "You generate commit messages from diffs.",
+    "pyeval": "You can evaluate code by returning it in an EVALUATE block.",
+}
+PLUGINS = {"pyeval": ["pyeval"]}
+MODELS = ["gpt-3.5-turbo-1106", "gpt-4-1106-preview", "gpt-4", "gpt-3.5-turbo"]
+TAGS = [f"project-{idx}" for idx in range(50)]
+WORDS = (
+    "the a python linux file process memory thread log error function class"
+    " list dict string network socket request response server client model"
+    " token cache index query database commit branch merge test benchmark"
+).split()
+
+# How many conversations are being extended at any one time.
+OPEN_THREADS = 200
+# Every snapshot repeats the whole thread, so cap the length of threads.
+MAX_THREAD_MESSAGES = 40
+
+
+def sentence(rng, min_words=5, max_words=40):
+    return " ".join(rng.choices(WORDS, k=rng.randint(min_words, max_words)))
+
+
+def paragraph(rng):
+    return "\n".join(sentence(rng) for _ in range(rng.randint(1, 12)))
+
+
+def answer(rng):
+    text = paragraph(rng)
+    if rng.random() < 0.3:
+        text += "\n```python\n" + paragraph(rng) + "\n```\n"
+    return text
+
+
+def entry(rng, messages, tags, plugins, model, timestamp, answered):
+    completion = usage = None
+    if answered:
+        prompt_tokens = sum(len(m["content"].split()) for m in messages[:-1])
+        completion_tokens = len(messages[-1]["content"].split())
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        completion = {
+            "id": f"chatcmpl-{rng.getrandbits(64):x}",
+            "created": int(timestamp.timestamp()),
+            "model": model + "-0613" if model in ("gpt-4", "gpt-3.5-turbo") else model,
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": messages[-1],
+                }
+            ],
+            "usage": usage,
+        }
+    return {
+        "messages": messages,
+        "completion": completion,
+        "usage": usage,
+        "tags": tags,
+        "timestamp": timestamp.isoformat(),
+        "plugins": plugins,
+        "model": model,
+    }
+
+
+def generate_entries(entries, seed=0, start=None):
+    rng = random.Random(seed)
+    timestamp = start or datetime(2023, 1, 1, tzinfo=timezone.utc)
+    threads = []
+
+    for name, prompt in PERSONALITIES.items():
+        messages = [{"role": "system", "content": prompt}]
+        yield entry(
+            rng, messages, ["^" + name], PLUGINS.get(name, []), None, timestamp, False
+        )
+
+    for _ in range(entries - len(PERSONALITIES)):
+        timestamp += timedelta(seconds=rng.expovariate(1 / 600))
+        roll = rng.random()
+
+        if not threads or roll < 0.25:
+            personality = rng.choice(list(PERSONALITIES))
+            thread = {
+                "messages": [{"role": "system", "content": PERSONALITIES[personality]}],
+                "tags": [],
+                "plugins": PLUGINS.get(personality, []),
+                "model": rng.choice(MODELS),
+            }
+            threads.append(thread)
+            if len(threads) > OPEN_THREADS:
+                threads.pop(rng.randrange(len(threads)))
+        else:
+            # Recent threads are the most likely to be continued.
+            thread = threads[-1 - min(int(rng.expovariate(0.2)), len(threads) - 1)]
+
+        messages = thread["messages"]
+        if roll > 0.95 and len(messages) > 2:
+            # Retry: replace the last answer.
+            messages = messages[:-1]
+        elif roll > 0.9:
+            thread["tags"] = [rng.choice(TAGS)]
+            yield entry(
+                rng,
+                list(messages),
+                list(thread["tags"]),
+                thread["plugins"],
+                thread["model"],
+                timestamp,
+                False,
+            )
+            continue
+        else:
+            messages = [*messages, {"role": "user", "content": sentence(rng)}]
+
+        messages = [*messages, {"role": "assistant", "content": answer(rng)}]
+        thread["messages"] = messages
+        if len(messages) >= MAX_THREAD_MESSAGES:
+            threads.remove(thread)
+        yield entry(
+            rng,
+            messages,
+            list(thread["tags"]),
+            thread["plugins"],
+            thread["model"],
+            timestamp,
+            True,
+        )
+
+
+def write_log(path, entries, seed=0):
+    with Path(path).open("w", encoding="utf-8") as fh:
+        fh.write(json.dumps({"version": LOG_FILE_VERSION}) + "\n")
+        for item in generate_entries(entries, seed):
+            fh.write(json.dumps(item) + "\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--entries", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    write_log(args.output, args.entries, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""A local OpenAI compatible server for benchmarking chatcli.
+
+Answers are generated at a fixed rate so the cost of chatcli itself can be
+separated from the cost of the model:
+
+    python -m benchmarks.mock_openai --port 8000 --ttft 0.2 --tokens-per-sec 50
+
+then point chatcli at it with `OPENAI_BASE_URL=http://127.0.0.1:8000/v1`.
+
+If the last message asks to "evaluate: <code>" the answer is an EVALUATE block,
+so the pyeval plugin loop can be exercised too.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+@dataclass
+class MockConfig:
+    ttft: float = 0.0
+    tokens_per_sec: float = 0.0
+    tokens: int = 100
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    seed: int | None = None
+
+
+def answer_tokens(messages, config):
+    question = messages[-1]["content"] if messages else ""
+    if question.startswith("evaluate: "):
+        code = question.removeprefix("evaluate: ")
+        return ["EVALUATE:\n", "```python\n", code, "\n```\n"]
+    if question.startswith("RESULT:"):
+        return ["The", " answer", " is", " above."]
+    return ["token" if idx == 0 else " token" for idx in range(config.tokens)]
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = MockConfig()
+    random = random.Random()
+
+    def log_message(self, *_args):
+        pass
+
+    def do_GET(self):  # noqa: N802
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(
+                200,
+                {
+                    "object": "list",
+                    "data": [
+                        {"id": "mock-model", "object": "model", "owned_by": "mock"}
+                    ],
+                },
+            )
+        else:
+            self.send_json(404, {"error": {"message": "Not found"}})
+
+    def do_POST(self):  # noqa: N802
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+
+        if self.random.random() < self.config.rate_limit_rate:
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limited", "type": "rate_limit"}},
+                headers={"retry-after-ms": "10"},
+            )
+            return
+        if self.random.random() < self.config.error_rate:
+            self.send_json(500, {"error": {"message": "Injected error"}})
+            return
+
+        tokens = answer_tokens(body["messages"], self.config)
+        if body.get("stream"):
+            self.stream_answer(body["model"], tokens)
+        else:
+            self.wait_for_tokens(len(tokens))
+            self.send_json(200, completion(body["model"], tokens))
+
+    def wait_for_tokens(self, count):
+        time.sleep(self.config.ttft)
+        if self.config.tokens_per_sec:
+            time.sleep(count / self.config.tokens_per_sec)
+
+    def stream_answer(self, model, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        time.sleep(self.config.ttft)
+        interval = 1 / self.config.tokens_per_sec if self.config.tokens_per_sec else 0
+        for token in tokens:
+            self.send_chunk(json.dumps(chunk(model, token)))
+            time.sleep(interval)
+        self.send_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def send_chunk(self, data):
+        event = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.flush()
+
+    def send_json(self, status, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def chunk(model, token):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "delta": {"role": "assistant", "content": token},
+                "finish_reason": None,
+            }
+        ],
+    }
+
+
+def completion(model, tokens):
+    return {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(tokens)},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {
+            "prompt_tokens": 10,
+            "completion_tokens": len(tokens),
+            "total_tokens": 10 + len(tokens),
+        },
+    }
+
+
+def start_server(config, host="127.0.0.1", port=0):
+    """Start the mock server in a background thread and return it."""
+    handler = type("Handler", (MockOpenAIHandler,), {"config": config})
+    handler.random = random.Random(config.seed)
+    server = ThreadingHTTPServer((host, port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    add_config_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def add_config_arguments(parser):
+    parser.add_argument(
+        "--ttft", type=float, default=0.0, help="Seconds to first token."
+    )
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0)
+    parser.add_argument("--tokens", type=int, default=100, help="Tokens per answer.")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int)
+
+
+def config_from_args(args):
+    return MockConfig(
+        ttft=args.ttft,
+        tokens_per_sec=args.tokens_per_sec,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = start_server(config_from_args(args), args.host, args.port)
+    print(f"Serving on {base_url(server)}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Time log commands, and record their peak memory, against large logs.
+
+    pytest benchmarks
+    CHATCLI_BENCH_ENTRIES=10000,100000 pytest benchmarks
+"""
+import shutil
+import tracemalloc
+import pytest
+
+COMMANDS = {
+    "log": ["log"],
+    "log-limit": ["log", "--limit", "20"],
+    "show": ["show", "3"],
+    "tags": ["tags"],
+    "personalities": ["personalities"],
+    "usage": ["usage"],
+    "search": ["log", "--search", "socket"],
+    "tag": ["log", "--tag", "project-7"],
+}
+
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize("command", COMMANDS.values(), ids=COMMANDS.keys())
+def test_command(benchmark, chatcli, command):
+    benchmark.extra_info["peak_memory_mb"] = (
+        peak_memory(lambda: chatcli(*command)) / 2**20
+    )
+    benchmark(chatcli, *command)
+
+
+def test_merge(benchmark, chatcli, large_log, tmp_path):
+    # merge appends to the log, so give every round a fresh copy.
+    def setup():
+        shutil.copyfile(large_log.with_suffix(".orig"), large_log)
+
+    shutil.copyfile(large_log, large_log.with_suffix(".orig"))
+    benchmark.extra_info["peak_memory_mb"] = (
+        peak_memory(lambda: chatcli("merge", "1", "2", "3")) / 2**20
+    )
+    try:
+        benchmark.pedantic(
+            chatcli, args=("merge", "1", "2", "3"), setup=setup, rounds=5
+        )
+    finally:
+        setup()
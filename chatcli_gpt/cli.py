@@ -2,11 +2,12 @@ import os
 import sys
 import itertools
 import functools
+import threading
 import asyncio
 from datetime import datetime, timezone
-import dateutil.parser
 from pathlib import Path
 import click
+from click.shell_completion import CompletionItem
 from click_default_group import DefaultGroup
 import prompt_toolkit
 
@@ -16,42 +17,62 @@ from .log import (
     conversation_log,
     create_initial_log,
     find_log,
+    is_sqlite_log,
+    metrics_log,
+    recall_answers,
+    thread_parents,
+    migrate_log,
+    needs_upgrade,
+    upgrade_log,
+    usage_log,
+    OutdatedLogError,
 )
-from .conversation import Conversation, is_personality
+from .conversation import Conversation, handle_sigint, is_personality, message_text
+from .query import Query, QueryError
 from . import models
-
-from .models import get_models
+from .client import SOCKET_PATH
+from .daemon import current_session
+from .render import answer_renderer
+from .trace import profiling, span
+from . import threads
 
 MESSAGE_COLORS = {
     "user": (186, 85, 211),
     "system": (100, 150, 200),
     "assistant": None,
+    "tool": (200, 180, 90),
 }
 
 DEFAULT_MODEL = "gpt-3.5-turbo-1106"
 
 
 class PartialChoice(click.types.ParamType):
-    def __init__(self, name, get_choices, fail_message, **kwargs):
+    def __init__(self, name, get_registry, fail_message, **kwargs):
         self.name = name
-        self._get_choices = get_choices
+        self._get_registry = get_registry
         self.fail_message = fail_message
         super().__init__(**kwargs)
 
     @property
     def choices(self):
-        return self._get_choices()
+        return self._get_registry().ids
 
     def convert(self, value, param, ctx):
-        for choice in self.choices:
-            if value in choice:
-                return choice
+        choice = self._get_registry().find(value)
+        if choice is not None:
+            return choice
         return self.fail(value + "\n" + self.fail_message, param, ctx)
 
+    def shell_complete(self, ctx, param, incomplete):
+        return [
+            CompletionItem(choice)
+            for choice in self._get_registry().with_prefix(incomplete)
+        ]
+
 
 MODEL_CHOICE = PartialChoice(
     name="MODEL",
-    get_choices=lambda: [model["id"] for model in get_models()],
+    get_registry=models.registry,
     fail_message="Run `chatcli models list` to see available models.",
 )
 
@@ -74,37 +95,110 @@ log_file_option = click.option(
 )
 
 
+def local_time(_ctx, _param, value):
+    return value and value.astimezone()
+
+
+since_option = click.option(
+    "--since",
+    type=click.DateTime(),
+    callback=local_time,
+    help="Only include entries from this time.",
+)
+until_option = click.option(
+    "--until",
+    type=click.DateTime(),
+    callback=local_time,
+    help="Only include entries before this time.",
+)
+
+
+_idle_loops = []
+_idle_loops_lock = threading.Lock()
+_thread_loop = threading.local()
+
+
+def event_loop():
+    """Return the calling thread's event loop.
+
+    Loops live as long as the process, so pooled connections survive from
+    one request to the next. Each thread running a command (several at once
+    in the daemon) has its own, taken from the idle loops and given back by
+    release_event_loop.
+    """
+    loop = getattr(_thread_loop, "loop", None)
+    if loop is None:
+        with _idle_loops_lock:
+            loop = _idle_loops.pop() if _idle_loops else asyncio.new_event_loop()
+        _thread_loop.loop = loop
+    return loop
+
+
+def release_event_loop():
+    loop = getattr(_thread_loop, "loop", None)
+    if loop is not None:
+        _thread_loop.loop = None
+        with _idle_loops_lock:
+            _idle_loops.append(loop)
+
+
 def coro(f):
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        return asyncio.run(f(*args, **kwargs))
+        return event_loop().run_until_complete(f(*args, **kwargs))
 
     return wrapper
 
 
+def stdin_isatty():
+    session = current_session()
+    if session:
+        return session.stdin_isatty
+    return os.isatty(0)
+
+
 @click.group(cls=DefaultGroup, default="chat", default_if_no_args=True)
 @click.version_option()
-def cli():
-    pass
+@click.option("--profile", is_flag=True, help="Show where the time went when finished.")
+@click.pass_context
+def cli(ctx, profile):
+    if profile:
+        ctx.with_resource(profiling(lambda report: click.echo(report, err=True)))
+
+
+QUERY_HELP = (
+    "Select by query, such as 'model:gpt-4* tag:work since:2024-01 cost>0.10"
+    ' "a phrase"\'.'
+)
 
 
 def select_conversation(command):
     @click.argument("offset", type=int, required=False)
     @click.option("-s", "--search", help="Select by search term")
     @click.option("-t", "--tag", help="Select by tag")
+    @click.option("--query", "query_text", help=QUERY_HELP)
     @log_file_option
     @functools.wraps(command)
-    def wrapper(*args, log_file=None, offset=None, search=None, tag=None, **kwargs):
+    def wrapper(
+        *args,
+        log_file=None,
+        offset=None,
+        search=None,
+        tag=None,
+        query_text=None,
+        **kwargs,
+    ):
         if (kwargs.get("continue_conversation") or kwargs.get("retry")) and not offset:
             offset = 1
-        if kwargs.get("select_personality") and not (tag or search or offset):
+        selected = tag or search or query_text or offset
+        if kwargs.get("select_personality") and not selected:
             tag = "^" + kwargs["select_personality"]
         kwargs.pop("select_personality", None)
-        if kwargs.get("new") and not (tag or search or offset):
+        if kwargs.get("new") and not selected:
             conversation = Conversation({})
         else:
             conversation = get_logged_conversation(
-                log_file, offset=offset, search=search, tag=tag
+                log_file, offset=offset, query=parse_query(query_text, search, tag)
             )
         return command(
             *args,
@@ -120,17 +214,31 @@ def filter_conversations(command):
     @click.argument("offsets", type=int, nargs=-1)
     @click.option("-s", "--search", help="Select by search term")
     @click.option("-t", "--tag", help="Select by tag")
+    @click.option("--query", "query_text", help=QUERY_HELP)
+    @since_option
+    @until_option
     @log_file_option
     @functools.wraps(command)
-    def wrapper(*args, log_file=None, offsets=None, search=None, tag=None, **kwargs):
-        if kwargs.get("select_personality") and not (tag or search):
+    def wrapper(
+        *args,
+        log_file=None,
+        offsets=None,
+        search=None,
+        tag=None,
+        query_text=None,
+        since=None,
+        until=None,
+        **kwargs,
+    ):
+        if kwargs.get("select_personality") and not (tag or search or query_text):
             tag = "^" + kwargs["select_personality"]
         kwargs.pop("select_personality", None)
+        query = parse_query(query_text, search, tag)
+        query.since = max(filter(None, [query.since, since]), default=None)
+        query.until = min(filter(None, [query.until, until]), default=None)
         return command(
             *args,
-            conversations=search_conversations(
-                log_file, offsets=offsets, search=search, tag=tag
-            ),
+            conversations=search_conversations(log_file, offsets, query),
             log_file=log_file,
             **kwargs,
         )
@@ -138,6 +246,19 @@ def filter_conversations(command):
     return wrapper
 
 
+def parse_query(text, search=None, tag=None):
+    """Parse a --query, adding the --search and --tag options to it."""
+    try:
+        query = Query.parse(text)
+    except QueryError as error:
+        raise click.BadParameter(str(error), param_hint="--query") from None
+    if search:
+        query.phrases.append(search)
+    if tag:
+        query.tags.append(tag)
+    return query
+
+
 @cli.command(help="Ask a question of ChatGPT.")
 @click.option(
     "-q", "--quick", is_flag=True, help="Just handle a one single-line question."
@@ -159,40 +280,55 @@ def filter_conversations(command):
 @click.option(
     "-f",
     "--file",
-    type=click.Path(exists=True),
     multiple=True,
-    help="Add a file to the conversation for context.",
+    help="Add a file, directory or glob of files to the conversation for context.",
+)
+@click.option(
+    "--file-tokens",
+    type=int,
+    help="Token budget for --file (default: half the model's context length).",
 )
 @click.option("-r", "--retry", is_flag=True, help="Retry previous question")
 @click.option("--stream/--sync", default=True, help="Stream or sync mode.")
+@click.option(
+    "--markdown/--plain",
+    default=False,
+    help="Render answers as Markdown when writing to a terminal.",
+)
 @click.option(
     "-m",
     "--model",
     type=MODEL_CHOICE,
     help="Model to use. Run `chatcli models list` to see available models.",
 )
+@click.option(
+    "--recall",
+    type=int,
+    default=0,
+    help="Add the most relevant N answers from the log to each question.",
+)
 @click.option("--plugin", "additional_plugins", multiple=True, help="Load a plugin.")
 @select_conversation
 def chat(log_file, conversation, **kwargs):
     conversation = conversation.clone()
+    conversation.model = kwargs["model"] or conversation.model or DEFAULT_MODEL
 
-    for filename in kwargs["file"]:
-        with Path(filename).open(encoding="utf-8") as fh:
-            file_contents = fh.read()
-
-        conversation.append(
-            "user", f"The file {filename!r} contains:\n```\n{file_contents}```"
-        )
+    if kwargs["file"]:
+        add_files(conversation, kwargs["file"], kwargs["file_tokens"])
 
     conversation.plugins.extend(kwargs["additional_plugins"])
-    conversation.model = kwargs["model"] or conversation.model or DEFAULT_MODEL
 
-    quick = kwargs["quick"] or not os.isatty(0)
+    quick = kwargs["quick"] or not stdin_isatty()
     multiline = not quick
 
     if kwargs["retry"]:
         conversation.messages.pop()
-        add_answer(log_file, conversation, stream=kwargs["stream"])
+        add_answer(
+            log_file,
+            conversation,
+            stream=kwargs["stream"],
+            markdown=kwargs["markdown"],
+        )
         if kwargs["quick"]:
             return
 
@@ -202,9 +338,33 @@ def chat(log_file, conversation, **kwargs):
         multiline=multiline,
         quick=quick,
         stream=kwargs["stream"],
+        markdown=kwargs["markdown"],
+        recall=kwargs["recall"],
     )
 
 
+def add_files(conversation, patterns, max_tokens):
+    from . import files
+
+    try:
+        contents, skipped = files.collect_files(
+            patterns, conversation.model, max_tokens
+        )
+    except ValueError as error:
+        raise click.BadParameter(str(error), param_hint="'-f' / '--file'") from error
+
+    for name, reason in skipped:
+        click.echo(f"Skipped {name}: {reason}", file=sys.stderr)
+    for file in contents:
+        if file.truncated:
+            click.echo(
+                f"Truncated {file.name} to fit the token budget.", file=sys.stderr
+            )
+        conversation.append(
+            "user", f"The file {file.name!r} contains:\n```\n{file.text}```"
+        )
+
+
 @cli.command(help="Create initial conversation log.")
 @click.option(
     "-r",
@@ -247,7 +407,7 @@ def add(log_file, conversation, personality, role, multiline, **kwargs):
     if personality:
         conversation.tags.append("^" + personality)
 
-    if multiline and os.isatty(0):
+    if multiline and stdin_isatty():
         click.echo("(Finish input with <Alt-Enter> or <Esc><Enter>)")
     content = prompt(multiline=True)
     conversation.append(role, content)
@@ -322,10 +482,12 @@ def merge(log_file, conversations, personality):
 
 
 @cli.command(help="List tags.", name="tags")
+@since_option
+@until_option
 @log_file_option
-def list_tags(log_file=None):
+def list_tags(since, until, log_file=None):
     tags = set()
-    for conversation in conversation_log(log_file):
+    for conversation in conversation_log(log_file, since, until):
         tags |= set(conversation.tags)
     for tag in sorted(tags):
         click.echo(tag)
@@ -394,7 +556,9 @@ def show(long, conversation, format_json, **_kwargs):
         if message["role"] == "user":
             prefix = ">> "
         click.echo(
-            click.style(prefix + message["content"], fg=MESSAGE_COLORS[message["role"]])
+            click.style(
+                prefix + message_text(message), fg=MESSAGE_COLORS[message["role"]]
+            )
         )
 
 
@@ -411,21 +575,29 @@ def show(long, conversation, format_json, **_kwargs):
 @click.option("--cost", is_flag=True, help="Show token cost")
 @click.option("--plugins", is_flag=True, help="Show enabled plugins")
 @click.option("-m", "--model", is_flag=True, help="Show model")
+@click.option(
+    "--threads",
+    "thread_heads",
+    is_flag=True,
+    help="Only show the latest entry of each thread.",
+)
 @click.option(
     "--json", "format_json", is_flag=True, help="Output conversation in JSON format."
 )
-def log(conversations, limit, format_json, **kwargs):
+def log(conversations, limit, format_json, thread_heads, log_file, **kwargs):
+    if thread_heads:
+        parents = thread_parents(log_file)
+        heads = threads.heads(parents)
+        conversations = (
+            (offset, conversation)
+            for offset, conversation in conversations
+            if len(parents) - offset + 1 in heads
+        )
     for offset, conversation in reversed(list(itertools.islice(conversations, limit))):
         if format_json:
             click.echo(conversation.to_json())
             continue
-        try:
-            question = conversation.find(
-                lambda message: message["role"] != "assistant"
-            )["content"]
-        except ValueError:
-            question = conversation.messages[-1]["content"]
-        trimmed_message = question.strip().split("\n", 1)[0][:80]
+        trimmed_message = conversation_summary(conversation)
 
         fields = []
         fields.append(click.style(f"{offset: 4d}:", fg="blue"))
@@ -452,28 +624,136 @@ def log(conversations, limit, format_json, **kwargs):
         click.echo(" ".join(fields))
 
 
+def conversation_summary(conversation):
+    try:
+        question = conversation.find(lambda message: message["role"] != "assistant")[
+            "content"
+        ]
+    except ValueError:
+        question = conversation.messages[-1]["content"]
+    return question.strip().split("\n", 1)[0][:80]
+
+
+@cli.command(help="Show how conversations branched.")
+@click.argument("offset", type=int, required=False)
+@click.option(
+    "--limit", "-l", type=int, default=10, help="Number of conversations to show."
+)
+@log_file_option
+def tree(offset, limit, log_file):
+    conversations = conversation_log(log_file)
+    parents = thread_parents(log_file)
+    children = threads.children(parents)
+
+    def is_personality_entry(entry_id):
+        tags = conversations[entry_id - 1].tags
+        return bool(tags) and is_personality(tags[-1])
+
+    def root(entry_id):
+        # Conversations started from the same personality share its entry as
+        # their parent; stop below it so each conversation is its own tree.
+        while (parent := parents[entry_id - 1]) and not is_personality_entry(parent):
+            entry_id = parent
+        return entry_id
+
+    if offset:
+        if not 0 < offset <= len(conversations):
+            click.echo("Matching conversation not found", file=sys.stderr)
+            sys.exit(1)
+        roots = [root(len(conversations) - offset + 1)]
+    else:
+        roots = []
+        for entry_id in sorted(threads.heads(parents), reverse=True):
+            if not is_personality_entry(entry_id):
+                entry_root = root(entry_id)
+                if entry_root not in roots:
+                    roots.append(entry_root)
+            if len(roots) == limit:
+                break
+        roots.reverse()
+
+    for entry_id in roots:
+        show_thread(entry_id, conversations, children)
+
+
+def show_thread(entry_id, conversations, children, first_indent="", indent=""):
+    """Print a thread, indenting only where it branches."""
+    line_indent = first_indent
+    while True:
+        conversation = conversations[entry_id - 1]
+        offset = len(conversations) - entry_id + 1
+        fields = [line_indent + click.style(f"{offset:d}:", fg="blue")]
+        fields.append(conversation_summary(conversation))
+        if conversation.tags:
+            fields.append(click.style(",".join(conversation.tags), fg="green"))
+        click.echo(" ".join(fields))
+        line_indent = indent
+
+        branches = children.get(entry_id, [])
+        if len(branches) != 1:
+            break
+        entry_id = branches[0]
+
+    for idx, branch in enumerate(branches):
+        last = idx == len(branches) - 1
+        show_thread(
+            branch,
+            conversations,
+            children,
+            indent + ("└─ " if last else "├─ "),
+            indent + ("   " if last else "│  "),
+        )
+
+
 cli.add_command(models.models)
 
 
 def run_conversation(
-    log_file, conversation, *, stream=True, multiline=True, quick=False
+    log_file,
+    conversation,
+    *,
+    stream=True,
+    markdown=False,
+    multiline=True,
+    quick=False,
+    recall=0,
 ):
-    if multiline and os.isatty(0):
+    if multiline and stdin_isatty():
         click.echo("(Finish input with <Alt-Enter> or <Esc><Enter>)")
 
     while True:
-        question = prompt(multiline=multiline)
+        with span("prompt"):
+            if stdin_isatty():
+                question = prompt_while_warming(conversation, multiline=multiline)
+            else:
+                question = prompt(multiline=multiline)
         if not question:
             break
+        if recall:
+            with span("recall"):
+                add_recalled_answers(log_file, conversation, question, recall)
         conversation.append("user", question)
-        add_answer(log_file, conversation, stream=stream)
+        add_answer(log_file, conversation, stream=stream, markdown=markdown)
 
         if quick:
             break
 
 
+def add_recalled_answers(log_file, conversation, question, limit):
+    from . import recall
+
+    asked = {m["content"] for m in conversation.messages if m["role"] == "user"}
+    excerpts = recall_answers(log_file, question, limit, exclude=asked)
+    message = recall.recall_message(excerpts, conversation.model)
+    if message:
+        conversation.append("system", message)
+
+
 def prompt(*, multiline=True, **kwargs):
-    if os.isatty(0):
+    session = current_session()
+    if session and session.stdin_isatty:
+        return session.prompt(multiline=multiline, **kwargs)
+    if stdin_isatty():
         try:
             return prompt_toolkit.prompt(
                 ">> ",
@@ -487,72 +767,141 @@ def prompt(*, multiline=True, **kwargs):
         return sys.stdin.read().strip()
 
 
+@coro
+async def prompt_while_warming(conversation, *, multiline=True):
+    """Prompt for a question, getting ready to send it in the meantime."""
+    from .conversation import keep_alive, warm_up
+
+    warming = asyncio.ensure_future(warm_up(conversation.model, conversation.messages))
+    keeping_alive = asyncio.ensure_future(keep_alive(conversation.model))
+    try:
+        return await prompt_async(multiline=multiline)
+    finally:
+        keeping_alive.cancel()
+        # The question goes out straight away. A connection still being
+        # opened wouldn't be shared with the request, so it's dropped.
+        warming.cancel()
+
+
+async def prompt_async(*, multiline=True):
+    session = current_session()
+    if session:
+        return await asyncio.to_thread(session.prompt, multiline=multiline)
+    try:
+        question = await prompt_toolkit.PromptSession().prompt_async(
+            ">> ", multiline=multiline, prompt_continuation=".. "
+        )
+    except EOFError:
+        return None
+    return question.strip()
+
+
 @cli.command(help="Add an answer to a question")
 @click.option("--stream/--sync", default=True, help="Stream or sync mode.")
+@click.option(
+    "--markdown/--plain",
+    default=False,
+    help="Render the answer as Markdown when writing to a terminal.",
+)
 @click.option("-m", "--model", type=MODEL_CHOICE)
 @select_conversation
-def answer(log_file, conversation, stream, **kwargs):
+def answer(log_file, conversation, stream, markdown, **kwargs):
     conversation = conversation.clone(**kwargs)
-    add_answer(log_file, conversation, stream=stream)
+    add_answer(log_file, conversation, stream=stream, markdown=markdown)
 
 
 @coro
-async def add_answer(log_file, conversation, *, stream=True):
+async def add_answer(log_file, conversation, *, stream=True, markdown=False):
     while True:
-        response = await conversation.complete(
-            stream=stream, callback=lambda token: click.echo(token, nl=False)
-        )
-        click.echo()
+        runner = start_plugins(conversation.plugins)
+        with answer_renderer(markdown=markdown) as renderer:
+
+            def on_token(token):
+                renderer.write(token)
+                if runner:
+                    runner.feed(token)
+
+            task = asyncio.ensure_future(
+                conversation.complete(stream=stream, callback=on_token)
+            )
+            # A sync request blocks the event loop, so it can't be cancelled
+            # and Ctrl-C interrupts as usual.
+            with handle_sigint(task, enabled=stream) as sigint:
+                try:
+                    response = await task
+                except asyncio.CancelledError:
+                    # Interrupted before the answer started.
+                    response = None
+        if response is None:
+            click.echo("Cancelled.", err=True)
+            break
+        if sigint.interrupted:
+            # The tool calls won't be run, and a conversation continued with
+            # calls that have no results is refused by the API.
+            conversation.messages[-1].pop("tool_calls", None)
         write_log(
             log_file,
             conversation,
             completion=conversation.completion,
             usage=conversation.usage,
+            metrics=conversation.metrics,
         )
-        from . import plugins
-
-        plugin_response = plugins.evaluate_plugins(
-            response.content, conversation.plugins
-        )
-        if not plugin_response:
+        if sigint.interrupted:
+            if runner:
+                runner.cancel()
+            click.echo("Interrupted: saved the partial answer.", err=True)
+            break
+        if not runner:
+            break
+        tool_calls = conversation.messages[-1].get("tool_calls")
+        with span("plugins"):
+            tool_messages = await runner.call_tools(tool_calls or [])
+            plugin_response = await runner.results(conversation.messages[-1]["content"])
+        for message in tool_messages:
+            click.echo(click.style(message["content"], fg=MESSAGE_COLORS["tool"]))
+        # Tool results must directly follow the calls.
+        conversation.messages.extend(tool_messages)
+        if plugin_response:
+            click.echo(click.style(plugin_response, fg=MESSAGE_COLORS["tool"]))
+            conversation.append("user", plugin_response)
+        elif not tool_messages:
             break
-        click.echo(click.style(plugin_response, fg=(200, 180, 90)))
-        conversation.append("user", plugin_response)
 
 
-def conversation_cost(conversation):
-    usage_costs = {model["id"]: model["pricing"] for model in get_models()}
+def start_plugins(active_plugins):
+    """Return a runner that starts plugins as the answer streams, if any."""
+    if not active_plugins:
+        return None
+    from . import plugins
+
+    for name in active_plugins:
+        if not plugins.get_plugin(name):
+            click.echo(f"Unknown plugin: {name}", err=True)
+    return plugins.PluginRunner(active_plugins, output=show_plugin_output)
+
+
+def show_plugin_output(text):
+    click.echo(click.style(text, dim=True), nl=False, err=True)
+
 
+def conversation_cost(conversation):
     if not conversation.usage:
         return 0
-    model = conversation.completion["model"]
-    model_price = (
-        usage_costs.get(model)
-        or usage_costs.get("-".join(model.split("-")[:-1]))
-        or usage_costs["openrouter/" + model]
-    )
-
-    usage = conversation.usage
-    return (
-        float(model_price["prompt"]) * usage["prompt_tokens"]
-        + float(model_price["completion"]) * usage["completion_tokens"]
-    )
+    return models.usage_cost(conversation.completion["model"], conversation.usage)
 
 
 @cli.command(help="Display number of tokens and token cost.", name="usage")
 @click.option("--today", is_flag=True, help="Show usage for today only.")
+@since_option
+@until_option
 @log_file_option
-def show_usage(today, log_file):
-    conversations = conversation_log(log_file)
-
-    def is_today(conversation):
-        return (
-            dateutil.parser.parse(conversation.timestamp).date()
-            == datetime.now(tz=timezone.utc).date()
-        )
-
+def show_usage(today, since, until, log_file):
     if today:
-        conversations = [c for c in conversations if is_today(c)]
+        midnight = datetime.now(tz=timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        since = max(filter(None, [since, midnight]))
+    conversations = usage_log(log_file, since, until)
     tokens = sum(
         conversation.usage["total_tokens"]
         for conversation in conversations
@@ -564,21 +913,178 @@ def show_usage(today, log_file):
     click.echo(f"Cost: ${total_cost:.2f}")
 
 
-def get_logged_conversation(log_path, offset, search=None, tag=None):
+PERCENTILES = (50, 90, 99)
+REQUEST_METRICS = (
+    ("ttft", "ttft (s)"),
+    ("duration", "duration (s)"),
+    ("tokens_per_sec", "tokens/sec"),
+)
+
+
+@cli.command(help="Show request latency and throughput by model and provider.")
+@since_option
+@until_option
+@log_file_option
+def stats(since, until, log_file):
+    conversations = metrics_log(log_file, since, until)
+    if not conversations:
+        click.echo("No request metrics recorded.")
+        return
+
+    for heading, key in (
+        ("model", lambda c: c.model or "unknown"),
+        ("provider", lambda c: models.provider(c.model or "")),
+    ):
+        click.echo(click.style(f"By {heading}:", bold=True))
+        groups = itertools.groupby(sorted(conversations, key=key), key=key)
+        for name, group in groups:
+            show_request_metrics(name, [c.metrics for c in group])
+
+
+def show_request_metrics(name, metrics):
+    retries = sum(m.get("retries") or 0 for m in metrics)
+    click.echo(f"  {name} ({len(metrics)} requests, {retries} retries)")
+    click.echo(" " * 18 + "".join(f"{'p' + str(p):>9}" for p in PERCENTILES))
+    for key, label in REQUEST_METRICS:
+        values = sorted(m[key] for m in metrics if m.get(key) is not None)
+        cells = (
+            f"{percentile(values, p):9.2f}" if values else f"{'-':>9}"
+            for p in PERCENTILES
+        )
+        click.echo(f"    {label:14}" + "".join(cells))
+
+
+def percentile(values, percent):
+    """Linearly interpolated percentile of sorted values."""
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@cli.command(
+    help="Upgrade an old conversation log, or copy it into a different storage format."
+)
+@click.option(
+    "--to",
+    "log_format",
+    type=click.Choice(["sqlite", "jsonl"]),
+    help="Storage format to convert to.",
+)
+@click.option(
+    "-o",
+    "--output",
+    type=click.Path(path_type=Path),
+    help="Path of the new log file.",
+)
+@log_file_option
+def migrate(log_format, output, log_file):
+    if needs_upgrade(log_file):
+        with click.progressbar(
+            length=log_file.stat().st_size,
+            label="Upgrading log file",
+            file=sys.stderr,
+        ) as progress:
+            backup_file = upgrade_log(log_file, progress.update)
+        click.echo(f"Upgraded log file. Backup saved in: {backup_file}")
+    elif not log_format:
+        click.echo("Log file is up to date.")
+
+    if not log_format:
+        return
+
+    if is_sqlite_log(log_file) == (log_format == "sqlite"):
+        click.echo(f"{log_file} is already a {log_format} log.", file=sys.stderr)
+        sys.exit(1)
+
+    output = output or log_file.with_suffix(".db" if log_format == "sqlite" else ".log")
+    if is_sqlite_log(output) != (log_format == "sqlite"):
+        click.echo(f"{output}: Not a {log_format} file name.", file=sys.stderr)
+        sys.exit(1)
+    if output.exists():
+        click.echo(f"{output}: File already exists.", file=sys.stderr)
+        sys.exit(1)
+
+    migrate_log(log_file, output)
+    click.echo(f"Migrated log to: {output}")
+
+
+@cli.command(
+    help="Answer a question about input from stdin that is too large for the model."
+)
+@click.argument("question")
+@click.option("-m", "--model", type=MODEL_CHOICE, default=DEFAULT_MODEL)
+@click.option(
+    "--chunk-tokens",
+    type=int,
+    help="Tokens of input per request (default: half the model's context length).",
+)
+@click.option(
+    "-j",
+    "--concurrency",
+    type=int,
+    default=4,
+    show_default=True,
+    help="Number of requests to run at once.",
+)
+@log_file_option
+@coro
+async def mapreduce(question, model, chunk_tokens, concurrency, log_file):
+    from .files import token_budget
+    from .mapreduce import MapReduce
+
+    run = MapReduce(
+        log_file,
+        question,
+        model,
+        chunk_tokens=chunk_tokens or token_budget(model),
+        concurrency=concurrency,
+    )
+    if run.logged:
+        click.echo(f"Resuming with {len(run.logged)} logged answers.", file=sys.stderr)
+    await run.run(sys.stdin, callback=lambda token: click.echo(token, nl=False))
+    click.echo()
+
+
+def get_logged_conversation(log_path, offset, query=None):
     offsets = [offset] if offset else []
     try:
-        return next(search_conversations(log_path, offsets, search, tag))[1]
+        return next(search_conversations(log_path, offsets, query))[1]
     except StopIteration:
         click.echo("Matching conversation not found", file=sys.stderr)
         sys.exit(1)
 
 
-def main():
+@cli.command(help="Run a background server that keeps chatcli warm.")
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(path_type=Path),
+    default=SOCKET_PATH,
+    show_default=True,
+    help="Unix socket to listen on.",
+)
+def serve(socket_path):
+    from . import daemon
+
+    click.echo(f"Listening on {socket_path}", file=sys.stderr)
     try:
-        cli()
+        daemon.serve(socket_path)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(args=None):
+    try:
+        cli(args)
     except FileNotFoundError as error:
         click.echo(f"{error}: Chatcli not initialized. Run `chatcli init` first.")
         sys.exit(1)
+    except OutdatedLogError as error:
+        click.echo(
+            f"{error}: Log file format is outdated. Run `chatcli migrate` first."
+        )
+        sys.exit(1)
 
 
 if __name__ == "__main__":
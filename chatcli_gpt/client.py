@@ -0,0 +1,154 @@
+"""Thin entry point that hands commands to a running `chatcli serve` daemon.
+
+This module is imported on every invocation, so it only uses the standard
+library. If no daemon is listening, or the daemon can't run the command as
+this process would, the command runs in-process as usual.
+"""
+import os
+import sys
+import json
+import hashlib
+import signal
+import socket
+import contextlib
+from pathlib import Path
+
+SOCKET_PATH = Path(
+    os.environ.get("CHATCLI_SOCKET", Path.home() / ".chatcli.sock")
+).expanduser()
+
+
+def main():
+    argv = sys.argv[1:]
+    if daemon_enabled(argv):
+        exit_code = forward(argv)
+        if exit_code is not None:
+            sys.exit(exit_code)
+
+    from .cli import main as run_in_process
+
+    run_in_process()
+
+
+# Commands read their settings from these environment variables, many of
+# them when they are imported, so the daemon only runs commands for clients
+# with the same settings as its own.
+SETTINGS_PREFIXES = ("CHATCLI_", "OPENAI_", "OPENROUTER_", "WOLFRAM_ALPHA_")
+# Used by the client alone.
+CLIENT_SETTINGS = ("CHATCLI_DAEMON", "CHATCLI_SOCKET")
+
+
+def daemon_enabled(argv):
+    return argv[:1] != ["serve"] and os.environ.get("CHATCLI_DAEMON", "1") != "0"
+
+
+def settings_digest(environ=None):
+    environ = os.environ if environ is None else environ
+    settings = sorted(
+        (name, value)
+        for name, value in environ.items()
+        if name.startswith(SETTINGS_PREFIXES) and name not in CLIENT_SETTINGS
+    )
+    return hashlib.sha256(json.dumps(settings).encode("utf-8")).hexdigest()
+
+
+def connect(socket_path=SOCKET_PATH):
+    if not socket_path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(socket_path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def forward(argv, socket_path=SOCKET_PATH):
+    """Run a command in the daemon, returning its exit code.
+
+    Returns None if there is no daemon to forward to, or if the command must
+    run in-process.
+    """
+    sock = connect(socket_path)
+    if sock is None:
+        return None
+
+    stdin_isatty = os.isatty(0)
+    with sock, sock.makefile("rw", encoding="utf-8") as channel:
+        send(
+            channel,
+            argv=argv,
+            cwd=str(Path.cwd()),
+            settings=settings_digest(),
+            stdin_isatty=stdin_isatty,
+            stdout_isatty=sys.stdout.isatty(),
+        )
+        # Input is only read once the daemon takes the command.
+        reply = json.loads(channel.readline() or "{}")
+        if not reply.get("accepted"):
+            return None
+        send(channel, stdin=None if stdin_isatty else sys.stdin.read())
+        with forward_interrupts(sock) as rearm:
+            for line in channel:
+                message = json.loads(line)
+                if "stdout" in message:
+                    sys.stdout.write(message["stdout"])
+                    sys.stdout.flush()
+                elif "stderr" in message:
+                    sys.stderr.write(message["stderr"])
+                    sys.stderr.flush()
+                elif "prompt" in message:
+                    send(channel, input=prompt(**message["prompt"]))
+                    rearm()
+                elif "exit" in message:
+                    return message["exit"]
+
+    sys.stderr.write("Lost connection to chatcli daemon.\n")
+    return 1
+
+
+@contextlib.contextmanager
+def forward_interrupts(sock):
+    """Pass Ctrl-C on to the daemon, so it can cancel the answer.
+
+    A second Ctrl-C exits as usual. Yields a function that passes on the next
+    Ctrl-C again, for the next answer.
+    """
+
+    def interrupt(_signum, _frame):
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        sock.sendall(b'{"interrupt": true}\n')
+
+    def rearm():
+        signal.signal(signal.SIGINT, interrupt)
+
+    try:
+        previous = signal.signal(signal.SIGINT, interrupt)
+    except ValueError:
+        # Not the main thread, so there are no signals to pass on.
+        yield lambda: None
+        return
+    try:
+        yield rearm
+    finally:
+        signal.signal(signal.SIGINT, previous)
+
+
+def send(channel, **message):
+    channel.write(json.dumps(message) + "\n")
+    channel.flush()
+
+
+def prompt(*, multiline=True, **kwargs):
+    import prompt_toolkit
+
+    try:
+        return prompt_toolkit.prompt(
+            ">> ",
+            multiline=multiline,
+            prompt_continuation=".. ",
+            **kwargs,
+        ).strip()
+    except EOFError:
+        return None
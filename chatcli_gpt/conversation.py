@@ -1,11 +1,15 @@
 import json
+import time
+import contextvars
 import signal
+import functools
 from copy import copy
 from contextlib import contextmanager
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import asyncio
 
 from . import models
+from .trace import span, traced, tracer
 
 
 class Conversation:
@@ -17,17 +21,18 @@ class Conversation:
         self.usage = conversation_data.get("usage")
         self.completion = conversation_data.get("completion")
         self.timestamp = conversation_data.get("timestamp")
+        self.metrics = conversation_data.get("metrics")
 
     def append(self, role, content):
         self.messages.append({"role": role, "content": content})
 
     def __contains__(self, search_term):
         question = (
-            self.messages[-2]["content"]
+            self.messages[-2].get("content")
             if len(self.messages) > 1
-            else self.messages[-1]["content"]
+            else self.messages[-1].get("content")
         )
-        return search_term in question
+        return search_term in (question or "")
 
     def to_json(self):
         return json.dumps(self.__dict__)
@@ -39,19 +44,36 @@ class Conversation:
         raise ValueError("No matching message found")
 
     async def complete(self, *, stream=True, callback=None):
+        metrics = RequestMetrics()
+        messages = self.messages
+        tools = None
+        if self.plugins and models.supports_tools(self.model):
+            from .plugins import tool_definitions, without_text_instructions
+
+            tools = tool_definitions(self.plugins)
+            messages = without_text_instructions(messages, self.plugins)
         if stream:
-            completion = await stream_request(self.messages, self.model, callback)
+            completion = await stream_request(
+                messages, self.model, callback, metrics, tools=tools
+            )
         else:
-            completion = synchroneous_request(self.messages, self.model, callback)
+            completion = synchroneous_request(
+                messages, self.model, callback, metrics, tools=tools
+            )
 
         # TODO: handle multiple choices
         response_message = completion.choices[0].message
         self.append(
             role=response_message.role,
-            content=response_message.content,
+            content=response_message.content or "",
         )
+        if response_message.tool_calls:
+            self.messages[-1]["tool_calls"] = [
+                tool_call.to_dict() for tool_call in response_message.tool_calls
+            ]
         self.completion = completion
         self.usage = completion_usage(self.messages[:-1], self.model, completion)
+        self.metrics = metrics.to_dict(self.usage["completion_tokens"])
 
         return response_message
 
@@ -67,6 +89,7 @@ class Conversation:
             else []
         )
         data.pop("completion", None)
+        data.pop("metrics", None)
         if model:
             data["model"] = model
         return type(self)(data)
@@ -76,23 +99,79 @@ def is_personality(tag):
     return tag.startswith("^")
 
 
+@dataclass
+class RequestMetrics:
+    """Latency of a single request, as recorded in the log."""
+
+    start: float = field(default_factory=time.perf_counter)
+    first_token: float | None = None
+    end: float | None = None
+    retries: int = 0
+    attempts: int = 0
+
+    def token(self):
+        if self.first_token is None:
+            self.first_token = time.perf_counter()
+
+    def finish(self):
+        self.end = time.perf_counter()
+
+    def to_dict(self, completion_tokens):
+        end = self.end or time.perf_counter()
+        duration = end - self.start
+        # Throughput is measured from the first token, so it isn't skewed by
+        # queueing or a slow connection.
+        generating = end - self.first_token if self.first_token else duration
+        return {
+            "ttft": self.first_token - self.start if self.first_token else None,
+            "duration": duration,
+            "tokens_per_sec": completion_tokens / generating if generating else None,
+            "retries": self.retries,
+        }
+
+
+# The openai client retries failed requests itself. The retries are counted
+# by an HTTP request hook, for the metrics of the request being made.
+_request_metrics = contextvars.ContextVar("request_metrics", default=None)
+
+
+@contextmanager
+def counting_retries(metrics):
+    token = _request_metrics.set(metrics)
+    try:
+        yield
+    finally:
+        _request_metrics.reset(token)
+
+
+def count_retry(request):
+    metrics = _request_metrics.get()
+    if metrics is None:
+        return
+    retry_count = request.headers.get("x-stainless-retry-count")
+    if retry_count is not None:
+        metrics.retries = int(retry_count)
+    elif metrics.attempts:
+        # Older clients don't number their retries.
+        metrics.retries += 1
+    metrics.attempts += 1
+
+
+async def acount_retry(request):
+    count_retry(request)
+
+
+@traced("tokens.count")
 def completion_usage(request_messages, model, completion):
     if "usage" in completion:
         return completion.usage
 
-    import tiktoken
-
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+    encoding = get_encoding(model)
 
-    request_text = " ".join(
-        "role: " + x["role"] + " content: " + x["content"] + "\n"
-        for x in request_messages
+    request_tokens = count_tokens(request_messages, model)
+    completion_tokens = len(
+        encoding.encode(completion.choices[0].message.content or "")
     )
-    request_tokens = len(encoding.encode(request_text))
-    completion_tokens = len(encoding.encode(completion.choices[0].message.content))
     return {
         "prompt_tokens": request_tokens,
         "completion_tokens": completion_tokens,
@@ -100,62 +179,230 @@ def completion_usage(request_messages, model, completion):
     }
 
 
-def synchroneous_request(request_messages, model, callback):
-    from openai import OpenAI
+def count_tokens(messages, model):
+    return sum(
+        message_tokens(model, message["role"], message_text(message))
+        for message in messages
+    )
+
+
+def message_text(message):
+    """The content of a message, including any tool calls it makes."""
+    calls = [
+        f"{call['function']['name']}({call['function']['arguments']})"
+        for call in message.get("tool_calls") or []
+    ]
+    return "\n".join([message.get("content") or "", *calls]).strip()
+
+
+# Messages are counted once, not again for every request that resends them.
+@functools.lru_cache(maxsize=4096)
+def message_tokens(model, role, content):
+    text = "role: " + role + " content: " + content + "\n"
+    return len(get_encoding(model).encode(text))
+
+
+@functools.cache
+def get_encoding(model):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.encoding_for_model("gpt-3.5-turbo")
+
+
+_clients = {}
+
+# Idle connections are kept open for longer than httpx's default of 5s, so
+# the connection opened while a question is typed is still there to send it.
+KEEPALIVE_EXPIRY = 120.0
+KEEPALIVE_INTERVAL = 60.0
+WARM_UP_TIMEOUT = 10.0
+
+
+def api_client(client_class, model, http_client=None, loop=None):
+    """Return a shared client, so connections are pooled between requests.
+
+    `http_client` is called to create the client's HTTP client, if given.
+    Async clients are kept per event loop, as their connections belong to it.
+    """
+    key = (client_class, models.api_base(model), models.api_key(model), loop)
+    if key not in _clients:
+        with span("client.setup"):
+            options = {"http_client": http_client()} if http_client else {}
+            _clients[key] = client_class(base_url=key[1], api_key=key[2], **options)
+    return _clients[key]
+
+
+def async_api_client(model):
+    import httpx
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+    return api_client(
+        AsyncOpenAI,
+        model,
+        lambda: DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=1000,
+                max_keepalive_connections=100,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            event_hooks={"request": [acount_retry]},
+        ),
+        loop=asyncio.get_running_loop(),
+    )
+
+
+async def warm_up(model, messages):
+    """Get ready to send messages to model, while the question is typed.
+
+    Opens a connection to the provider, loads the tokenizer and counts the
+    tokens of the messages so far. Failures are left for the request itself
+    to report.
+    """
+    with span("warm_up", model=model):
+        await asyncio.gather(
+            connect(model),
+            asyncio.to_thread(count_tokens, messages, model),
+            return_exceptions=True,
+        )
+
 
-    client = OpenAI(
-        base_url=models.api_base(model),
-        api_key=models.api_key(model),
+async def keep_alive(model):
+    """Reconnect now and then, in case the question takes a while to type."""
+    while True:
+        await asyncio.sleep(KEEPALIVE_INTERVAL)
+        await asyncio.gather(connect(model), return_exceptions=True)
+
+
+async def connect(model):
+    # Any small request opens the connection; its answer doesn't matter.
+    client = async_api_client(model).with_options(
+        timeout=WARM_UP_TIMEOUT, max_retries=0
     )
+    await client.models.retrieve(models.api_model_name(model))
+
+
+@traced("request.sync")
+def synchroneous_request(request_messages, model, callback, metrics=None, tools=None):
+    from openai import NOT_GIVEN, DefaultHttpxClient, OpenAI
 
-    completion = client.chat.completions.create(
-        model=models.api_model_name(model),
-        messages=request_messages,
+    client = api_client(
+        OpenAI,
+        model,
+        lambda: DefaultHttpxClient(event_hooks={"request": [count_retry]}),
     )
-    if callback:
+    metrics = metrics or RequestMetrics()
+
+    with counting_retries(metrics):
+        completion = client.chat.completions.create(
+            model=models.api_model_name(model),
+            messages=request_messages,
+            tools=tools or NOT_GIVEN,
+        )
+    metrics.finish()
+    if callback and completion.choices[0].message.content:
         callback(completion.choices[0].message.content)
     return completion
 
 
+@dataclass
+class Interruption:
+    interrupted: bool = False
+
+
 @contextmanager
-def handle_sigint():
-    @dataclass
-    class State:
-        running: bool
+def handle_sigint(task, *, enabled=True):
+    """Cancel task on Ctrl-C. A second Ctrl-C interrupts the program as usual.
 
-    state = State(running=True)
+    Cancelling a streaming request closes the stream, and with it the
+    connection, so the provider stops generating the answer. A command run
+    by the daemon is interrupted by its client instead of a signal.
+    """
+    from .daemon import current_session
 
-    def handle_sigint(_signal, _frame):
-        state.running = False
+    state = Interruption()
+    loop = task.get_loop()
+    session = current_session()
 
-    try:
-        signal.signal(signal.SIGINT, handle_sigint)
+    def interrupt():
+        state.interrupted = True
+        task.cancel()
+
+    def handle_sigint():
+        loop.remove_signal_handler(signal.SIGINT)
+        interrupt()
+
+    if not enabled:
         yield state
-    finally:
-        signal.signal(signal.SIGINT, signal.SIG_DFL)
+    elif session:
+        session.on_interrupt = lambda: loop.call_soon_threadsafe(interrupt)
+        try:
+            yield state
+        finally:
+            session.on_interrupt = None
+    else:
+        try:
+            loop.add_signal_handler(signal.SIGINT, handle_sigint)
+            installed = True
+        except (NotImplementedError, RuntimeError, ValueError):
+            # Only the main thread can handle signals.
+            installed = False
+        try:
+            yield state
+        finally:
+            if installed:
+                loop.remove_signal_handler(signal.SIGINT)
+
+
+async def stream_request(request_messages, model, callback, metrics=None, tools=None):
+    from openai import NOT_GIVEN
+
+    aclient = async_api_client(model)
+    metrics = metrics or RequestMetrics()
+
+    request_start = time.perf_counter()
+    with span("request.connect", model=model), counting_retries(metrics):
+        stream = await aclient.chat.completions.create(
+            model=models.api_model_name(model),
+            messages=request_messages,
+            stream=True,
+            tools=tools or NOT_GIVEN,
+        )
 
+    if tracer.enabled:
+        callback = traced_callback(callback, request_start)
+    with span("request.stream", model=model):
+        response = await accumulate_streaming_response(stream, callback, metrics)
+    # openai's AsyncStream has close(), plain async generators have aclose().
+    close = getattr(stream, "close", None) or stream.aclose
+    await close()
 
-async def stream_request(request_messages, model, callback):
-    from openai import AsyncOpenAI
+    return response
 
-    aclient = AsyncOpenAI(
-        base_url=models.api_base(model),
-        api_key=models.api_key(model),
-    )
 
-    stream = await aclient.chat.completions.create(
-        model=models.api_model_name(model),
-        messages=request_messages,
-        stream=True,
-    )
+def traced_callback(callback, request_start):
+    """Wrap a token callback to record time to first token and render time."""
+    first_token = True
 
-    response = await accumulate_streaming_response(stream, callback)
-    await stream.close()
+    def wrapper(token):
+        nonlocal first_token
+        if first_token:
+            first_token = False
+            tracer.record(
+                "request.first_token",
+                request_start,
+                time.perf_counter() - request_start,
+            )
+        if callback:
+            with span("render"):
+                callback(token)
 
-    return response
+    return wrapper
 
 
-async def accumulate_streaming_response(stream, callback=None):
+async def accumulate_streaming_response(stream, callback=None, metrics=None):
     from openai.types.chat import ChatCompletionMessage
     from openai.types.completion import Completion, CompletionChoice
 
@@ -165,13 +412,21 @@ async def accumulate_streaming_response(stream, callback=None):
     completion = {}
 
     accumulated_content = ""
+    tool_calls = {}
+    finish_reason = "stop"
 
     try:
         async for chunk in stream:
             if chunk.choices[0].delta.content:
+                if metrics:
+                    metrics.token()
                 chunk_content = chunk.choices[0].delta.content
                 accumulated_content += chunk_content
                 callback(chunk_content)
+            for delta in chunk.choices[0].delta.tool_calls or []:
+                if metrics:
+                    metrics.token()
+                add_tool_call_delta(tool_calls, delta)
 
             if completion.get("id") is None:
                 completion["id"] = chunk.id
@@ -181,18 +436,26 @@ async def accumulate_streaming_response(stream, callback=None):
                 completion["model"] = chunk.model
 
     except asyncio.CancelledError:
-        pass
+        # Keep the partial answer, marked as cut short.
+        finish_reason = "cancelled"
+
+    if metrics:
+        metrics.finish()
 
     message = ChatCompletionMessage(
         text=accumulated_content,
         content=accumulated_content,
         role="assistant",
         function_call=None,
-        tool_calls=None,
+        tool_calls=[tool_calls[index] for index in sorted(tool_calls)] or None,
     )
 
-    choice = CompletionChoice(
-        finish_reason="stop",
+    # "cancelled" isn't one of the API's finish reasons, so isn't validated.
+    make_choice = (
+        CompletionChoice.construct if finish_reason == "cancelled" else CompletionChoice
+    )
+    choice = make_choice(
+        finish_reason=finish_reason,
         index=0,
         text=accumulated_content,
         message=message,
@@ -207,6 +470,19 @@ async def accumulate_streaming_response(stream, callback=None):
     )
 
 
+def add_tool_call_delta(tool_calls, delta):
+    """Add a streamed fragment of a tool call to the calls by index."""
+    call = tool_calls.setdefault(
+        delta.index,
+        {"id": None, "type": "function", "function": {"name": "", "arguments": ""}},
+    )
+    if delta.id:
+        call["id"] = delta.id
+    if delta.function:
+        call["function"]["name"] += delta.function.name or ""
+        call["function"]["arguments"] += delta.function.arguments or ""
+
+
 def get_choice_content(completion, index=0):
     return choices_by_index(completion.choices).get(index, {}).content
 
@@ -0,0 +1,238 @@
+"""The `chatcli serve` daemon.
+
+The daemon runs commands forwarded by `chatcli_gpt.client` in a long lived
+process, so imports, the parsed log, tokenizers and HTTP connections stay warm
+between commands. Commands share the process wide working directory and
+standard streams, so only one runs at a time, but a command waiting for the
+user to type lets the others run.
+"""
+import io
+import os
+import sys
+import json
+import queue
+import signal
+import threading
+import traceback
+import contextlib
+import socketserver
+
+_command_lock = threading.Lock()
+_local = threading.local()
+
+
+def current_session():
+    return getattr(_local, "session", None)
+
+
+class Session:
+    def __init__(self, rfile, wfile, request):
+        self.rfile = rfile
+        self.wfile = wfile
+        self.request = request
+        self.stdin_isatty = request["stdin_isatty"]
+        self.stdout_isatty = request["stdout_isatty"]
+        self.stdin = io.StringIO(request["stdin"] or "")
+        self.process_state = None
+        self.replies = queue.Queue()
+        # Set while an answer that Ctrl-C cancels is streaming.
+        self.on_interrupt = None
+
+    def send(self, **message):
+        self.wfile.write((json.dumps(message) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def prompt(self, *, multiline=True, **kwargs):
+        self.send(prompt={"multiline": multiline, **kwargs})
+        # Other commands can run while the user types.
+        self.deactivate()
+        try:
+            return self.replies.get()
+        finally:
+            self.activate()
+
+    def listen(self):
+        """Read the client's answers to prompts, and its Ctrl-Cs."""
+        with contextlib.suppress(OSError, ValueError):
+            for line in self.rfile:
+                message = json.loads(line)
+                if "interrupt" in message:
+                    on_interrupt = self.on_interrupt
+                    if on_interrupt:
+                        on_interrupt()
+                else:
+                    self.replies.put(message["input"])
+        # The client has gone, so there's no more input.
+        self.replies.put(None)
+
+    def run(self):
+        from .cli import release_event_loop
+        from .log import shared_writers
+
+        _local.session = self
+        self.activate()
+        try:
+            return run_command(self.request["argv"])
+        finally:
+            self.deactivate()
+            release_event_loop()
+            _local.session = None
+            # The command's entries are committed before it reports back.
+            shared_writers.flush_all()
+
+    def activate(self):
+        """Take the process's working directory and standard streams."""
+        _command_lock.acquire()
+        self.process_state = contextlib.ExitStack()
+        self.process_state.enter_context(working_directory(self.request["cwd"]))
+        self.process_state.enter_context(
+            contextlib.redirect_stdout(RemoteStream(self, "stdout"))
+        )
+        self.process_state.enter_context(
+            contextlib.redirect_stderr(RemoteStream(self, "stderr"))
+        )
+        self.process_state.enter_context(redirect_stdin(self.stdin))
+
+    def deactivate(self):
+        try:
+            self.process_state.close()
+        finally:
+            _command_lock.release()
+
+
+def run_command(argv):
+    from .cli import main
+
+    try:
+        main(argv)
+    except SystemExit as error:
+        if isinstance(error.code, str):
+            sys.stderr.write(error.code + "\n")
+            return 1
+        return error.code or 0
+    except Exception:  # noqa: BLE001
+        # Report the failure to the client rather than dropping the connection.
+        sys.stderr.write(traceback.format_exc())
+        return 1
+    return 0
+
+
+class RemoteStream(io.TextIOBase):
+    encoding = "utf-8"
+    errors = "strict"
+
+    def __init__(self, session, name):
+        self.session = session
+        self.name = name
+
+    def write(self, text):
+        self.session.send(**{self.name: text})
+        return len(text)
+
+    def isatty(self):
+        return self.session.stdout_isatty
+
+    def writable(self):
+        return True
+
+
+@contextlib.contextmanager
+def working_directory(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+@contextlib.contextmanager
+def redirect_stdin(stream):
+    previous = sys.stdin
+    sys.stdin = stream
+    try:
+        yield
+    finally:
+        sys.stdin = previous
+
+
+# Commands that run in the client's process: the server itself, and
+# mapreduce, which streams its input rather than reading it all first.
+IN_PROCESS_COMMANDS = ("serve", "mapreduce")
+
+
+def accepts(request):
+    """Whether the daemon runs the command, rather than the client."""
+    from .client import settings_digest
+
+    return (
+        request["settings"] == settings_digest()
+        and command_name(request["argv"]) not in IN_PROCESS_COMMANDS
+    )
+
+
+def command_name(argv):
+    from .cli import cli
+
+    try:
+        with cli.make_context("chatcli", list(argv), resilient_parsing=True) as ctx:
+            args = ctx.protected_args + ctx.args
+            return cli.resolve_command(ctx, args)[0] if args else None
+    except click_errors():
+        return None
+
+
+def click_errors():
+    import click
+
+    return (click.ClickException, click.exceptions.Exit)
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if not accepts(request):
+            self.wfile.write(b'{"accepted": false}\n')
+            return
+        self.wfile.write(b'{"accepted": true}\n')
+        self.wfile.flush()
+        request["stdin"] = json.loads(self.rfile.readline())["stdin"]
+        session = Session(self.rfile, self.wfile, request)
+        threading.Thread(target=session.listen, daemon=True).start()
+        with contextlib.suppress(BrokenPipeError, ConnectionResetError):
+            session.send(exit=session.run())
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(socket_path):
+    from . import log
+
+    log.enable_cache()
+    log.enable_group_commit()
+
+    with contextlib.suppress(FileNotFoundError):
+        socket_path.unlink()
+    return Server(str(socket_path), Handler)
+
+
+def serve(socket_path):
+    # Import everything a command needs up front, rather than on first use.
+    from . import cli  # noqa: F401
+    import openai  # noqa: F401
+    import tiktoken  # noqa: F401
+
+    from . import log
+
+    server = create_server(socket_path)
+    # Stop cleanly on SIGTERM too, so pending log entries are written.
+    signal.signal(signal.SIGTERM, lambda *_args: sys.exit(0))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        log.shared_writers.close()
+        with contextlib.suppress(FileNotFoundError):
+            socket_path.unlink()
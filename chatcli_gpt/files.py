@@ -0,0 +1,250 @@
+"""Collect the files given with `chat -f` as context for a conversation.
+
+Arguments can be files, directories or glob patterns. Directories are
+walked honouring `.gitignore` files. Files are read in parallel, binary,
+huge and duplicate files are skipped, and the rest are fitted into a token
+budget: arguments given first have priority, and the files that don't fit
+are truncated or dropped, starting from the last.
+"""
+import os
+import re
+import glob
+import hashlib
+from pathlib import Path
+from dataclasses import dataclass
+from concurrent.futures import ThreadPoolExecutor
+
+from . import models
+from .conversation import get_encoding
+
+MAX_FILE_BYTES = int(os.environ.get("CHATCLI_MAX_FILE_BYTES", 1_000_000))
+# Share of the model's context window that attached files may use, leaving
+# room for the conversation and the answer.
+FILE_CONTEXT_SHARE = 0.5
+DEFAULT_CONTEXT_LENGTH = 4096
+# Rather than truncate a file to almost nothing, drop it.
+MIN_TRUNCATED_TOKENS = 100
+TRUNCATED_MARKER = "\n... (truncated)\n"
+READ_WORKERS = 8
+
+
+@dataclass
+class FileContent:
+    name: str
+    text: str
+    tokens: int
+    digest: bytes = b""
+    truncated: bool = False
+
+
+def collect_files(patterns, model, max_tokens=None):
+    """Return (files, skipped) for the given -f arguments.
+
+    `skipped` is a list of (name, reason) pairs for files that were left out.
+    """
+    encoding = get_encoding(model)
+    budget = max_tokens if max_tokens is not None else token_budget(model)
+
+    paths = expand_paths(patterns)
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as executor:
+        results = list(executor.map(lambda path: read_file(path, encoding), paths))
+
+    files = []
+    skipped = []
+    seen = set()
+    for name, content, reason in results:
+        if reason:
+            skipped.append((name, reason))
+        elif content.digest in seen:
+            skipped.append((name, "duplicate"))
+        else:
+            seen.add(content.digest)
+            files.append(content)
+
+    kept, dropped = fit_to_budget(files, budget, encoding)
+    return kept, skipped + dropped
+
+
+def token_budget(model):
+    details = models.registry().get(model) or {}
+    context_length = details.get("context_length") or DEFAULT_CONTEXT_LENGTH
+    return int(context_length * FILE_CONTEXT_SHARE)
+
+
+def read_file(path, encoding):
+    """Return (name, FileContent, None), or (name, None, reason) if skipped."""
+    name = str(path)
+    try:
+        if path.stat().st_size > MAX_FILE_BYTES:
+            return name, None, "too large"
+        data = path.read_bytes()
+    except OSError as error:
+        return name, None, error.strerror or "unreadable"
+    if b"\0" in data[:8192]:
+        return name, None, "binary"
+    try:
+        text = data.decode("utf-8")
+    except UnicodeDecodeError:
+        return name, None, "binary"
+    tokens = len(encoding.encode(text))
+    return name, FileContent(name, text, tokens, hashlib.sha256(data).digest()), None
+
+
+def fit_to_budget(files, budget, encoding):
+    kept = []
+    dropped = []
+    for file in files:
+        if file.tokens <= budget:
+            kept.append(file)
+            budget -= file.tokens
+        elif budget >= MIN_TRUNCATED_TOKENS:
+            text = encoding.decode(encoding.encode(file.text)[:budget])
+            kept.append(
+                FileContent(file.name, text + TRUNCATED_MARKER, budget, truncated=True)
+            )
+            budget = 0
+        else:
+            dropped.append((file.name, "over the token budget"))
+    return kept, dropped
+
+
+def expand_paths(patterns):
+    """Expand -f arguments to a list of files, in argument order."""
+    paths = []
+    seen = set()
+
+    def add(path):
+        key = path.resolve()
+        if key not in seen:
+            seen.add(key)
+            paths.append(path)
+
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_file():
+            # Files named explicitly are included even if ignored.
+            add(path)
+        elif path.is_dir():
+            for file in walk(path):
+                add(file)
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True))  # noqa: PTH207
+            if not matches:
+                raise ValueError(f"No files match {pattern!r}")
+            ignore = GitIgnore(find_root(Path.cwd()))
+            for match in map(Path, matches):
+                if match.is_file() and not ignore.ignored(match):
+                    add(match)
+    return paths
+
+
+def walk(directory):
+    ignore = GitIgnore(find_root(directory))
+    for root, dirnames, filenames in os.walk(directory):
+        root_path = Path(root)
+        dirnames[:] = sorted(
+            name
+            for name in dirnames
+            if name != ".git" and not ignore.ignored(root_path / name, is_dir=True)
+        )
+        for name in sorted(filenames):
+            if not ignore.ignored(root_path / name):
+                yield root_path / name
+
+
+def find_root(path):
+    """The enclosing git repository, whose .gitignore files apply to path."""
+    path = path.resolve()
+    for directory in [path, *path.parents]:
+        if (directory / ".git").exists():
+            return directory
+    return path
+
+
+class GitIgnore:
+    """Match paths against the .gitignore files between root and the path."""
+
+    def __init__(self, root):
+        self.root = root
+        self._rules = {}
+
+    def rules(self, directory):
+        if directory not in self._rules:
+            gitignore = directory / ".gitignore"
+            self._rules[directory] = (
+                parse_gitignore(gitignore.read_text(encoding="utf-8", errors="replace"))
+                if gitignore.is_file()
+                else []
+            )
+        return self._rules[directory]
+
+    def ignored(self, path, *, is_dir=False):
+        path = path.resolve()
+        try:
+            parts = path.relative_to(self.root).parts
+        except ValueError:
+            return False
+        # A path inside an ignored directory is ignored too.
+        for depth in range(1, len(parts)):
+            if self._matches(parts[:depth], is_dir=True):
+                return True
+        return self._matches(parts, is_dir=is_dir)
+
+    def _matches(self, parts, *, is_dir):
+        ignored = False
+        for depth in range(len(parts)):
+            directory = self.root.joinpath(*parts[:depth])
+            relative = "/".join(parts[depth:])
+            for regex, negated, dir_only in self.rules(directory):
+                if (is_dir or not dir_only) and regex.fullmatch(relative):
+                    ignored = not negated
+        return ignored
+
+
+def parse_gitignore(text):
+    """Return (regex, negated, dir_only) for each pattern in a .gitignore."""
+    rules = []
+    for line in text.splitlines():
+        line = line.rstrip()
+        if not line or line.startswith("#"):
+            continue
+        negated = line.startswith("!")
+        line = line.removeprefix("!")
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        # Patterns containing a slash are relative to the .gitignore.
+        anchored = "/" in line
+        regex = glob_to_regex(line.lstrip("/"))
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        rules.append((re.compile(regex), negated, dir_only))
+    return rules
+
+
+def glob_to_regex(pattern):
+    regex = ""
+    idx = 0
+    while idx < len(pattern):
+        if pattern.startswith("**/", idx):
+            regex += "(?:.*/)?"
+            idx += 3
+        elif pattern.startswith("**", idx):
+            regex += ".*"
+            idx += 2
+        elif pattern[idx] == "*":
+            regex += "[^/]*"
+            idx += 1
+        elif pattern[idx] == "?":
+            regex += "[^/]"
+            idx += 1
+        elif pattern[idx] == "[" and "]" in pattern[idx + 1 :]:
+            end = pattern.index("]", idx + 1)
+            characters = pattern[idx + 1 : end]
+            if characters.startswith("!"):
+                characters = "^" + characters[1:]
+            regex += "[" + characters + "]"
+            idx = end + 1
+        else:
+            regex += re.escape(pattern[idx])
+            idx += 1
+    return regex
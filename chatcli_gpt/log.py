@@ -1,35 +1,233 @@
 import os
 import os.path
-import sys
+import bisect
+import itertools
 import shutil
+import atexit
+import contextlib
+import fcntl
+import threading
 from pathlib import Path
 from datetime import datetime, timezone
 import json
 
 from .conversation import Conversation
+from . import recall, sqlite_log, threads
+from .query import Query, parse_timestamp
+from .trace import span, traced
 
 
 CHAT_LOG = os.environ.get("CHATCLI_LOGFILE", ".chatcli.log")
 LOG_FILE_VERSION = "0.4"
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+DURABILITY_LEVELS = ("none", "batch", "always")
 
 
-def write_log(log_file, conversation, usage=None, completion=None):
-    timestamp = datetime.now(timezone.utc).isoformat()
-    with log_file.open("a", buffering=1, encoding="utf-8") as fh:
-        fh.write(
-            json.dumps(
-                {
-                    "messages": conversation.messages,
-                    "completion": completion.to_dict() if completion else None,
-                    "usage": usage,
-                    "tags": conversation.tags or [],
-                    "timestamp": timestamp,
-                    "plugins": conversation.plugins or [],
-                    "model": conversation.model,
-                },
-            )
-            + "\n",
+def is_sqlite_log(log_path):
+    return Path(log_path).suffix in SQLITE_SUFFIXES
+
+
+def write_log(log_file, conversation, usage=None, completion=None, metrics=None):
+    entry = log_entry(conversation, usage, completion, metrics)
+    # The daemon flushes a command's entries before it reports back, but an
+    # entry that must be durable is written straight away.
+    if shared_writers.enabled and durability() != "always":
+        shared_writers.writer(log_file).append(entry)
+    else:
+        append_entries(log_file, [entry])
+
+
+def log_entry(conversation, usage=None, completion=None, metrics=None):
+    return {
+        "messages": conversation.messages,
+        "completion": completion.to_dict() if completion else None,
+        "usage": usage,
+        "tags": conversation.tags or [],
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "plugins": conversation.plugins or [],
+        "model": conversation.model,
+        "metrics": metrics,
+    }
+
+
+def durability():
+    value = os.environ.get("CHATCLI_DURABILITY", "none")
+    if value not in DURABILITY_LEVELS:
+        raise ValueError(
+            f"CHATCLI_DURABILITY must be one of {', '.join(DURABILITY_LEVELS)}"
         )
+    return value
+
+
+@traced("log.write")
+def append_entries(log_file, entries, *, sync=None):
+    """Append entries to the log as a single locked write.
+
+    `sync` overrides the CHATCLI_DURABILITY setting: "always" fsyncs before
+    returning, "batch" shares one fsync between the appends made in the next
+    FSYNC_DELAY seconds and "none" leaves it to the operating system.
+    """
+    sync = sync or durability()
+    entries = list(entries)
+    if is_sqlite_log(log_file):
+        sqlite_log.append_entries(log_file, entries, durability=sync)
+        threads.update(log_file, entries)
+        if recall.index_path(log_file).exists():
+            state = log_state(log_file)
+            recall.update(log_file, entries, state - len(entries), state)
+        return
+
+    data = "".join(json.dumps(entry) + "\n" for entry in entries)
+    if not data:
+        return
+    with log_file.open("a", encoding="utf-8") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            previous_size = fh.seek(0, os.SEEK_END)
+            fh.write(data)
+            fh.flush()
+            if sync == "always":
+                os.fsync(fh.fileno())
+            # Still holding the lock, so entry ids in the indexes match the log.
+            threads.update(log_file, entries)
+            recall.update(log_file, entries, previous_size, fh.tell())
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+    if sync == "batch":
+        schedule_fsync(log_file)
+
+
+FSYNC_DELAY = 1.0
+_unsynced_logs = set()
+_fsync_lock = threading.Lock()
+_fsync_timer = None
+
+
+def schedule_fsync(log_file):
+    global _fsync_timer  # noqa: PLW0603
+    with _fsync_lock:
+        if _fsync_timer is None:
+            atexit.register(fsync_pending)
+        if not _unsynced_logs:
+            _fsync_timer = start_timer(FSYNC_DELAY, fsync_pending)
+        _unsynced_logs.add(Path(log_file))
+
+
+def fsync_pending():
+    with _fsync_lock:
+        log_files = list(_unsynced_logs)
+        _unsynced_logs.clear()
+    for log_file in log_files:
+        with contextlib.suppress(FileNotFoundError), log_file.open("rb") as fh:
+            os.fsync(fh.fileno())
+
+
+def start_timer(delay, function):
+    # A daemon thread, so a pending timer doesn't hold up exit (atexit
+    # handlers and close() flush instead).
+    timer = threading.Timer(delay, function)
+    timer.daemon = True
+    timer.start()
+    return timer
+
+
+class LogWriter:
+    """Group commit writer for batch jobs and long running processes.
+
+    Entries are buffered and appended with a single write (and at most one
+    fsync) once `max_entries` are pending, once the oldest pending entry is
+    `max_delay` seconds old (by a timer, so a lone entry isn't left waiting
+    for the next one), or when the writer is flushed or closed.
+    """
+
+    def __init__(self, log_file, *, max_entries=64, max_delay=1.0):
+        self.log_file = log_file
+        self.max_entries = max_entries
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def write(self, conversation, usage=None, completion=None, metrics=None):
+        self.append(log_entry(conversation, usage, completion, metrics))
+
+    def append(self, entry):
+        with self._lock:
+            if not self._pending:
+                self._timer = start_timer(self.max_delay, self.flush)
+            self._pending.append(entry)
+            due = len(self._pending) >= self.max_entries
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+            entries, self._pending = self._pending, []
+            if not entries:
+                return
+            sync = "always" if durability() != "none" else "none"
+            append_entries(self.log_file, entries, sync=sync)
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.close()
+
+
+class SharedWriters:
+    """Group commit for the commands run by `chatcli serve`.
+
+    Entries written to a log by any command are appended together by one
+    LogWriter per log. Reading a log flushes its writer first, so commands
+    see the entries written before them, and the daemon flushes the writers
+    when a command finishes, so its entries are on disk before it returns.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def writer(self, log_file):
+        key = Path(log_file).resolve()
+        with self._lock:
+            if key not in self._writers:
+                self._writers[key] = LogWriter(key, max_delay=GROUP_COMMIT_DELAY)
+            return self._writers[key]
+
+    def flush(self, log_file):
+        if not self.enabled:
+            return
+        with self._lock:
+            writer = self._writers.get(Path(log_file).resolve())
+        if writer:
+            writer.flush()
+
+    def flush_all(self):
+        with self._lock:
+            writers = list(self._writers.values())
+        for writer in writers:
+            writer.flush()
+
+    def close(self):
+        self.flush_all()
+
+
+GROUP_COMMIT_DELAY = 0.2
+shared_writers = SharedWriters()
+
+
+def enable_group_commit():
+    shared_writers.enabled = True
+    atexit.register(shared_writers.close)
 
 
 def create_initial_log(reinit):
@@ -39,40 +237,180 @@ def create_initial_log(reinit):
     new_log_file = Path(CHAT_LOG)
 
     if not new_log_file.exists():
-        with Path(CHAT_LOG).open("w", encoding="utf-8") as fh:
-            fh.write(json.dumps({"version": LOG_FILE_VERSION}) + "\n")
+        create_empty_log(new_log_file)
 
     from importlib import resources
 
-    default_log = resources.path("chatcli_gpt", "data") / "default_log"
+    default_log = resources.files("chatcli_gpt") / "data" / "default_log"
 
-    with Path(default_log).open(encoding="utf-8") as fh:
+    with default_log.open(encoding="utf-8") as fh, LogWriter(new_log_file) as writer:
         for line in fh:
-            write_log(new_log_file, Conversation(json.loads(line)))
+            writer.write(Conversation(json.loads(line)))
+
+
+def create_empty_log(log_path):
+    if is_sqlite_log(log_path):
+        sqlite_log.create_log(log_path, LOG_FILE_VERSION)
+    else:
+        with log_path.open("w", encoding="utf-8") as fh:
+            fh.write(json.dumps({"version": LOG_FILE_VERSION}) + "\n")
+    threads.create(log_path)
+
+
+class OutdatedLogError(Exception):
+    pass
+
+
+@traced("log.load")
+def conversation_log(log_path, since=None, until=None):
+    """Return the conversations in the log, from since until until if given."""
+    shared_writers.flush(log_path)
+    if is_sqlite_log(log_path):
+        return [
+            Conversation(entry)
+            for entry in sqlite_log.log_entries(log_path, since, until)
+        ]
+    # Entries written with a skewed clock can be out of order, so the range
+    # found by searching is checked entry by entry.
+    if log_cache.enabled:
+        entries, _ = cached_range(log_cache.entries(log_path), since, until)
+        if since or until:
+            entries = [e for e in entries if in_range(entry_time(e), since, until)]
+        return [Conversation(copy_entry(entry)) for entry in entries]
+    lines, _ = log_lines(log_path, since, until)
+    if since or until:
+        lines = [line for line in lines if in_range(line_time(line), since, until)]
+    return [Conversation(json.loads(line)) for line in lines]
+
+
+class LogCache:
+    """Parsed log entries kept between commands by `chatcli serve`.
+
+    The log is append only, so when a cached log has grown only the new lines
+    are parsed. Anything else (a new inode, a shrunk file, a missing newline at
+    the old end) causes a full reload.
+    """
 
+    def __init__(self):
+        self.enabled = False
+        self._logs = {}
+        self._lock = threading.Lock()
 
-def conversation_log(log_path):
+    def entries(self, log_path):
+        # The daemon runs a command while another waits for input.
+        with self._lock:
+            return self._entries(log_path)
+
+    def _entries(self, log_path):
+        key = log_path.resolve()
+        stat = log_path.stat()
+        inode, size, entries = self._logs.get(key, (None, 0, None))
+
+        if entries is not None and inode == stat.st_ino and size <= stat.st_size:
+            with log_path.open("rb") as fh:
+                fh.seek(size - 1)
+                if fh.read(1) == b"\n":
+                    entries.extend(json.loads(line) for line in fh)
+                    self._logs[key] = (inode, stat.st_size, entries)
+                    return entries
+
+        with log_path.open("rb") as fh:
+            if log_version(fh.readline()) is None:
+                raise OutdatedLogError(log_path)
+            entries = [json.loads(line) for line in fh]
+        self._logs[key] = (stat.st_ino, stat.st_size, entries)
+        return entries
+
+
+log_cache = LogCache()
+
+
+def enable_cache():
+    log_cache.enabled = True
+
+
+def copy_entry(entry):
+    """Copy the parts of a cached entry that commands modify in place."""
+    return {
+        **entry,
+        "messages": [dict(message) for message in entry["messages"]],
+        "tags": list(entry["tags"]),
+        "plugins": list(entry["plugins"]),
+    }
+
+
+def log_version(first_line):
+    return json.loads(first_line).get("version")
+
+
+def needs_upgrade(log_path):
+    if is_sqlite_log(log_path):
+        return False
     with log_path.open(encoding="utf-8") as fh:
-        line = json.loads(fh.readline())
-        version = line.get("version")
-        if version is None:
-            fh.close()
-            lines = list(convert_log_pre_0_4(log_path))
-            backup_file = log_path.with_suffix(".log.bak.0_3")
-            sys.stderr.write(f"Upgrading log file. Making backup in: {backup_file}\n")
-            shutil.copyfile(log_path, backup_file)
-            rewrite_log(log_path, lines)
-            return [Conversation(json.loads(line)) for line in lines]
-        return [Conversation(json.loads(line)) for line in fh]
-
-
-def rewrite_log(path, lines):
-    with path.open("w", encoding="utf-8") as fh:
-        fh.write(json.dumps({"version": LOG_FILE_VERSION}) + "\n")
-        for line in lines:
-            fh.write(line + "\n")
+        return log_version(fh.readline()) is None
+
+
+def upgrade_log(log_path, progress=None):
+    """Convert a pre-0.4 log to the current format.
+
+    Converted entries are streamed to a temporary file next to the log which
+    atomically replaces it once complete. Each old entry converts to exactly
+    one new line, so an interrupted upgrade resumes by skipping the entries
+    already in the temporary file.
+
+    Entries without a time of their own are given the previous entry's, so
+    the log stays in time order for the range searches; those before any
+    timed entry stay untimed, which counts as the oldest.
+    """
+    progress = progress or (lambda _: None)
+    upgrade_file = log_path.with_name(log_path.name + ".upgrading")
+    backup_file = log_path.with_suffix(".log.bak.0_3")
+
+    written, last_line = resume_upgrade(upgrade_file)
+    # The first line is the version header, written only into an empty file.
+    converted = max(written - 1, 0)
+    previous = json.loads(last_line).get("timestamp") if converted else None
+    with log_path.open("rb") as source, upgrade_file.open("a", encoding="utf-8") as fh:
+        if written == 0:
+            fh.write(json.dumps({"version": LOG_FILE_VERSION}) + "\n")
+        for line_number, line in enumerate(source):
+            progress(len(line))
+            if line_number < converted:
+                continue
+            entry = convert_entry_pre_0_4(json.loads(line), previous)
+            previous = entry["timestamp"]
+            fh.write(json.dumps(entry) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    shutil.copyfile(log_path, backup_file)
+    os.replace(upgrade_file, log_path)
+    return backup_file
 
 
+def resume_upgrade(upgrade_file):
+    """Return the number of lines (header included) written by an earlier attempt,
+    and the last of them.
+
+    A partially written trailing line is truncated away.
+    """
+    if not upgrade_file.exists():
+        return 0, None
+    with upgrade_file.open("rb+") as fh:
+        complete = 0
+        lines = 0
+        last_line = None
+        for line in fh:
+            if not line.endswith(b"\n"):
+                break
+            complete += len(line)
+            lines += 1
+            last_line = line
+        fh.truncate(complete)
+    return lines, last_line
+
+
+@traced("find_log")
 def find_log(start_dir):
     start_dir = start_dir or Path(".")
 
@@ -85,59 +423,284 @@ def find_log(start_dir):
     raise FileNotFoundError(CHAT_LOG)
 
 
-def search_conversations(log_path, offsets, search, tag):
-    for idx, conversation in enumerate(reversed(conversation_log(log_path)), start=1):
-        if offsets and idx not in offsets:
-            continue
+def usage_log(log_path, since=None, until=None):
+    shared_writers.flush(log_path)
+    if is_sqlite_log(log_path):
+        return [
+            Conversation(entry)
+            for entry in sqlite_log.usage_entries(log_path, since, until)
+        ]
+    return conversation_log(log_path, since, until)
+
+
+def metrics_log(log_path, since=None, until=None):
+    """Return the conversations that recorded request metrics."""
+    shared_writers.flush(log_path)
+    if is_sqlite_log(log_path):
+        return [
+            Conversation(entry)
+            for entry in sqlite_log.metrics_entries(log_path, since, until)
+        ]
+    return [
+        conversation
+        for conversation in conversation_log(log_path, since, until)
+        if conversation.metrics
+    ]
+
+
+def thread_parents(log_path):
+    """Return the parent id of each entry in the log (see threads.py)."""
+    return threads.parents(
+        log_path, [conversation.messages for conversation in conversation_log(log_path)]
+    )
+
+
+def log_state(log_path):
+    """A value that changes whenever entries are appended to the log."""
+    if is_sqlite_log(log_path):
+        return sqlite_log.entry_count(log_path)
+    return log_path.stat().st_size
+
+
+def recall_answers(log_path, question, limit, exclude=()):
+    """Return the earlier answers most relevant to question (see recall.py)."""
+    shared_writers.flush(log_path)
+    return recall.recall(
+        log_path,
+        log_state(log_path),
+        lambda: [conversation.messages for conversation in conversation_log(log_path)],
+        question,
+        limit,
+        exclude,
+    )
+
 
-        if search and search not in conversation:
+MIGRATE_BATCH = 1000
+
+
+def migrate_log(source, destination):
+    """Copy the log to destination, a batch of entries at a time."""
+    shared_writers.flush(source)
+    if is_sqlite_log(source):
+        entries = sqlite_log.log_entries(source)
+    else:
+        entries = (Conversation(entry).__dict__ for entry in jsonl_entries(source))
+
+    create_empty_log(destination)
+    while batch := list(itertools.islice(entries, MIGRATE_BATCH)):
+        append_entries(destination, batch)
+
+
+def jsonl_entries(log_path):
+    with log_path.open("rb") as fh:
+        if log_version(fh.readline()) is None:
+            raise OutdatedLogError(log_path)
+        for line in fh:
+            yield json.loads(line)
+
+
+def search_conversations(log_path, offsets, query=None):
+    """Yield the (offset, conversation) pairs matching query, most recent first.
+
+    In a JSONL log the query's metadata terms are checked against each line
+    before it is decoded, so only candidates are parsed.
+    """
+    query = query or Query()
+    shared_writers.flush(log_path)
+    if is_sqlite_log(log_path):
+        for idx, entry in sqlite_log.search_entries(log_path, offsets, query):
+            yield idx, Conversation(entry)
+        return
+    if log_cache.enabled:
+        entries, newer = cached_range(
+            log_cache.entries(log_path), query.since, query.until
+        )
+        for idx, entry in enumerate(reversed(entries), start=newer + 1):
+            if offsets and idx not in offsets:
+                continue
+            conversation = Conversation(copy_entry(entry))
+            if query.matches(conversation):
+                yield idx, conversation
+        return
+    with span("log.load"):
+        lines, newer = log_lines(log_path, query.since, query.until)
+    for idx, line in enumerate(reversed(lines), start=newer + 1):
+        if offsets and idx not in offsets:
             continue
-        if tag and tag not in conversation.tags:
+        if not line_may_match(line, query):
             continue
-        yield idx, conversation
+        conversation = Conversation(json.loads(line))
+        if query.matches(conversation):
+            yield idx, conversation
 
 
-def convert_log_pre_0_4(filename):
-    with Path(filename).open(encoding="utf-8") as fh:
-        for line in fh:
-            data = json.loads(line)
-
-            messages = data["messages"]
-            usage = data["usage"]
-
-            if usage and "request_tokens" in usage:
-                usage["prompt_tokens"] = usage["request_tokens"]
-                del usage["request_tokens"]
-
-            tags = data.get("tags", [])
-            completion = data.get("completion") or data.get("response")
-
-            timestamp = (
-                data.get("timestamp")
-                or (
-                    completion
-                    and datetime.fromtimestamp(
-                        completion.get("created"), tz=timezone.utc
-                    ).isoformat()
-                )
-                or datetime.now(tz=timezone.utc).isoformat()
-            )
-
-            assert isinstance(messages, list), data
-            assert isinstance(tags, list), data
-            assert isinstance(completion, dict) or completion is None, (
-                completion,
-                data,
-            )
-            assert isinstance(usage, dict) or usage is None, (usage, data)
-
-            converted_data = {
-                "messages": messages,
-                "completion": completion,
-                "tags": tags,
-                "usage": usage,
-                "timestamp": timestamp,
-                "plugins": data.get("plugins", []),
-                "model": data.get("model"),
-            }
-            yield json.dumps(converted_data)
+def log_lines(log_path, since=None, until=None):
+    """Return the raw lines of the log from since until until.
+
+    Also returns the number of entries after the range, which offsets count
+    back from.
+    """
+    with log_path.open("rb") as fh:
+        if log_version(fh.readline()) is None:
+            raise OutdatedLogError(log_path)
+        start = fh.tell()
+        end = os.fstat(fh.fileno()).st_size
+        if since:
+            start = first_line_from(fh, since, start, end)
+        if until:
+            end = first_line_from(fh, until, start, end)
+        fh.seek(start)
+        lines = fh.read(end - start).splitlines(keepends=True)
+        newer = fh.read().count(b"\n") if until else 0
+    return lines, newer
+
+
+def in_range(time, since, until):
+    return (not since or time >= since) and (not until or time < until)
+
+
+def first_line_from(fh, time, start, end):
+    """Find the first line between offsets start and end timestamped at or after time.
+
+    Entries are appended in time order, so this is a binary search over byte
+    offsets, reading just one line at each step.
+    """
+    low, high = start, end
+    while low < high:
+        middle = (low + high) // 2
+        line_start, line = line_at(fh, middle)
+        if line_start >= high or line_time(line) >= time:
+            high = middle
+        else:
+            low = line_start + len(line)
+    return min(line_at(fh, low)[0], end) if low < end else end
+
+
+def line_at(fh, offset):
+    """Return the first line starting at or after offset, and its offset."""
+    fh.seek(offset - 1)
+    if fh.read(1) != b"\n":
+        fh.readline()
+    return fh.tell(), fh.readline()
+
+
+def line_time(line):
+    """The timestamp of a log line, decoding only the timestamp."""
+    position = line.rfind(b'"timestamp": ')
+    timestamp = raw_value(line, position + 13) if position >= 0 else None
+    return parse_timestamp(timestamp) if timestamp else OLDEST
+
+
+# Entries without a timestamp are treated as older than any time asked for.
+OLDEST = datetime.min.replace(tzinfo=timezone.utc)
+
+
+def entry_time(entry):
+    timestamp = entry.get("timestamp")
+    return parse_timestamp(timestamp) if timestamp else OLDEST
+
+
+def cached_range(entries, since, until):
+    """Like log_lines, for the parsed entries of a cached log."""
+
+    start = bisect.bisect_left(entries, since, key=entry_time) if since else 0
+    end = (
+        bisect.bisect_left(entries, until, lo=start, key=entry_time)
+        if until
+        else len(entries)
+    )
+    return entries[start:end], len(entries) - end
+
+
+def line_may_match(line, query):
+    """Check a log line against the query, decoding only its metadata.
+
+    Phrases are looked for in the raw line, as they'd be encoded in it.
+    """
+    if not all(encoded_in(phrase, line) for phrase in query.phrases):
+        return False
+    metadata = line_metadata(line)
+    return metadata is None or query.matches_metadata(**metadata)
+
+
+def encoded_in(text, line):
+    return any(
+        json.dumps(text, ensure_ascii=ensure_ascii)[1:-1].encode() in line
+        for ensure_ascii in (True, False)
+    )
+
+
+# json.dumps writes an entry's messages first, so the last occurrence of one
+# of these keys in a line is the entry's own.
+METADATA_KEYS = ("timestamp", "model", "tags", "usage")
+
+
+def line_metadata(line):
+    """Decode the fields of a log line that queries check, or None."""
+    metadata = {}
+    for key in METADATA_KEYS:
+        position = line.rfind(b'"%s": ' % key.encode())
+        if position < 0:
+            return None
+        metadata[key] = raw_value(line, position + len(key) + 4)
+
+    # The completion's model follows its (already escaped) choices.
+    position = line.rfind(b'"completion": ')
+    if position < 0:
+        return None
+    position += len(b'"completion": ')
+    metadata["completion_model"] = None
+    if not line.startswith(b"null", position):
+        position = line.find(b'"model": ', position)
+        if position >= 0:
+            metadata["completion_model"] = raw_value(line, position + 9)
+    return metadata
+
+
+def raw_value(line, position):
+    value, _ = JSON_DECODER.raw_decode(line[position:].decode("utf-8"))
+    return value
+
+
+JSON_DECODER = json.JSONDecoder()
+
+
+def convert_entry_pre_0_4(data, previous_timestamp=None):
+    messages = data["messages"]
+    usage = data["usage"]
+
+    if usage and "request_tokens" in usage:
+        usage["prompt_tokens"] = usage["request_tokens"]
+        del usage["request_tokens"]
+
+    tags = data.get("tags", [])
+    completion = data.get("completion") or data.get("response")
+
+    timestamp = (
+        data.get("timestamp")
+        or (
+            completion
+            and datetime.fromtimestamp(
+                completion.get("created"), tz=timezone.utc
+            ).isoformat()
+        )
+        or previous_timestamp
+    )
+
+    assert isinstance(messages, list), data
+    assert isinstance(tags, list), data
+    assert isinstance(completion, dict) or completion is None, (
+        completion,
+        data,
+    )
+    assert isinstance(usage, dict) or usage is None, (usage, data)
+
+    return {
+        "messages": messages,
+        "completion": completion,
+        "tags": tags,
+        "usage": usage,
+        "timestamp": timestamp,
+        "plugins": data.get("plugins", []),
+        "model": data.get("model"),
+    }
@@ -0,0 +1,185 @@
+"""Answer a question about input too large for the model's context.
+
+The input is streamed in chunks of at most `chunk_tokens` tokens. Each chunk
+is answered separately (map), with a bounded number of requests running at
+once, and the partial answers are then combined (reduce), in rounds if they
+don't fit into a single request.
+
+Every request is logged, tagged with an id derived from the question and
+settings, with the log writes grouped by a LogWriter. Running the same
+command again reuses the logged answers, so a failed run resumes where it
+stopped.
+"""
+import asyncio
+import hashlib
+
+from .conversation import Conversation, get_encoding
+from .log import LogWriter, search_conversations
+from .query import Query
+
+MAP_PROMPT = (
+    "You are given one part of a larger input. Answer the question using only"
+    " this part. If it contains nothing relevant, say so briefly."
+)
+REDUCE_PROMPT = (
+    "You are given answers to the same question, each from a different part of"
+    " a larger input. Combine them into a single answer to the question."
+)
+
+
+def content_hash(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8") + b"\0")
+    return digest.hexdigest()
+
+
+def run_tag(question, model, chunk_tokens):
+    return "mapreduce:" + content_hash(question, model, str(chunk_tokens))[:12]
+
+
+def chunk_text(lines, encoding, max_tokens):
+    """Group lines into chunks of at most max_tokens, splitting long lines."""
+    chunk = []
+    chunk_tokens = 0
+    for line in lines:
+        tokens = encoding.encode(line)
+        if chunk and chunk_tokens + len(tokens) > max_tokens:
+            yield "".join(chunk)
+            chunk = []
+            chunk_tokens = 0
+        if len(tokens) > max_tokens:
+            while len(tokens) > max_tokens:
+                yield encoding.decode(tokens[:max_tokens])
+                tokens = tokens[max_tokens:]
+            line = encoding.decode(tokens)
+        if tokens:
+            chunk.append(line)
+            chunk_tokens += len(tokens)
+    if chunk:
+        yield "".join(chunk)
+
+
+class MapReduce:
+    def __init__(self, log_file, question, model, *, chunk_tokens, concurrency):
+        self.log_file = log_file
+        self.question = question
+        self.model = model
+        self.chunk_tokens = chunk_tokens
+        self.concurrency = concurrency
+        self.encoding = get_encoding(model)
+        self.tag = run_tag(question, model, chunk_tokens)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.logged = self.load_logged()
+        self.writer = LogWriter(log_file)
+
+    def load_logged(self):
+        """Answers to requests made by earlier runs with the same settings."""
+        logged = {}
+        for _, conversation in search_conversations(
+            self.log_file, [], Query(tags=[self.tag])
+        ):
+            messages = conversation.messages
+            if len(messages) == 3 and messages[-1]["role"] == "assistant":
+                key = content_hash(messages[0]["content"], messages[1]["content"])
+                logged[key] = messages[-1]["content"]
+        return logged
+
+    async def complete(self, prompt, content, callback=None):
+        key = content_hash(prompt, content)
+        if key in self.logged:
+            if callback:
+                callback(self.logged[key])
+            return self.logged[key]
+
+        conversation = Conversation(
+            {
+                "messages": [
+                    {"role": "system", "content": prompt},
+                    {"role": "user", "content": content},
+                ],
+                "model": self.model,
+                "tags": [self.tag],
+            }
+        )
+        async with self.semaphore:
+            await conversation.complete(callback=callback)
+        self.writer.write(
+            conversation,
+            completion=conversation.completion,
+            usage=conversation.usage,
+            metrics=conversation.metrics,
+        )
+        return conversation.messages[-1]["content"]
+
+    async def map(self, chunks):
+        """Answer the question for each chunk, reading chunks as they're needed."""
+        chunks = iter(chunks)
+        tasks = []
+        while True:
+            chunk = await asyncio.to_thread(next, chunks, None)
+            if chunk is None:
+                break
+            content = f"Question: {self.question}\n\nInput:\n{chunk}"
+            tasks.append(asyncio.create_task(self.complete(MAP_PROMPT, content)))
+            running = [task for task in tasks if not task.done()]
+            if len(running) >= self.concurrency:
+                await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def reduce(self, results, callback=None):
+        """Combine partial answers, in rounds until they fit in one request."""
+        if len(results) == 1:
+            if callback:
+                callback(results[0])
+            return results[0]
+        while True:
+            groups = self.group(results)
+            if len(groups) == 1:
+                return await self.complete(
+                    REDUCE_PROMPT, self.reduce_content(groups[0]), callback
+                )
+            results = await asyncio.gather(
+                *(
+                    self.complete(REDUCE_PROMPT, self.reduce_content(group))
+                    for group in groups
+                )
+            )
+
+    def reduce_content(self, results):
+        partial_answers = "\n\n---\n\n".join(results)
+        return f"Question: {self.question}\n\nPartial answers:\n\n{partial_answers}"
+
+    def group(self, results):
+        """Split results into groups that fit in a request.
+
+        Every group has at least two results, so each round at least halves
+        the number of results.
+        """
+        groups = [[]]
+        tokens = 0
+        for result in results:
+            result_tokens = len(self.encoding.encode(result))
+            if len(groups[-1]) >= 2 and tokens + result_tokens > self.chunk_tokens:
+                groups.append([])
+                tokens = 0
+            groups[-1].append(result)
+            tokens += result_tokens
+        if len(groups) > 1 and len(groups[-1]) == 1:
+            groups[-2].extend(groups.pop())
+        return groups
+
+    async def run(self, lines, callback=None):
+        try:
+            results = await self.map(
+                chunk_text(lines, self.encoding, self.chunk_tokens)
+            )
+            if not results:
+                return ""
+            return await self.reduce(results, callback)
+        finally:
+            self.writer.close()
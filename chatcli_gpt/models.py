@@ -1,12 +1,17 @@
 import os
 import sys
+import time
+import asyncio
+import bisect
+import subprocess
 from pathlib import Path
+from collections import defaultdict
 import json
 
 import click
 from click_default_group import DefaultGroup
 
-OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY")
+from .trace import traced
 
 MODEL_CACHE = Path.home() / ".chatcli.models.json"
 
@@ -14,30 +19,169 @@ OPENAI_MODELS = [
     {
         "id": "gpt-4-1106-preview",
         "pricing": {"prompt": 0.01 / 1000, "completion": 0.03 / 1000},
+        "context_length": 128000,
+        "tools": True,
     },
     {
         "id": "gpt-3.5-turbo-1106",
         "pricing": {"prompt": 0.001 / 1000, "completion": 0.002 / 1000},
+        "context_length": 16385,
+        "tools": True,
     },
     {
         "id": "gpt-4",
         "pricing": {"prompt": 0.03 / 1000, "completion": 0.06 / 1000},
+        "context_length": 8192,
+        "tools": True,
     },
     {
         "id": "gpt-3.5-turbo",
         "pricing": {"prompt": 0.002 / 1000, "completion": 0.002 / 1000},
+        "context_length": 4096,
+        "tools": True,
     },
 ]
 
 
+# Where models can be fetched from: the prefix added to the provider's model
+# ids, the environment variable that must be set to use it, and how long to
+# wait for its catalog.
+PROVIDERS = {
+    "openai": {"prefix": "", "setting": "OPENAI_API_KEY", "timeout": 10.0},
+    "openrouter": {
+        "prefix": "openrouter/",
+        "setting": "OPENROUTER_API_KEY",
+        "timeout": 15.0,
+    },
+    "local": {"prefix": "local/", "setting": "CHATCLI_LOCAL_API_BASE", "timeout": 2.0},
+}
+
+# Set to a number of seconds to refresh a fetched catalog in the background
+# once it is older than that.
+MODELS_TTL = os.environ.get("CHATCLI_MODELS_TTL")
+
+
+class ModelRegistry:
+    """The available models, indexed for lookup by id, prefix and substring."""
+
+    def __init__(self, models):
+        self.models = models
+        self.ids = [model["id"] for model in models]
+        self.by_id = {model["id"]: model for model in models}
+        self.sorted_ids = sorted(self.by_id)
+        self.trigrams = defaultdict(set)
+        for position, model_id in enumerate(self.ids):
+            for trigram in trigrams(model_id):
+                self.trigrams[trigram].add(position)
+        self._matches = {}
+
+    def get(self, model_id):
+        return self.by_id.get(model_id)
+
+    def with_prefix(self, prefix):
+        start = bisect.bisect_left(self.sorted_ids, prefix)
+        end = bisect.bisect_left(self.sorted_ids, prefix + "\U0010ffff")
+        return self.sorted_ids[start:end]
+
+    def find(self, value):
+        """Return the first model id (in catalog order) containing value."""
+        if value not in self._matches:
+            self._matches[value] = next(
+                (
+                    self.ids[position]
+                    for position in self.candidates(value)
+                    if value in self.ids[position]
+                ),
+                None,
+            )
+        return self._matches[value]
+
+    def candidates(self, value):
+        value_trigrams = trigrams(value)
+        if not value_trigrams:
+            return range(len(self.ids))
+        positions = set.intersection(
+            *(self.trigrams.get(trigram, set()) for trigram in value_trigrams)
+        )
+        return sorted(positions)
+
+
+def trigrams(text):
+    return {text[idx : idx + 3] for idx in range(len(text) - 2)}
+
+
+_registry = None
+_registry_key = None
+
+
+def registry():
+    """Return the model registry, reloading it if the model cache changed."""
+    global _registry, _registry_key  # noqa: PLW0603
+
+    try:
+        stat = MODEL_CACHE.stat()
+        key = (MODEL_CACHE.resolve(), stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        stat = key = None
+
+    if _registry is None or key != _registry_key:
+        _registry = ModelRegistry(get_models())
+        _registry_key = key
+
+    if stat and MODELS_TTL and cache_age(stat) > float(MODELS_TTL):
+        refresh_in_background()
+
+    return _registry
+
+
+@traced("models.load")
 def get_models():
-    models = []
-    models.extend(OPENAI_MODELS)
-    if MODEL_CACHE.exists():
-        models += json.load(MODEL_CACHE.open())
+    cached = load_cache()
+    # Fetched details (such as context length) are added to the built in
+    # models, which keep their place at the start of the list.
+    cached_by_id = {model["id"]: model for model in cached}
+    builtin_ids = {model["id"] for model in OPENAI_MODELS}
+    models = [{**cached_by_id.get(model["id"], {}), **model} for model in OPENAI_MODELS]
+    models += [model for model in cached if model["id"] not in builtin_ids]
     return models
 
 
+def load_cache():
+    if not MODEL_CACHE.exists():
+        return []
+    with MODEL_CACHE.open(encoding="utf-8") as fh:
+        return json.load(fh)
+
+
+def cache_age(stat=None):
+    stat = stat or MODEL_CACHE.stat()
+    return time.time() - stat.st_mtime
+
+
+def write_cache(models):
+    """Replace the model cache atomically, so readers never see half of it."""
+    temp_file = MODEL_CACHE.with_name(f"{MODEL_CACHE.name}.{os.getpid()}.tmp")
+    with temp_file.open("w", encoding="utf-8") as fh:
+        json.dump(models, fh)
+    os.replace(temp_file, MODEL_CACHE)
+
+
+def refresh_in_background(source=None):
+    if source and not provider_configured(source):
+        return
+    # Claim the refresh by touching the cache, so other commands started
+    # before it finishes don't start their own.
+    os.utime(MODEL_CACHE)
+    subprocess.Popen(
+        [sys.executable, "-m", "chatcli_gpt", "models", "fetch", source or "--all"],
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "CHATCLI_DAEMON": "0"},
+        start_new_session=True,
+    )
+
+
 @click.group(
     cls=DefaultGroup,
     default="list",
@@ -50,47 +194,203 @@ def models():
 
 @models.command(name="list", help="List available models")
 def list_models():
-    for model in get_models():
+    for model in registry().models:
         click.echo(f"{model['id']}")
 
 
 @models.command(name="fetch", help="Fetch models from a source.")
-@click.argument("source", type=click.Choice(choices=["openrouter"]))
-def fetch(source):
-    if source == "openrouter":
-        if not OPENROUTER_API_KEY:
-            click.echo("OPENROUTER_API_KEY not set", file=sys.stderr)
+@click.argument("source", type=click.Choice(choices=list(PROVIDERS)), required=False)
+@click.option(
+    "--all",
+    "fetch_all",
+    is_flag=True,
+    help="Fetch from every configured provider at once.",
+)
+@click.option(
+    "--ttl",
+    type=float,
+    help="Only fetch if the cached models are older than this many seconds.",
+)
+@click.option(
+    "--timeout", type=float, help="Seconds to wait for each provider to respond."
+)
+@click.option(
+    "--background", is_flag=True, help="Fetch in a background process and return."
+)
+def fetch(source, fetch_all, ttl, timeout, background):
+    if bool(source) == fetch_all:
+        raise click.UsageError("Give a source, or --all.")
+    if ttl is not None and MODEL_CACHE.exists() and cache_age() < ttl:
+        return
+
+    providers = [name for name in PROVIDERS if provider_configured(name)]
+    if source:
+        if source not in providers:
+            click.echo(f"{PROVIDERS[source]['setting']} not set", file=sys.stderr)
             sys.exit(1)
-        models = list(fetch_openrouter_models())
-        json.dump(models, MODEL_CACHE.open("w"))
+        providers = [source]
+    if not providers:
+        settings = [provider["setting"] for provider in PROVIDERS.values()]
+        click.echo(
+            "No provider is configured: set "
+            f"{', '.join(settings[:-1])} or {settings[-1]}.",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if background and MODEL_CACHE.exists():
+        refresh_in_background(source)
+        return
+
+    results = asyncio.run(fetch_catalogs(providers, timeout))
+    for name, result in results.items():
+        if isinstance(result, BaseException):
+            click.echo(
+                f"{name}: Could not fetch models, keeping the old list."
+                f" ({type(result).__name__}: {result})",
+                file=sys.stderr,
+            )
+    write_cache(merge_catalogs(load_cache(), results))
+    if all(isinstance(result, BaseException) for result in results.values()):
+        sys.exit(1)
 
 
-def fetch_openrouter_models():
-    from openai import OpenAI
+async def fetch_catalogs(providers, timeout=None):
+    """Fetch every provider's models concurrently.
 
-    client = OpenAI(
-        base_url=api_base("openrouter/"),
-        api_key=api_key("openrouter/"),
+    Returns a dict of provider name to a list of models, or the exception
+    raised by that provider.
+    """
+
+    async def fetch_with_timeout(name):
+        return await asyncio.wait_for(
+            fetch_provider_models(name), timeout or PROVIDERS[name]["timeout"]
+        )
+
+    results = await asyncio.gather(
+        *(fetch_with_timeout(name) for name in providers), return_exceptions=True
     )
+    return dict(zip(providers, results))
+
+
+async def fetch_provider_models(name):
+    from openai import AsyncOpenAI
+
+    prefix = PROVIDERS[name]["prefix"]
+    async with AsyncOpenAI(
+        base_url=api_base(prefix), api_key=api_key(prefix), max_retries=0
+    ) as client:
+        return [
+            catalog_entry(name, model.to_dict()) async for model in client.models.list()
+        ]
+
+
+def catalog_entry(name, model):
+    entry = {
+        **model,
+        "id": PROVIDERS[name]["prefix"] + model["id"],
+        "provider": name,
+    }
+    # vLLM and similar local servers report the context length as max_model_len.
+    context_length = model.get("context_length") or model.get("max_model_len")
+    if context_length:
+        entry["context_length"] = context_length
+    if name == "local":
+        entry.setdefault("pricing", {"prompt": 0, "completion": 0})
+    return entry
+
+
+def merge_catalogs(cached, results):
+    """Replace the cached models of each provider that was fetched successfully."""
+    fetched = {
+        name: models
+        for name, models in results.items()
+        if not isinstance(models, BaseException)
+    }
+    merged = [
+        model
+        for model in cached
+        if (model.get("provider") or provider(model["id"])) not in fetched
+    ]
+    for models in fetched.values():
+        merged.extend(models)
+    return merged
+
+
+def usage_cost(model, usage):
+    """The price in dollars of a completion by model, or 0 if it isn't known."""
+    catalog = registry()
+    candidates = (
+        catalog.get(model_id)
+        for model_id in (
+            model,
+            "-".join(model.split("-")[:-1]),
+            "openrouter/" + model,
+            "local/" + model,
+        )
+    )
+    # Fetched catalogs include models without published prices.
+    model_price = next(
+        (
+            candidate["pricing"]
+            for candidate in candidates
+            if candidate and "pricing" in candidate
+        ),
+        None,
+    )
+    if model_price is None:
+        return 0
+
+    return (
+        float(model_price["prompt"]) * usage["prompt_tokens"]
+        + float(model_price["completion"]) * usage["completion_tokens"]
+    )
+
+
+def supports_tools(model):
+    """Whether plugins are offered to model as tools, or only as text formats.
+
+    Set CHATCLI_TOOLS to 1 or 0 to override what the catalog says.
+    """
+    setting = os.environ.get("CHATCLI_TOOLS")
+    if setting in ("0", "1"):
+        return setting == "1"
+    details = registry().get(model) or {}
+    if "tools" in details:
+        return details["tools"]
+    # Catalogs such as OpenRouter's list the request parameters a model takes.
+    return "tools" in (details.get("supported_parameters") or [])
+
+
+def provider(model):
+    for name, config in PROVIDERS.items():
+        if config["prefix"] and model.startswith(config["prefix"]):
+            return name
+    return "openai"
+
 
-    for model in client.models.list():
-        model.id = f"openrouter/{model.id}"
-        yield model.to_dict()
+def provider_configured(name):
+    return bool(os.environ.get(PROVIDERS[name]["setting"]))
 
 
 def api_base(model):
-    if model.startswith("openrouter/"):
+    name = provider(model)
+    if name == "openrouter":
         return "https://openrouter.ai/api/v1"
-    return "https://api.openai.com/v1"
+    if name == "local":
+        return os.environ.get("CHATCLI_LOCAL_API_BASE")
+    return os.environ.get("OPENAI_BASE_URL", "https://api.openai.com/v1")
 
 
 def api_key(model):
-    if model.startswith("openrouter/"):
+    name = provider(model)
+    if name == "openrouter":
         return os.environ.get("OPENROUTER_API_KEY")
+    if name == "local":
+        # Local servers rarely check the key, but the client insists on one.
+        return os.environ.get("CHATCLI_LOCAL_API_KEY", "local")
     return os.environ.get("OPENAI_API_KEY")
 
 
 def api_model_name(model):
-    if model.startswith("openrouter/"):
-        return model[len("openrouter/") :]
-    return model
+    return model.removeprefix(PROVIDERS[provider(model)]["prefix"])
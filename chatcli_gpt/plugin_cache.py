@@ -0,0 +1,95 @@
+"""Cache of search and Wolfram plugin results.
+
+Results are kept in a SQLite database in the home directory, so they are
+shared between conversations. Each plugin's results expire after its TTL,
+and once the cache holds MAX_ENTRIES results the least recently used are
+evicted.
+"""
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+from contextlib import closing
+
+CACHE_PATH = Path.home() / ".chatcli.plugins.db"
+TTLS = {
+    "search": int(os.environ.get("CHATCLI_SEARCH_TTL", 24 * 60 * 60)),
+    "wolfram": int(os.environ.get("CHATCLI_WOLFRAM_TTL", 7 * 24 * 60 * 60)),
+}
+MAX_ENTRIES = int(os.environ.get("CHATCLI_PLUGIN_CACHE_SIZE", 1000))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    plugin TEXT NOT NULL,
+    query TEXT NOT NULL,
+    output TEXT NOT NULL,
+    created REAL NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (plugin, query)
+);
+CREATE INDEX IF NOT EXISTS results_used ON results(used);
+"""
+
+
+def is_cached(plugin):
+    return plugin in TTLS
+
+
+def normalize(query):
+    return " ".join(query.lower().split())
+
+
+def connect():
+    db = sqlite3.connect(CACHE_PATH, timeout=10)
+    db.executescript(SCHEMA)
+    return db
+
+
+def cached(plugin, query, run):
+    """Return run(query), or its cached output if it's recent enough.
+
+    A cached output has a "cached" key with the time it was created. Outputs
+    without a result, such as errors, aren't cached.
+    """
+    key = normalize(query)
+    now = time.time()
+    with closing(connect()) as db, db:
+        row = db.execute(
+            "SELECT output, created FROM results WHERE plugin = ? AND query = ?",
+            (plugin, key),
+        ).fetchone()
+        if row and now - row[1] < TTLS[plugin]:
+            db.execute(
+                "UPDATE results SET used = ? WHERE plugin = ? AND query = ?",
+                (now, plugin, key),
+            )
+            return {**json.loads(row[0]), "cached": row[1]}
+
+    output = run(query)
+    if output.get("result") and not output.get("error"):
+        store(plugin, key, output, now)
+    return output
+
+
+def store(plugin, key, output, now):
+    with closing(connect()) as db, db:
+        db.execute(
+            "INSERT OR REPLACE INTO results (plugin, query, output, created, used)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (plugin, key, json.dumps(output), now, now),
+        )
+        db.execute(
+            "DELETE FROM results WHERE rowid IN"
+            " (SELECT rowid FROM results ORDER BY used DESC LIMIT -1 OFFSET ?)",
+            (MAX_ENTRIES,),
+        )
+
+
+def describe_age(created, now=None):
+    seconds = (now or time.time()) - created
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= size:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count > 1 else ''} ago"
+    return "just now"
@@ -0,0 +1,385 @@
+"""Plugins let the model run code, search the web and so on.
+
+The model uses a plugin by calling it as a tool, if it supports tools, or
+by writing a block of text in the plugin's format (such as `SEARCH("...")`),
+and the results are sent back to it. Plugins are built in or installed by other packages under
+the "chatcli_gpt.plugins" entry point group, as a `Plugin`. A plugin's
+module, and its dependencies, are only imported when it's first used.
+"""
+import re
+import ast
+import json
+import asyncio
+import functools
+import importlib
+import threading
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+
+from .. import plugin_cache
+from ..trace import span
+
+ENTRY_POINT_GROUP = "chatcli_gpt.plugins"
+
+
+@dataclass(frozen=True)
+class Plugin:
+    """A plugin, described without importing it.
+
+    `run` names the function that runs the plugin, as "module:function". It
+    is called with the tool arguments and a callback for output as it is
+    produced, and returns a dict with a "result" and/or an "error". If
+    `is_async`, it's a coroutine function; otherwise it runs in a thread.
+    At most `concurrency` calls to it run at once.
+
+    `pattern` matches the plugin's blocks in the answer's text; its groups
+    are the values of the parameters, in order. Parameters in `quoted` may
+    be written as python string literals.
+    """
+
+    name: str
+    run: str
+    description: str
+    parameters: dict
+    pattern: str | None = None
+    quoted: tuple = ()
+    is_async: bool = False
+    concurrency: int = 4
+
+    def load(self):
+        module_name, _, function = self.run.partition(":")
+        return getattr(importlib.import_module(module_name), function)
+
+    def regex(self):
+        return re.compile(self.pattern, re.DOTALL)
+
+    def opening(self):
+        """The text every block starts with, or "" if the pattern has none."""
+        if "|" in self.pattern:
+            return ""
+        literal = ""
+        rest = self.pattern
+        while rest:
+            if rest[0] == "\\" and rest[1:2] and not rest[1].isalnum():
+                char, rest = rest[1], rest[2:]
+            elif rest[0] in ".^$*+?{}[]()\\":
+                break
+            else:
+                char, rest = rest[0], rest[1:]
+            if rest[:1] in ("*", "?", "{"):
+                break
+            literal += char
+            if rest[:1] == "+":
+                break
+        return literal
+
+    def block_arguments(self, block):
+        groups = block if isinstance(block, tuple) else (block,)
+        arguments = dict(zip(self.parameters, groups))
+        for name in self.quoted:
+            arguments[name] = query_text(arguments[name])
+        return arguments
+
+    def tool_arguments(self, text):
+        """Decode a tool call's arguments, raising ValueError if they're invalid."""
+        arguments = json.loads(text or "{}")
+        if not isinstance(arguments, dict):
+            raise ValueError("the arguments must be an object")
+        missing = [name for name in self.parameters if name not in arguments]
+        if missing:
+            raise ValueError(f"missing {', '.join(missing)}")
+        return arguments
+
+    def tool(self):
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        name: {"type": "string", "description": description}
+                        for name, description in self.parameters.items()
+                    },
+                    "required": list(self.parameters),
+                },
+            },
+        }
+
+
+PLUGINS = {
+    plugin.name: plugin
+    for plugin in [
+        Plugin(
+            "pyeval",
+            "chatcli_gpt.plugins.execute:run_python",
+            "Run python code and return what it prints. The value of a final"
+            " expression is printed too.",
+            {"code": "The python code to run."},
+            pattern=r"EVALUATE:\n+```(?:python)?\n(.*?)```",
+        ),
+        Plugin(
+            "bash",
+            "chatcli_gpt.plugins.execute:run_bash",
+            "Run a bash script and return its output.",
+            {"code": "The script to run."},
+            pattern=r"EVALUATE:\n+```(?:bash)?\n(.*?)```",
+        ),
+        Plugin(
+            "search",
+            "chatcli_gpt.plugins.search:run",
+            "Search the web with DuckDuckGo and return the top results.",
+            {"query": "The search query."},
+            # One query per line: with DOTALL, .* would run on to the last ")".
+            pattern=r"SEARCH\(([^\n]*)\)",
+            quoted=("query",),
+        ),
+        Plugin(
+            "wolfram",
+            "chatcli_gpt.plugins.wolfram:run",
+            "Ask Wolfram Alpha a question, for facts, maths and conversions.",
+            {"query": "The question."},
+            pattern=r"WOLFRAM\(([^\n]*)\)",
+            quoted=("query",),
+        ),
+        Plugin(
+            "save",
+            "chatcli_gpt.plugins.save:run",
+            "Save text to a file.",
+            {"filename": "The file to write.", "contents": "The text to write."},
+            pattern=r"SAVE\((.*?)\)\n```\w*\n(.*?)```",
+            quoted=("filename",),
+        ),
+        Plugin(
+            "image",
+            "chatcli_gpt.plugins.image:run",
+            "Generate an image from a description, and save it to a file.",
+            {"filename": "The file to write.", "prompt": "A description of the image."},
+            pattern=r"IMAGE\((.*?)\)\n```\w*\n(.*?)```",
+            quoted=("filename",),
+            is_async=True,
+        ),
+    ]
+}
+
+
+@functools.cache
+def get_plugin(name):
+    """Return the built in or installed plugin called name, or None."""
+    if name in PLUGINS:
+        return PLUGINS[name]
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        if entry_point.name == name:
+            return entry_point.load()
+    return None
+
+
+def tool_definitions(plugins):
+    """The tools for a request, one for each of the plugins."""
+    return [plugin.tool() for plugin in filter(None, map(get_plugin, plugins))]
+
+
+def without_text_instructions(messages, plugins):
+    """Leave out the system messages that teach the plugins' text formats.
+
+    When the plugins are offered as tools, the instructions would only have
+    the model write blocks instead of calling them.
+    """
+    patterns = [
+        plugin.regex()
+        for plugin in filter(None, map(get_plugin, plugins))
+        if plugin.pattern
+    ]
+    return [
+        message
+        for message in messages
+        if message["role"] != "system"
+        or not any(pattern.search(message.get("content") or "") for pattern in patterns)
+    ]
+
+
+def query_text(block):
+    search_term = block.strip()
+    if search_term[0] in "\"'":
+        search_term = ast.literal_eval(search_term)
+    return search_term
+
+
+def evaluate_plugins(response_text, plugins, output=None):
+    """Run the plugin blocks in a response and return their formatted output.
+
+    `output` is called with the output of the bash and pyeval plugins as
+    they produce it.
+    """
+
+    async def evaluate():
+        return await PluginRunner(plugins, output).results(response_text)
+
+    return asyncio.run(evaluate())
+
+
+class PluginRunner:
+    """Start plugins while an answer streams, as each block is completed.
+
+    Feed the answer's tokens to `feed` from the event loop, then await
+    `results` with the whole answer. Output the plugins produce before the
+    answer is finished is held back, so it isn't mixed into the answer.
+    """
+
+    def __init__(self, plugins, output=None):
+        # Unknown plugins are ignored.
+        self.plugins = {
+            plugin.name: plugin for plugin in filter(None, map(get_plugin, plugins))
+        }
+        self.output = output
+        self.text = ""
+        self.scanned = 0
+        self.positions = {name: 0 for name in self.plugins}
+        self.unfinished = {name: [] for name in self.plugins}
+        self.queries = {name: set() for name in self.plugins}
+        self.tasks = {name: [] for name in self.plugins}
+        self.semaphores = {}
+        self.held_output = []
+        self.answering = True
+        self.lock = threading.Lock()
+
+    def feed(self, token):
+        self.text += token
+        # Blocks end at the end of a line, so only complete lines are searched.
+        if "\n" in token:
+            self.scanned = self.text.rindex("\n") + 1
+            self.detect()
+
+    def detect(self):
+        for plugin in self.plugins.values():
+            if not plugin.pattern:
+                continue
+            if opening := plugin.opening():
+                self.detect_openings(plugin, opening)
+                continue
+            pattern = plugin.regex()
+            while match := pattern.search(
+                self.text, self.positions[plugin.name], self.scanned
+            ):
+                self.positions[plugin.name] = match.end()
+                self.start(plugin, match)
+
+    def detect_openings(self, plugin, opening):
+        # A block can only begin at its opening, so text without one is
+        # never searched again. Openings whose block hasn't matched yet may
+        # still be being written, and are tried again on the next line.
+        pattern = plugin.regex()
+        name = plugin.name
+        candidates = self.unfinished[name]
+        self.unfinished[name] = []
+        position = self.positions[name]
+        while (begin := self.text.find(opening, position, self.scanned)) != -1:
+            candidates.append(begin)
+            position = begin + 1
+        position = max(position, self.scanned - len(opening) + 1)
+        end = 0
+        for begin in candidates:
+            if begin < end:
+                continue
+            if match := pattern.match(self.text, begin, self.scanned):
+                end = match.end()
+                self.start(plugin, match)
+            else:
+                self.unfinished[name].append(begin)
+        self.positions[name] = max(position, end)
+
+    def start(self, plugin, match):
+        block = match.group(1) if match.re.groups == 1 else match.groups()
+        arguments = plugin.block_arguments(block)
+        if plugin_cache.is_cached(plugin.name):
+            # Asking the same question twice in one response gets one answer.
+            query = plugin_cache.normalize(arguments["query"])
+            if query in self.queries[plugin.name]:
+                return
+            self.queries[plugin.name].add(query)
+        self.tasks[plugin.name].append(
+            asyncio.ensure_future(self.run(plugin, arguments))
+        )
+
+    async def run(self, plugin, arguments):
+        if plugin.name not in self.semaphores:
+            self.semaphores[plugin.name] = asyncio.Semaphore(plugin.concurrency)
+        output = self.write_output if self.output else None
+        async with self.semaphores[plugin.name]:
+            with span(f"plugin.{plugin.name}"):
+                if plugin.is_async:
+                    return await plugin.load()(arguments, output)
+                return await asyncio.to_thread(lambda: plugin.load()(arguments, output))
+
+    async def call_tools(self, tool_calls):
+        """Run an answer's tool calls in parallel, returning the tool messages."""
+        self.finish_answer()
+
+        async def call(tool_call):
+            name = tool_call["function"]["name"]
+            if name not in self.plugins:
+                output = {"error": f"There is no tool called {name!r}."}
+            else:
+                plugin = self.plugins[name]
+                try:
+                    arguments = plugin.tool_arguments(
+                        tool_call["function"]["arguments"]
+                    )
+                except ValueError as error:
+                    output = {"error": f"Invalid arguments for {name}: {error}"}
+                else:
+                    output = await self.run(plugin, arguments)
+            return {
+                "role": "tool",
+                "tool_call_id": tool_call["id"],
+                "content": format_block(output) or "(No output.)",
+            }
+
+        return await asyncio.gather(*(call(tool_call) for tool_call in tool_calls))
+
+    def write_output(self, text):
+        with self.lock:
+            if self.answering:
+                self.held_output.append(text)
+            else:
+                self.output(text)
+
+    async def results(self, response_text):
+        """Wait for the plugins to finish, and return their formatted output."""
+        self.text = response_text
+        self.scanned = len(response_text)
+        self.detect()
+        self.finish_answer()
+        tasks = [task for plugin in self.plugins for task in self.tasks[plugin]]
+        return "\n".join(
+            format_block(result) for result in await asyncio.gather(*tasks)
+        )
+
+    def finish_answer(self):
+        """Show the output held back while the answer was streaming."""
+        with self.lock:
+            self.answering = False
+            held, self.held_output = self.held_output, []
+            for text in held:
+                self.output(text)
+
+    def cancel(self):
+        """Stop waiting for the plugins (though running code can't be stopped)."""
+        for tasks in self.tasks.values():
+            for task in tasks:
+                task.cancel()
+
+
+# TODO: Truncate the output to meet token requirement and save $$.
+def format_block(output):
+    output_blocks = []
+    if output.get("result"):
+        label = "RESULT"
+        if output.get("cached"):
+            age = plugin_cache.describe_age(output["cached"])
+            label += f" (cached {age}, may be out of date)"
+        output_blocks.append(f"{label}:\n```\n{output['result']}\n```")
+    if output.get("error"):
+        output_blocks.append(f"ERROR:\n```\n{output['error']}\n```")
+    return "\n".join(output_blocks)
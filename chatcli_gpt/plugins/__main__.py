@@ -0,0 +1,10 @@
+import sys
+import prompt_toolkit
+
+from . import evaluate_plugins
+
+print("(Finish input with <Alt-Enter> or <Esc><Enter>)")
+input_text = prompt_toolkit.prompt(
+    multiline=True, prompt=">>> ", continuation_prompt="... "
+)
+print(evaluate_plugins(input_text, sys.argv[1:]))
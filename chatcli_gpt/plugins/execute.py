@@ -0,0 +1,149 @@
+"""The bash and pyeval plugins.
+
+Code runs in a child process in its own session, with a wall clock timeout
+and CPU and memory limits. Output is passed on as it is produced, and the
+start and end of long output are kept for the answer.
+"""
+import os
+import sys
+import codecs
+import signal
+import threading
+import contextlib
+import subprocess
+from pathlib import Path
+
+# Limits for code run by the bash and pyeval plugins.
+EXEC_TIMEOUT = float(os.environ.get("CHATCLI_EXEC_TIMEOUT", 10))
+EXEC_CPU_SECONDS = int(os.environ.get("CHATCLI_EXEC_CPU_SECONDS", 10))
+EXEC_MEMORY_BYTES = int(os.environ.get("CHATCLI_EXEC_MEMORY_BYTES", 2 * 1024**3))
+# The start and end of longer output is kept, the middle is left out.
+EXEC_OUTPUT_BYTES = int(os.environ.get("CHATCLI_EXEC_OUTPUT_BYTES", 16 * 1024))
+
+
+def run_bash(arguments, output=None):
+    return exec_bash(arguments["code"], output)
+
+
+def run_python(arguments, output=None):
+    return exec_python(arguments["code"], output)
+
+
+def exec_bash(code, output=None):
+    return run_code(["/bin/bash", "-c", code], None, output)
+
+
+def exec_python(code, output=None):
+    runner = Path(__file__).with_name("pyeval.py")
+    return run_code([sys.executable, "-u", str(runner)], code, output)
+
+
+def run_code(args, stdin_text, output=None):
+    """Run a command with limits, passing its output to `output` as it comes.
+
+    The command gets EXEC_TIMEOUT seconds before it is killed, along with
+    anything it started.
+    """
+    process = subprocess.Popen(  # noqa: S603
+        with_exec_limits(args),
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    lock = threading.Lock()
+    captured = {"result": CappedOutput(), "error": CappedOutput()}
+    readers = [
+        threading.Thread(target=read_output, args=(pipe, capture, output, lock))
+        for pipe, capture in (
+            (process.stdout, captured["result"]),
+            (process.stderr, captured["error"]),
+        )
+    ]
+    for reader in readers:
+        reader.start()
+
+    with contextlib.suppress(BrokenPipeError):
+        process.stdin.write((stdin_text or "").encode("utf-8"))
+        process.stdin.close()
+    timed_out = False
+    try:
+        process.wait(timeout=EXEC_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(process.pid, signal.SIGKILL)
+        process.wait()
+    for reader in readers:
+        # A background process that left the session can hold a pipe open.
+        reader.join(timeout=1)
+
+    result = {name: capture.text().strip() for name, capture in captured.items()}
+    if timed_out:
+        message = f"Timed out after {EXEC_TIMEOUT:g} seconds."
+        result["error"] = "\n".join(filter(None, [result["error"], message]))
+    return result
+
+
+# Sets the limits and then becomes the command, so they apply before it
+# starts. preexec_fn would do the same, but isn't safe in a threaded program.
+LIMITS_TRAMPOLINE = """\
+import os, sys, resource
+cpu, memory = int(sys.argv[1]), int(sys.argv[2])
+resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+os.execv(sys.argv[3], sys.argv[3:])
+"""
+
+
+def with_exec_limits(args):
+    return [
+        sys.executable,
+        "-I",
+        "-S",
+        "-c",
+        LIMITS_TRAMPOLINE,
+        str(EXEC_CPU_SECONDS),
+        str(EXEC_MEMORY_BYTES),
+        *args,
+    ]
+
+
+def read_output(pipe, capture, output, lock):
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    with pipe:
+        while data := pipe.read1(4096):
+            capture.write(data)
+            if output:
+                with lock:
+                    output(decoder.decode(data))
+
+
+class CappedOutput:
+    """Keep the first and last EXEC_OUTPUT_BYTES / 2 bytes of an output."""
+
+    def __init__(self, limit=None):
+        limit = limit or EXEC_OUTPUT_BYTES
+        self.head_limit = limit // 2
+        self.tail_limit = limit - self.head_limit
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+        room = self.head_limit - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        self.tail += data
+        if len(self.tail) > self.tail_limit:
+            del self.tail[: len(self.tail) - self.tail_limit]
+
+    def text(self):
+        head = self.head.decode("utf-8", errors="replace")
+        tail = self.tail.decode("utf-8", errors="replace")
+        omitted = self.size - len(self.head) - len(self.tail)
+        if omitted:
+            return f"{head}\n... ({omitted} bytes left out) ...\n{tail}"
+        return head + tail
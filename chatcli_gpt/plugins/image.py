@@ -0,0 +1,55 @@
+"""The image plugin: generate images and save them to files.
+
+Images are requested as base64, which saves downloading each one in a second
+request, and are decoded to the file in chunks. The plugin is async, so the
+images for several blocks are generated at once.
+"""
+import os
+import base64
+import asyncio
+from pathlib import Path
+
+IMAGE_SIZE = os.environ.get("CHATCLI_IMAGE_SIZE", "256x256")
+IMAGE_COUNT = int(os.environ.get("CHATCLI_IMAGE_COUNT", 1))
+# A multiple of 4, so each chunk decodes on its own.
+CHUNK_CHARS = 64 * 1024
+
+
+async def run(arguments, _output=None):
+    import openai
+
+    client = openai.AsyncOpenAI()
+    try:
+        response = await client.images.generate(
+            prompt=arguments["prompt"],
+            n=IMAGE_COUNT,
+            size=IMAGE_SIZE,
+            response_format="b64_json",
+        )
+    except openai.OpenAIError as error:
+        return {"error": f"Image generation failed: {error}"}
+    finally:
+        await client.close()
+
+    paths = image_paths(arguments["filename"], len(response.data))
+    await asyncio.gather(
+        *(
+            asyncio.to_thread(write_image, path, image.b64_json)
+            for path, image in zip(paths, response.data)
+        )
+    )
+    return {"result": "Saved to: " + ", ".join(map(str, paths))}
+
+
+def image_paths(filename, count):
+    """Number the files when there's more than one image: cat-1.png, cat-2.png."""
+    path = Path(filename)
+    if count == 1:
+        return [path]
+    return [path.with_stem(f"{path.stem}-{index}") for index in range(1, count + 1)]
+
+
+def write_image(path, b64_data):
+    with path.open("wb") as fh:
+        for start in range(0, len(b64_data), CHUNK_CHARS):
+            fh.write(base64.b64decode(b64_data[start : start + CHUNK_CHARS]))
@@ -0,0 +1,32 @@
+"""Run the python code on stdin for the pyeval plugin.
+
+This runs in a child process, so the code can be stopped and limited
+without affecting chatcli. Like the python REPL, the value of a final
+expression is printed.
+"""
+import ast
+import sys
+import traceback
+
+
+def main():
+    code = sys.stdin.read()
+    scope = {"__name__": "__main__"}
+    try:
+        mod = ast.parse(code, mode="exec")
+        if mod.body and isinstance(mod.body[-1], ast.Expr):
+            last_expr = mod.body.pop()
+            exec(compile(mod, "<ast>", "exec"), scope)
+            result = eval(
+                compile(ast.Expression(last_expr.value), "<ast>", "eval"), scope
+            )
+            if result is not None:
+                print(result)
+        else:
+            exec(compile(mod, "<ast>", "exec"), scope)
+    except Exception:  # noqa: BLE001
+        print(traceback.format_exc())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,9 @@
+"""The save plugin: write text to a file."""
+from pathlib import Path
+
+
+def run(arguments, _output=None):
+    filename = arguments["filename"]
+    with Path(filename).open("w", encoding="utf-8") as fh:
+        fh.write(arguments["contents"])
+    return {"result": f"Saved to: {filename}"}
@@ -0,0 +1,17 @@
+"""The search plugin: search the web with DuckDuckGo."""
+import json
+import duckduckgo_search
+
+from .. import plugin_cache
+
+
+def run(arguments, _output=None):
+    return plugin_cache.cached("search", arguments["query"], exec_duckduckgo)
+
+
+def exec_duckduckgo(search_term):
+    return {
+        "result": json.dumps(
+            duckduckgo_search.ddg(search_term, max_results=5), indent=2
+        )
+    }
@@ -0,0 +1,20 @@
+"""The wolfram plugin: ask Wolfram Alpha."""
+import os
+import wolframalpha
+
+from .. import plugin_cache
+
+
+def run(arguments, _output=None):
+    return plugin_cache.cached("wolfram", arguments["query"], exec_wolfram)
+
+
+def exec_wolfram(query):
+    api_key = os.environ.get("WOLFRAM_ALPHA_API_KEY")
+    if not api_key:
+        return {
+            "error": "WOLFRAM_ALPHA_API_KEY is not configured. (Set as an environment variable.)"
+        }
+    client = wolframalpha.Client(api_key)
+    result = client.query(query)
+    return {"result": next(result.results).text}
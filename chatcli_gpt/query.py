@@ -0,0 +1,153 @@
+"""A small query language for selecting conversations from the log.
+
+    model:gpt-4* tag:work since:2024-01 cost>0.10 "exact phrase"
+
+All the terms must match. `model:` takes a glob pattern and `tag:` a tag.
+`since:` and `until:` take a year, month, day or time in ISO format (in
+local time): `since:` matches from the start of the period and `until:` up
+to its end. `cost` (in dollars) and `tokens` are compared with <, <=, >, >=
+or =. Any other word, or quoted phrase, must appear in the question.
+
+The terms other than phrases only need an entry's metadata, so they can be
+checked before its messages are decoded.
+"""
+import re
+import shlex
+import operator
+from fnmatch import fnmatchcase
+from datetime import datetime, timedelta
+from dataclasses import dataclass, field
+
+from .models import usage_cost
+
+FIELDS = ("model", "tag", "since", "until")
+COMPARISON = re.compile(r"(cost|tokens)(<=|>=|<|>|=)(.+)")
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "=": operator.eq,
+}
+
+
+class QueryError(ValueError):
+    pass
+
+
+@dataclass
+class Query:
+    models: list = field(default_factory=list)
+    tags: list = field(default_factory=list)
+    since: datetime | None = None
+    until: datetime | None = None
+    # (name, operator, value) with name "cost" or "tokens".
+    comparisons: list = field(default_factory=list)
+    phrases: list = field(default_factory=list)
+
+    @classmethod
+    def parse(cls, text):
+        query = cls()
+        try:
+            terms = shlex.split(text or "")
+        except ValueError as error:
+            raise QueryError(f"Invalid query: {error}") from None
+        for term in terms:
+            name, _, value = term.partition(":")
+            if name in FIELDS and value:
+                query.add_field(name, value)
+            elif match := COMPARISON.fullmatch(term):
+                name, op, value = match.groups()
+                try:
+                    query.comparisons.append((name, op, float(value)))
+                except ValueError:
+                    raise QueryError(f"Invalid number: {value}") from None
+            else:
+                query.phrases.append(term)
+        return query
+
+    def add_field(self, name, value):
+        if name == "model":
+            self.models.append(value)
+        elif name == "tag":
+            self.tags.append(value)
+        elif name == "since":
+            start, _ = parse_period(value)
+            self.since = max(self.since, start) if self.since else start
+        else:
+            _, end = parse_period(value)
+            self.until = min(self.until, end) if self.until else end
+
+    def matches(self, conversation):
+        completion = conversation.completion or {}
+        return self.matches_metadata(
+            timestamp=conversation.timestamp,
+            model=conversation.model,
+            tags=conversation.tags,
+            usage=conversation.usage,
+            completion_model=completion.get("model"),
+        ) and all(phrase in conversation for phrase in self.phrases)
+
+    def matches_metadata(self, *, timestamp, model, tags, usage, completion_model):
+        if not all(fnmatchcase(model or "", pattern) for pattern in self.models):
+            return False
+        if not all(tag in tags for tag in self.tags):
+            return False
+        if self.since or self.until:
+            if not timestamp:
+                return False
+            time = parse_timestamp(timestamp)
+            if (self.since and time < self.since) or (
+                self.until and time >= self.until
+            ):
+                return False
+        return self.matches_usage(usage, completion_model)
+
+    def matches_usage(self, usage, completion_model):
+        for name, op, value in self.comparisons:
+            if name == "tokens":
+                actual = usage["total_tokens"] if usage else 0
+            else:
+                actual = (
+                    usage_cost(completion_model, usage)
+                    if usage and completion_model
+                    else 0
+                )
+            if not OPERATORS[op](actual, value):
+                return False
+        return True
+
+    def has_costs(self):
+        return any(name == "cost" for name, _, _ in self.comparisons)
+
+
+def parse_period(text):
+    """Return the start and end of a year, month, day or time."""
+    try:
+        if re.fullmatch(r"\d{4}", text):
+            start = datetime(int(text), 1, 1)
+            end = datetime(int(text) + 1, 1, 1)
+        elif re.fullmatch(r"\d{4}-\d{2}", text):
+            year, month = map(int, text.split("-"))
+            start = datetime(year, month, 1)
+            end = datetime(year + month // 12, month % 12 + 1, 1)
+        else:
+            start = end = datetime.fromisoformat(text)
+            if re.fullmatch(r"\d{4}-\d{2}-\d{2}", text):
+                end = start + timedelta(days=1)
+    except ValueError:
+        raise QueryError(f"Invalid date: {text}") from None
+    return local_time(start), local_time(end)
+
+
+def local_time(time):
+    return time if time.tzinfo else time.astimezone()
+
+
+def parse_timestamp(timestamp):
+    try:
+        return local_time(datetime.fromisoformat(timestamp))
+    except ValueError:
+        import dateutil.parser
+
+        return local_time(dateutil.parser.parse(timestamp))
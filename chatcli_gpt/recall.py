@@ -0,0 +1,178 @@
+"""Recall relevant answers from earlier conversations.
+
+Each answered question in the log is indexed once in a SQLite FTS5 table
+next to the log (`<log>.recall`), which ranks matches with BM25. The index
+is built the first time recall is used and is then kept up to date as
+entries are appended to the log.
+"""
+import re
+import sqlite3
+from pathlib import Path
+from contextlib import closing
+
+from . import threads
+from .conversation import get_encoding
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL,
+    answer_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_answer_hash ON entries(answer_hash);
+CREATE VIRTUAL TABLE IF NOT EXISTS answers USING fts5(
+    question,
+    answer,
+    tokenize='porter unicode61'
+);
+"""
+
+RECALL_TOKENS = 1000
+# Only the most distinctive words of a long question are searched for.
+MAX_QUERY_TERMS = 32
+RECALL_HEADER = "Relevant excerpts from earlier conversations:"
+
+
+def index_path(log_path):
+    log_path = Path(log_path)
+    return log_path.with_name(log_path.name + ".recall")
+
+
+def connect(log_path, *, create=False):
+    path = index_path(log_path)
+    if not create and not path.exists():
+        return None
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def answered_question(messages):
+    """Return the (question, answer) an entry added, or None."""
+    if len(messages) < 2 or messages[-1]["role"] != "assistant":
+        return None
+    if messages[-2]["role"] != "user":
+        return None
+    return messages[-2].get("content") or "", messages[-1].get("content") or ""
+
+
+def add_entries(db, messages_list):
+    (next_id,) = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM entries").fetchone()
+    for entry_id, messages in enumerate(messages_list, start=next_id):
+        pair = answered_question(messages)
+        answer_hash = threads.prefix_hashes(messages[-2:])[-1] if pair else None
+        # Tagging an entry adds another snapshot of the same answer.
+        if (
+            pair
+            and not db.execute(
+                "SELECT 1 FROM entries WHERE answer_hash = ?", (answer_hash,)
+            ).fetchone()
+        ):
+            db.execute(
+                "INSERT INTO answers (rowid, question, answer) VALUES (?, ?, ?)",
+                (entry_id, *pair),
+            )
+        db.execute(
+            "INSERT INTO entries (id, hash, answer_hash) VALUES (?, ?, ?)",
+            (entry_id, threads.prefix_hashes(messages)[-1], answer_hash),
+        )
+
+
+def update(log_path, entries, previous_state, log_state):
+    """Index entries just appended to the log, if recall has been used.
+
+    The states identify the log before and after the append (see
+    log.log_state), so recall can tell the index is current without reading
+    the log. An index that was already behind is left for `recall` to sync.
+    """
+    db = connect(log_path)
+    if db is None:
+        return
+    with closing(db), db:
+        if indexed_state(db) != str(previous_state):
+            return
+        add_entries(db, [entry.get("messages") or [] for entry in entries])
+        set_log_state(db, log_state)
+
+
+def indexed_state(db):
+    row = db.execute("SELECT value FROM meta WHERE key = 'log_state'").fetchone()
+    return row[0] if row else None
+
+
+def set_log_state(db, log_state):
+    db.execute(
+        "INSERT OR REPLACE INTO meta (key, value) VALUES ('log_state', ?)",
+        (str(log_state),),
+    )
+
+
+def sync(db, messages_list):
+    """Index the entries missing from the index, rebuilding it if stale."""
+    (indexed,) = db.execute("SELECT COUNT(*) FROM entries").fetchone()
+    if indexed:
+        last = db.execute(
+            "SELECT hash FROM entries WHERE id = ?", (indexed,)
+        ).fetchone()
+        if (
+            indexed > len(messages_list)
+            or not last
+            or last[0] != threads.prefix_hashes(messages_list[indexed - 1])[-1]
+        ):
+            db.execute("DELETE FROM entries")
+            db.execute("DELETE FROM answers")
+            indexed = 0
+    add_entries(db, messages_list[indexed:])
+
+
+def search_query(text):
+    """Build an FTS5 query matching any of the words in text."""
+    words = list(dict.fromkeys(re.findall(r"\w+", text.lower())))
+    words = sorted(words, key=len, reverse=True)[:MAX_QUERY_TERMS]
+    return " OR ".join('"' + word + '"' for word in words)
+
+
+def recall(log_path, log_state, load_messages, question, limit, exclude=()):
+    """Return up to `limit` (question, answer) pairs most relevant to question.
+
+    If the index doesn't match `log_state`, `load_messages()` is called for
+    the messages of every entry in the log to bring it up to date. Answers
+    whose question is in `exclude` (the conversation so far) are skipped.
+    """
+    query = search_query(question)
+    if not query or limit <= 0:
+        return []
+    with closing(connect(log_path, create=True)) as db, db:
+        if indexed_state(db) != str(log_state):
+            sync(db, load_messages())
+            set_log_state(db, log_state)
+        rows = db.execute(
+            "SELECT question, answer FROM answers WHERE answers MATCH ?"
+            " ORDER BY bm25(answers) LIMIT ?",
+            (query, limit + len(exclude)),
+        ).fetchall()
+    return [
+        (past_question, answer)
+        for past_question, answer in rows
+        if past_question not in exclude
+    ][:limit]
+
+
+def recall_message(excerpts, model, max_tokens=RECALL_TOKENS):
+    """Format excerpts as a system message of at most max_tokens tokens."""
+    if not excerpts:
+        return None
+    encoding = get_encoding(model)
+    per_excerpt = max_tokens // len(excerpts)
+    parts = [RECALL_HEADER]
+    for question, answer in excerpts:
+        text = f"Q: {question}\nA: {answer}"
+        tokens = encoding.encode(text)
+        if len(tokens) > per_excerpt:
+            text = encoding.decode(tokens[:per_excerpt]) + " ..."
+        parts.append(text)
+    return "\n\n".join(parts)
@@ -0,0 +1,111 @@
+"""Display streamed answers.
+
+With `--markdown` an answer on a terminal is rendered as Markdown while it
+streams. Rendering the whole answer again for every token would get slower
+as the answer grows, so the answer is split into blocks at blank lines
+outside code fences: a finished block is printed once, and only the block
+still being written is re-rendered, in a rich Live region below the others.
+"""
+import sys
+import time
+
+FENCES = ("```", "~~~")
+# Tokens arrive faster than the terminal needs redrawing.
+REFRESH_INTERVAL = 0.05
+
+
+def answer_renderer(*, markdown=False):
+    """Return a renderer for an answer written to stdout."""
+    if markdown and sys.stdout.isatty():
+        from rich.console import Console
+
+        return MarkdownRenderer(Console(file=sys.stdout))
+    return PlainRenderer(sys.stdout)
+
+
+class PlainRenderer:
+    """Write tokens as they are, flushing each one only on a terminal."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.interactive = stream.isatty()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.finish()
+
+    def write(self, text):
+        self.stream.write(text)
+        if self.interactive:
+            self.stream.flush()
+
+    def finish(self):
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class MarkdownRenderer:
+    def __init__(self, console):
+        from rich.live import Live
+
+        self.console = console
+        self.live = Live(
+            console=console, auto_refresh=False, vertical_overflow="visible"
+        )
+        self.block = []
+        self.line = ""
+        self.fence = None
+        self.last_refresh = 0.0
+
+    def __enter__(self):
+        self.live.start()
+        return self
+
+    def __exit__(self, *_exc_info):
+        self.finish()
+
+    def write(self, text):
+        *lines, self.line = (self.line + text).split("\n")
+        for line in lines:
+            self.end_line(line)
+        if time.monotonic() - self.last_refresh >= REFRESH_INTERVAL:
+            self.refresh()
+
+    def end_line(self, line):
+        stripped = line.strip()
+        if self.fence:
+            if stripped.startswith(self.fence):
+                self.fence = None
+        elif stripped.startswith(FENCES):
+            self.fence = stripped[:3]
+        elif not stripped:
+            if self.block:
+                self.print_block()
+            return
+        self.block.append(line)
+
+    def print_block(self):
+        from rich.markdown import Markdown
+
+        block = Markdown("\n".join(self.block))
+        self.block = []
+        # Show only what follows the block in the live region before the
+        # block is printed above it.
+        self.live.update(self.trailing(), refresh=False)
+        self.live.console.print(block)
+        self.live.console.print()
+
+    def trailing(self):
+        from rich.markdown import Markdown
+
+        return Markdown("\n".join([*self.block, self.line]))
+
+    def refresh(self):
+        self.live.update(self.trailing(), refresh=True)
+        self.last_refresh = time.monotonic()
+
+    def finish(self):
+        self.refresh()
+        self.live.stop()
@@ -0,0 +1,392 @@
+import json
+import sqlite3
+from contextlib import closing
+from datetime import timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    timestamp TEXT,
+    model TEXT,
+    completion TEXT,
+    plugins TEXT NOT NULL DEFAULT '[]',
+    question TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS messages (
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    position INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT,
+    extra TEXT,
+    PRIMARY KEY (entry_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tags (
+    entry_id INTEGER NOT NULL REFERENCES entries(id),
+    position INTEGER NOT NULL,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (entry_id, position)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS usage (
+    entry_id INTEGER PRIMARY KEY REFERENCES entries(id),
+    model TEXT,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    total_tokens INTEGER,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    entry_id INTEGER PRIMARY KEY REFERENCES entries(id),
+    ttft REAL,
+    duration REAL,
+    tokens_per_sec REAL,
+    retries INTEGER
+);
+CREATE INDEX IF NOT EXISTS entries_timestamp ON entries(timestamp);
+CREATE INDEX IF NOT EXISTS entries_model ON entries(model);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags(tag, entry_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS question_fts USING fts5(
+    question,
+    content='entries',
+    content_rowid='id',
+    tokenize='trigram'
+);
+"""
+
+# The trigram tokenizer can't match anything shorter than a trigram.
+MIN_FTS_TERM = 3
+
+# Under WAL, NORMAL can lose the last commits on a power loss but never
+# corrupts the database, which OFF can.
+SYNCHRONOUS = {"none": "NORMAL", "batch": "NORMAL", "always": "FULL"}
+
+
+# Bumped when SCHEMA changes, so older logs get the new tables.
+SCHEMA_VERSION = 1
+# Entries are loaded in batches, starting small for commands that only want
+# the first few.
+FIRST_BATCH = 16
+MAX_BATCH = 512
+
+
+def connect(log_path, *, create=False):
+    if not create and not log_path.exists():
+        raise FileNotFoundError(log_path)
+    db = sqlite3.connect(log_path)
+    (version,) = db.execute("PRAGMA user_version").fetchone()
+    if version < SCHEMA_VERSION:
+        with db:
+            db.executescript(SCHEMA)
+            db.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+    return db
+
+
+def create_log(log_path, version):
+    with closing(connect(log_path, create=True)) as db, db:
+        # WAL lets readers carry on while another process appends.
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+            (version,),
+        )
+
+
+def append_entries(log_path, entries, durability="none"):
+    with closing(connect(log_path)) as db, db:
+        db.execute(f"PRAGMA synchronous={SYNCHRONOUS[durability]}")
+        for entry in entries:
+            insert_entry(db, entry)
+
+
+def insert_entry(db, entry):
+    messages = entry.get("messages") or []
+    cursor = db.execute(
+        "INSERT INTO entries (timestamp, model, completion, plugins, question)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (
+            entry.get("timestamp"),
+            entry.get("model"),
+            json.dumps(entry.get("completion")),
+            json.dumps(entry.get("plugins") or []),
+            question_text(messages),
+        ),
+    )
+    entry_id = cursor.lastrowid
+    db.execute(
+        "INSERT INTO question_fts (rowid, question) VALUES (?, ?)",
+        (entry_id, question_text(messages)),
+    )
+    db.executemany(
+        "INSERT INTO messages (entry_id, position, role, content, extra)"
+        " VALUES (?, ?, ?, ?, ?)",
+        (
+            (entry_id, position, *split_message(message))
+            for position, message in enumerate(messages)
+        ),
+    )
+    db.executemany(
+        "INSERT INTO tags (entry_id, position, tag) VALUES (?, ?, ?)",
+        (
+            (entry_id, position, tag)
+            for position, tag in enumerate(entry.get("tags") or [])
+        ),
+    )
+    usage = entry.get("usage")
+    if usage:
+        completion = entry.get("completion") or {}
+        db.execute(
+            "INSERT INTO usage (entry_id, model, prompt_tokens, completion_tokens,"
+            " total_tokens, data) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                entry_id,
+                completion.get("model"),
+                usage.get("prompt_tokens"),
+                usage.get("completion_tokens"),
+                usage.get("total_tokens"),
+                json.dumps(usage),
+            ),
+        )
+    metrics = entry.get("metrics")
+    if metrics:
+        db.execute(
+            "INSERT INTO metrics (entry_id, ttft, duration, tokens_per_sec, retries)"
+            " VALUES (?, ?, ?, ?, ?)",
+            (
+                entry_id,
+                metrics.get("ttft"),
+                metrics.get("duration"),
+                metrics.get("tokens_per_sec"),
+                metrics.get("retries"),
+            ),
+        )
+
+
+def question_text(messages):
+    if not messages:
+        return ""
+    message = messages[-2] if len(messages) > 1 else messages[-1]
+    return message.get("content") or ""
+
+
+def split_message(message):
+    extra = {
+        key: value for key, value in message.items() if key not in ("role", "content")
+    }
+    return (
+        message["role"],
+        message.get("content"),
+        json.dumps(extra) if extra else None,
+    )
+
+
+def join_message(role, content, extra):
+    message = {"role": role, "content": content}
+    if extra:
+        message.update(json.loads(extra))
+    return message
+
+
+def entry_count(log_path):
+    with closing(connect(log_path)) as db:
+        (count,) = db.execute("SELECT COALESCE(MAX(id), 0) FROM entries").fetchone()
+        return count
+
+
+def log_entries(log_path, since=None, until=None):
+    with closing(connect(log_path)) as db:
+        where, params = time_range("timestamp", since, until)
+        rows = db.execute(
+            "SELECT id, timestamp, model, completion, plugins FROM entries"
+            + where
+            + " ORDER BY id",
+            params,
+        )
+        for batch in batches(rows):
+            yield from load_entries(db, batch)
+
+
+def batches(rows):
+    size = FIRST_BATCH
+    while batch := rows.fetchmany(size):
+        yield batch
+        size = min(size * 2, MAX_BATCH)
+
+
+def load_entries(db, rows):
+    """Load the entries for rows of the entries table, with a query per table."""
+    if not rows:
+        return []
+    ids = [row[0] for row in rows]
+    selected = f"entry_id IN ({', '.join('?' * len(ids))})"
+    messages = {entry_id: [] for entry_id in ids}
+    for entry_id, *message in db.execute(
+        "SELECT entry_id, role, content, extra FROM messages"
+        f" WHERE {selected} ORDER BY entry_id, position",
+        ids,
+    ):
+        messages[entry_id].append(join_message(*message))
+    tags = {entry_id: [] for entry_id in ids}
+    for entry_id, tag in db.execute(
+        f"SELECT entry_id, tag FROM tags WHERE {selected} ORDER BY entry_id, position",
+        ids,
+    ):
+        tags[entry_id].append(tag)
+    usage = dict(db.execute(f"SELECT entry_id, data FROM usage WHERE {selected}", ids))
+    metrics = {
+        entry_id: metrics_dict(*values)
+        for entry_id, *values in db.execute(
+            "SELECT entry_id, ttft, duration, tokens_per_sec, retries FROM metrics"
+            f" WHERE {selected}",
+            ids,
+        )
+    }
+    return [
+        {
+            "messages": messages[entry_id],
+            "completion": json.loads(completion) if completion else None,
+            "usage": json.loads(usage[entry_id]) if entry_id in usage else None,
+            "tags": tags[entry_id],
+            "timestamp": timestamp,
+            "plugins": json.loads(plugins),
+            "model": model,
+            "metrics": metrics.get(entry_id),
+        }
+        for entry_id, timestamp, model, completion, plugins in rows
+    ]
+
+
+def metrics_dict(ttft, duration, tokens_per_sec, retries):
+    return {
+        "ttft": ttft,
+        "duration": duration,
+        "tokens_per_sec": tokens_per_sec,
+        "retries": retries,
+    }
+
+
+def search_entries(log_path, offsets, query):
+    """Yield (offset, entry) pairs matching query, most recent first.
+
+    Offsets count back from the end of the log, so entry ids (which are
+    contiguous because the log is append only) convert to offsets directly.
+    Everything but cost is checked in SQL; costs depend on model prices, so
+    they're checked from the usage table before the entry is loaded.
+    """
+    with closing(connect(log_path)) as db:
+        (total,) = db.execute("SELECT COALESCE(MAX(id), 0) FROM entries").fetchone()
+
+        clauses = []
+        params = []
+        if offsets:
+            clauses.append(f"id IN ({', '.join('?' * len(offsets))})")
+            params.extend(total - offset + 1 for offset in offsets)
+        for pattern in query.models:
+            clauses.append("COALESCE(model, '') GLOB ?")
+            params.append(pattern)
+        for tag in query.tags:
+            clauses.append("id IN (SELECT entry_id FROM tags WHERE tag = ?)")
+            params.append(tag)
+        if query.since:
+            clauses.append("timestamp >= ?")
+            params.append(utc_timestamp(query.since))
+        if query.until:
+            clauses.append("timestamp < ?")
+            params.append(utc_timestamp(query.until))
+        for name, op, value in query.comparisons:
+            if name == "tokens":
+                clauses.append(
+                    "COALESCE((SELECT total_tokens FROM usage"
+                    f" WHERE entry_id = id), 0) {op} ?"
+                )
+                params.append(value)
+        for phrase in query.phrases:
+            if len(phrase) >= MIN_FTS_TERM:
+                clauses.append(
+                    "id IN (SELECT rowid FROM question_fts WHERE question_fts MATCH ?)"
+                )
+                params.append('"' + phrase.replace('"', '""') + '"')
+            # FTS matching is case insensitive, so confirm the exact match.
+            clauses.append("instr(question, ?) > 0")
+            params.append(phrase)
+
+        where = " WHERE " + " AND ".join(clauses) if clauses else ""
+        rows = db.execute(
+            "SELECT id, timestamp, model, completion, plugins FROM entries"
+            + where
+            + " ORDER BY id DESC",
+            params,
+        )
+        for batch in batches(rows):
+            if query.has_costs():
+                batch = [
+                    row
+                    for row in batch
+                    if query.matches_usage(*entry_usage(db, row[0]))
+                ]
+            for row, entry in zip(batch, load_entries(db, batch)):
+                yield total - row[0] + 1, entry
+
+
+def entry_usage(db, entry_id):
+    row = db.execute(
+        "SELECT data, model FROM usage WHERE entry_id = ?", (entry_id,)
+    ).fetchone()
+    return (json.loads(row[0]), row[1]) if row else (None, None)
+
+
+def time_range(column, since, until):
+    """A WHERE clause selecting column from since until until."""
+    clauses = []
+    params = []
+    if since:
+        clauses.append(f"{column} >= ?")
+        params.append(utc_timestamp(since))
+    if until:
+        clauses.append(f"{column} < ?")
+        params.append(utc_timestamp(until))
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+def utc_timestamp(time):
+    """Format time as the log's timestamps are, so they compare as text."""
+    return time.astimezone(timezone.utc).isoformat()
+
+
+def usage_entries(log_path, since=None, until=None):
+    with closing(connect(log_path)) as db:
+        where, params = time_range("entries.timestamp", since, until)
+        rows = db.execute(
+            "SELECT entries.timestamp, usage.model, usage.data FROM usage"
+            " JOIN entries ON entries.id = usage.entry_id"
+            + where
+            + " ORDER BY entries.id",
+            params,
+        )
+        for timestamp, model, data in rows.fetchall():
+            yield {
+                "timestamp": timestamp,
+                "completion": {"model": model},
+                "usage": json.loads(data),
+            }
+
+
+def metrics_entries(log_path, since=None, until=None):
+    with closing(connect(log_path)) as db:
+        where, params = time_range("entries.timestamp", since, until)
+        rows = db.execute(
+            "SELECT entries.timestamp, entries.model, metrics.ttft, metrics.duration,"
+            " metrics.tokens_per_sec, metrics.retries FROM metrics"
+            " JOIN entries ON entries.id = metrics.entry_id"
+            + where
+            + " ORDER BY entries.id",
+            params,
+        )
+        for timestamp, model, *metrics in rows.fetchall():
+            yield {
+                "timestamp": timestamp,
+                "model": model,
+                "metrics": metrics_dict(*metrics),
+            }
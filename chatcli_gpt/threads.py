@@ -0,0 +1,128 @@
+"""Index of the conversation threads in a log.
+
+Every change to a conversation appends a new snapshot to the log, so the
+log is really a forest of threads. Each entry's parent is the most recent
+earlier entry whose messages are the longest prefix of its own: the answer
+it continues, or the question a retry branched from.
+
+The index lives next to the log in `<log>.threads`. Each entry stores the
+hash of its messages, chained message by message, so the hash of every
+prefix of a new entry can be looked up without comparing it to the rest of
+the log. Entry ids count from 1 in log order.
+"""
+import json
+import hashlib
+import sqlite3
+from pathlib import Path
+from contextlib import closing
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY,
+    parent INTEGER,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_hash ON threads(hash, id);
+"""
+
+
+def index_path(log_path):
+    log_path = Path(log_path)
+    return log_path.with_name(log_path.name + ".threads")
+
+
+def connect(log_path, *, create=False):
+    path = index_path(log_path)
+    if not create and not path.exists():
+        return None
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA)
+    return db
+
+
+def prefix_hashes(messages):
+    """Return the hash of each prefix of messages, shortest first."""
+    digest = hashlib.sha1(usedforsecurity=False)
+    hashes = []
+    for message in messages:
+        digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+        hashes.append(digest.hexdigest()[:16])
+    return hashes or [""]
+
+
+def add_entries(db, messages_list):
+    (next_id,) = db.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM threads").fetchone()
+    for entry_id, messages in enumerate(messages_list, start=next_id):
+        hashes = prefix_hashes(messages)
+        latest = dict(
+            db.execute(
+                "SELECT hash, MAX(id) FROM threads"
+                f" WHERE hash IN ({', '.join('?' * len(hashes))}) GROUP BY hash",
+                hashes,
+            )
+        )
+        parent = next(
+            (latest[digest] for digest in reversed(hashes) if digest in latest), None
+        )
+        db.execute(
+            "INSERT INTO threads (id, parent, hash) VALUES (?, ?, ?)",
+            (entry_id, parent, hashes[-1]),
+        )
+
+
+def update(log_path, entries):
+    """Index entries just appended to the log, if the log has an index."""
+    db = connect(log_path)
+    if db is None:
+        return
+    with closing(db), db:
+        add_entries(db, [entry.get("messages") or [] for entry in entries])
+
+
+def create(log_path):
+    with closing(connect(log_path, create=True)):
+        pass
+
+
+def parents(log_path, messages_list):
+    """Return each entry's parent id (or None), indexing the log if needed.
+
+    `messages_list` is the messages of every entry in the log. Entries the
+    index hasn't seen are added; if the log no longer matches the index
+    (it was replaced or rewritten) the index is rebuilt.
+    """
+    with closing(connect(log_path, create=True)) as db, db:
+        (indexed,) = db.execute("SELECT COUNT(*) FROM threads").fetchone()
+        if indexed:
+            last = db.execute(
+                "SELECT hash FROM threads WHERE id = ?", (indexed,)
+            ).fetchone()
+            if (
+                indexed > len(messages_list)
+                or not last
+                or last[0] != prefix_hashes(messages_list[indexed - 1])[-1]
+            ):
+                db.execute("DELETE FROM threads")
+                indexed = 0
+        add_entries(db, messages_list[indexed:])
+        return [
+            parent for (parent,) in db.execute("SELECT parent FROM threads ORDER BY id")
+        ]
+
+
+def children(parent_ids):
+    """Map each entry id to the ids of its children, oldest first."""
+    result = {}
+    for entry_id, parent in enumerate(parent_ids, start=1):
+        result.setdefault(parent, []).append(entry_id)
+    return result
+
+
+def heads(parent_ids):
+    """Return the ids of entries that no later entry continues."""
+    continued = set(parent_ids)
+    return {
+        entry_id
+        for entry_id in range(1, len(parent_ids) + 1)
+        if entry_id not in continued
+    }
@@ -0,0 +1,141 @@
+"""Timing spans for the stages of a command.
+
+Spans are only recorded when tracing is enabled, either with `--profile`
+(which prints a breakdown when the command finishes) or by setting
+CHATCLI_TRACE to a file name, which receives a Chrome trace (load it in
+chrome://tracing or https://ui.perfetto.dev).
+"""
+import os
+import json
+import time
+import atexit
+import inspect
+import threading
+import functools
+import contextlib
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.start = time.perf_counter()
+        self.events = []
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            self.reset()
+
+    def reset(self):
+        self.start = time.perf_counter()
+        self.events = []
+
+    def record(self, name, start, duration, args=None):
+        self.events.append(
+            {
+                "name": name,
+                "start": start - self.start,
+                "duration": duration,
+                "thread": threading.get_ident(),
+                "args": args or {},
+            }
+        )
+
+    def summary(self):
+        """Return (name, count, total seconds) for each span, in start order."""
+        totals = {}
+        for event in self.events:
+            count, total = totals.get(event["name"], (0, 0.0))
+            totals[event["name"]] = (count + 1, total + event["duration"])
+        return [(name, count, total) for name, (count, total) in totals.items()]
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        return {
+            "traceEvents": [
+                {
+                    "name": event["name"],
+                    "ph": "X",
+                    "ts": event["start"] * 1e6,
+                    "dur": event["duration"] * 1e6,
+                    "pid": pid,
+                    "tid": event["thread"],
+                    "args": event["args"],
+                }
+                for event in self.events
+            ],
+            "displayTimeUnit": "ms",
+        }
+
+
+tracer = Tracer()
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    if not tracer.enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.record(name, start, time.perf_counter() - start, args)
+
+
+def traced(name):
+    """Decorate a function (or coroutine function) to run inside a span."""
+
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def format_profile():
+    elapsed = time.perf_counter() - tracer.start
+    lines = [f"Profile: {elapsed * 1000:.1f} ms total"]
+    for name, count, total in tracer.summary():
+        lines.append(
+            f"  {name:24} {count:6d} {total * 1000:10.1f} ms"
+            f" {total / elapsed * 100:5.1f}%"
+        )
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def profiling(report):
+    """Trace until exit, then pass the formatted profile to `report`."""
+    was_enabled = tracer.enabled
+    tracer.enable()
+    try:
+        yield
+    finally:
+        report(format_profile())
+        tracer.enabled = was_enabled
+
+
+def write_chrome_trace(path):
+    with open(path, "w", encoding="utf-8") as fh:  # noqa: PTH123
+        json.dump(tracer.chrome_trace(), fh)
+
+
+TRACE_FILE = os.environ.get("CHATCLI_TRACE")
+
+if TRACE_FILE:
+    tracer.enable()
+    atexit.register(write_chrome_trace, TRACE_FILE)
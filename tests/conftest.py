@@ -8,7 +8,12 @@ from openai import OpenAI, AsyncOpenAI
 from openai.types.chat import ChatCompletion, ChatCompletionMessage, ChatCompletionChunk
 
 from openai.types.chat.chat_completion import Choice
-from openai.types.chat.chat_completion_chunk import ChoiceDelta, Choice as ChunkChoice
+from openai.types.chat.chat_completion_chunk import (
+    ChoiceDelta,
+    ChoiceDeltaToolCall,
+    ChoiceDeltaToolCallFunction,
+    Choice as ChunkChoice,
+)
 
 
 @pytest.fixture(autouse=True)
@@ -68,6 +73,56 @@ def to_chunks(model, tokens):
         )
 
 
+def tool_call_chunks(model, calls):
+    """Stream tool calls, given as (id, name, arguments), in fragments."""
+    for index, (call_id, name, arguments) in enumerate(calls):
+        fragments = [arguments[:5], arguments[5:]]
+        for position, fragment in enumerate(fragments):
+            yield ChatCompletionChunk(
+                id="chatcmpl-123",
+                object="chat.completion.chunk",
+                created=1677652288,
+                model=model,
+                choices=[
+                    ChunkChoice(
+                        delta=ChoiceDelta(
+                            role="assistant",
+                            tool_calls=[
+                                ChoiceDeltaToolCall(
+                                    index=index,
+                                    id=None if position else call_id,
+                                    type="function",
+                                    function=ChoiceDeltaToolCallFunction(
+                                        name=None if position else name,
+                                        arguments=fragment,
+                                    ),
+                                )
+                            ],
+                        ),
+                        index=0,
+                        finish_reason=None,
+                    )
+                ],
+            )
+
+
+class ByteEncoding:
+    """Stands in for a tiktoken encoding, with one token per byte."""
+
+    def encode(self, text):
+        return list(text.encode("utf-8"))
+
+    def decode(self, tokens):
+        return bytes(tokens).decode("utf-8", errors="replace")
+
+
+@pytest.fixture(autouse=True)
+def _plugin_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        "chatcli_gpt.plugin_cache.CACHE_PATH", tmp_path / ".chatcli.plugins.db"
+    )
+
+
 @pytest.fixture(autouse=True)
 def _fake_assistant(mocker):
     def ai(message, model):
@@ -84,7 +139,7 @@ def _fake_assistant(mocker):
 
         yield from to_chunks(model, tokens)
 
-    def advanced_ai(model, messages, *, stream=False):
+    def advanced_ai(model, messages, *, stream=False, **_kwargs):
         if stream:
             return (x for x in streaming_ai(model, messages[-1]["content"]))
         return ChatCompletion(
@@ -121,6 +176,10 @@ def _fake_assistant(mocker):
     )
     mocker.patch("openai.AsyncOpenAI", return_value=mock_async_client)
 
+    mocker.patch("chatcli_gpt.files.get_encoding", return_value=ByteEncoding())
+    mocker.patch("chatcli_gpt.recall.get_encoding", return_value=ByteEncoding())
+    mocker.patch("chatcli_gpt.mapreduce.get_encoding", return_value=ByteEncoding())
+
     mocker.patch(
         "chatcli_gpt.conversation.completion_usage",
         return_value={"prompt_tokens": 11, "completion_tokens": 10, "total_tokens": 41},
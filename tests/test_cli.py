@@ -1,13 +1,20 @@
 # pylint: disable=redefined-outer-name
+import asyncio
 from datetime import datetime, timedelta, timezone
 import json
 import os
+import signal
+import sqlite3
+import time
 from pathlib import Path
 from unittest.mock import patch
 import pytest
 from chatcli_gpt.cli import cli
+from chatcli_gpt.log import OutdatedLogError
 from click.testing import CliRunner
 
+from .conftest import to_chunks, tool_call_chunks
+
 
 def test_chat_default(chatcli):
     result = chatcli("--quick", input="What is your name?")
@@ -42,6 +49,242 @@ def test_chat_with_file(chatcli):
     )
 
 
+def test_chat_with_directory(chatcli):
+    Path("docs").mkdir()
+    Path("docs/a.txt").write_text("Hello, world!")
+    Path("docs/b.txt").write_text("Hello, world!")
+    result = chatcli("-f docs", input="What's in these files?")
+    assert "Skipped docs/b.txt: duplicate" in result.output
+
+    messages = last_conversation_data(chatcli)["messages"]
+    assert messages[1]["content"] == (
+        "The file 'docs/a.txt' contains:\n```\nHello, world!```"
+    )
+    assert messages[2]["content"] == "What's in these files?"
+
+
+def test_chat_recall(chatcli):
+    chatcli("chat --quick", input="How do I list files in python?")
+    chatcli("chat --quick", input="What is the capital of France?")
+    chatcli("chat --quick", input="How do I delete files in python?")
+
+    chatcli("chat --quick --recall 1", input="Which python module lists files?")
+    messages = last_conversation_data(chatcli)["messages"]
+    assert messages[-3]["role"] == "system"
+    assert messages[-3]["content"].startswith(
+        "Relevant excerpts from earlier conversations:"
+    )
+    assert "python" in messages[-3]["content"]
+    assert "France" not in messages[-3]["content"]
+    assert messages[-2]["content"] == "Which python module lists files?"
+
+    # Written entries are added to the index as they are logged.
+    chatcli("chat --quick", input="What is the capital of Germany?")
+    chatcli("chat --quick --recall 1", input="Capital of Germany?")
+    messages = last_conversation_data(chatcli)["messages"]
+    assert "WHAT IS THE CAPITAL OF GERMANY?" in messages[-3]["content"]
+
+
+def test_mapreduce(chatcli):
+    text = "".join(f"line {idx}\n" for idx in range(10))
+    result = chatcli("mapreduce 'Which lines?' --chunk-tokens 20", input=text)
+    assert "LINE 0" in result.output
+    assert "LINE 9" in result.output
+
+    conversations = [
+        entry
+        for entry in logged_entries()
+        if entry["tags"] and entry["tags"][0].startswith("mapreduce:")
+    ]
+    maps = [c for c in conversations if "Input:\n" in c["messages"][1]["content"]]
+    assert [c["messages"][1]["content"].split("Input:\n")[1] for c in maps] == [
+        "line 0\nline 1\n",
+        "line 2\nline 3\n",
+        "line 4\nline 5\n",
+        "line 6\nline 7\n",
+        "line 8\nline 9\n",
+    ]
+    assert len(conversations) > len(maps)
+
+    # Running again reuses the logged answers.
+    entries = len(logged_entries())
+    rerun = chatcli("mapreduce 'Which lines?' --chunk-tokens 20", input=text)
+    assert f"Resuming with {len(conversations)} logged answers." in rerun.output
+    assert rerun.output.endswith(result.output)
+    assert len(logged_entries()) == entries
+
+
+def test_interrupt_saves_partial_answer(chatcli, mocker):
+    async def interrupted(model, *_args, **_kwargs):
+        chunks = to_chunks(model, ["Hello", " world"])
+        yield next(chunks)
+        yield next(chunks)
+        os.kill(os.getpid(), signal.SIGINT)
+        await asyncio.sleep(10)
+        for chunk in chunks:
+            yield chunk
+
+    client = mocker.Mock()
+    client.chat.completions.create = mocker.AsyncMock(side_effect=interrupted)
+    mocker.patch("openai.AsyncOpenAI", return_value=client)
+
+    result = chatcli("chat --quick", input="Say hello world")
+    assert "Interrupted: saved the partial answer." in result.output
+
+    data = last_conversation_data(chatcli)
+    assert data["messages"][-1] == {"role": "assistant", "content": "Hello"}
+    assert data["completion"]["choices"][0]["finish_reason"] == "cancelled"
+    # The handler is removed, so Ctrl-C interrupts as usual again.
+    assert signal.getsignal(signal.SIGINT) is signal.default_int_handler
+
+
+def test_interrupted_tool_calls_not_saved(chatcli, mocker):
+    async def interrupted(model, *_args, **_kwargs):
+        chunks = tool_call_chunks(model, [("call_1", "pyeval", '{"code": "1"}')])
+        yield next(chunks)
+        os.kill(os.getpid(), signal.SIGINT)
+        await asyncio.sleep(10)
+        for chunk in chunks:
+            yield chunk
+
+    client = mocker.Mock()
+    client.chat.completions.create = mocker.AsyncMock(side_effect=interrupted)
+    mocker.patch("openai.AsyncOpenAI", return_value=client)
+
+    result = chatcli("chat -p pyeval", input="What is 1?")
+    assert "Interrupted: saved the partial answer." in result.output
+    # Continuing the conversation sends no calls without results.
+    data = last_conversation_data(chatcli)
+    assert data["messages"][-1] == {"role": "assistant", "content": ""}
+
+
+def test_sync_answer_keeps_default_sigint(chatcli, mocker):
+    import openai
+
+    create = openai.OpenAI.return_value.chat.completions.create
+    answer = create.side_effect
+    handlers = []
+
+    def record_handler(*args, **kwargs):
+        handlers.append(signal.getsignal(signal.SIGINT))
+        return answer(*args, **kwargs)
+
+    mocker.patch.object(create, "side_effect", record_handler)
+
+    result = chatcli("chat --quick --sync", input="Say hello")
+    assert "SAY HELLO" in result.output
+    # A sync request can't be cancelled, so Ctrl-C must still interrupt it.
+    assert handlers == [signal.default_int_handler]
+
+
+def test_prompt_while_warming(chatcli, mocker):
+    warm_up = mocker.patch("chatcli_gpt.conversation.warm_up")
+    mocker.patch("chatcli_gpt.cli.stdin_isatty", return_value=True)
+    mocker.patch(
+        "chatcli_gpt.cli.prompt_async", side_effect=["What is your name?", None]
+    )
+
+    result = chatcli("chat")
+
+    assert "WHAT IS YOUR NAME?" in result.output
+    warm_up.assert_called_with("gpt-3.5-turbo-1106", mocker.ANY)
+    assert warm_up.call_count == 2
+
+
+def test_question_not_held_back_by_warm_up(chatcli, mocker):
+    async def slow_warm_up(*_args):
+        await asyncio.sleep(60)
+
+    mocker.patch("chatcli_gpt.conversation.warm_up", side_effect=slow_warm_up)
+    mocker.patch("chatcli_gpt.cli.stdin_isatty", return_value=True)
+    mocker.patch(
+        "chatcli_gpt.cli.prompt_async", side_effect=["What is your name?", None]
+    )
+
+    start = time.perf_counter()
+    result = chatcli("chat")
+
+    assert "WHAT IS YOUR NAME?" in result.output
+    assert time.perf_counter() - start < 5
+
+
+def test_tool_calls(chatcli, mocker):
+    async def answer(model, messages, **_kwargs):
+        if messages[-1]["role"] == "tool":
+            chunks = to_chunks(model, ["The answer is 42."])
+        else:
+            chunks = tool_call_chunks(
+                model,
+                [
+                    ("call_1", "pyeval", '{"code": "6 * 7"}'),
+                    ("call_2", "pyeval", '{"code": "print(2 ** 5)"}'),
+                ],
+            )
+        for chunk in chunks:
+            yield chunk
+
+    client = mocker.Mock()
+    client.chat.completions.create = mocker.AsyncMock(side_effect=answer)
+    mocker.patch("openai.AsyncOpenAI", return_value=client)
+
+    result = chatcli("chat -p pyeval", input="What is 6 * 7?")
+    assert "The answer is 42." in result.output
+
+    request = client.chat.completions.create.call_args.kwargs
+    assert [tool["function"]["name"] for tool in request["tools"]] == ["pyeval"]
+    # The personality's EVALUATE: instructions aren't needed with tools.
+    assert [message["role"] for message in request["messages"]][:1] == ["user"]
+    messages = last_conversation_data(chatcli)["messages"]
+    assert [message["role"] for message in messages[-4:]] == [
+        "assistant",
+        "tool",
+        "tool",
+        "assistant",
+    ]
+    assert len(messages[-4]["tool_calls"]) == 2
+    assert messages[-3] == {
+        "role": "tool",
+        "tool_call_id": "call_1",
+        "content": "RESULT:\n```\n42\n```",
+    }
+    assert messages[-2]["content"] == "RESULT:\n```\n32\n```"
+
+
+def test_plugins_without_tools(chatcli, monkeypatch):
+    import openai
+
+    monkeypatch.setenv("CHATCLI_TOOLS", "0")
+    create = openai.AsyncOpenAI.return_value.chat.completions.create
+
+    result = chatcli("chat --quick -p pyeval", input="What is 6 * 7?")
+    assert "WHAT IS 6 * 7?" in result.output
+
+    request = create.call_args.kwargs
+    assert request["tools"] is openai.NOT_GIVEN
+    assert request["messages"][0]["role"] == "system"
+    assert "EVALUATE:" in request["messages"][0]["content"]
+
+
+def test_profile(chatcli):
+    result = chatcli("--profile chat --quick", input="What is your name?")
+    assert "WHAT IS YOUR NAME?" in result.output
+    assert "Profile:" in result.output
+    for stage in ("find_log", "log.load", "request.first_token", "log.write"):
+        assert stage in result.output
+
+
+def test_chrome_trace(chatcli):
+    from chatcli_gpt import trace
+
+    with trace.profiling(lambda _: None):
+        chatcli("chat --quick", input="What is your name?")
+        trace.write_chrome_trace("trace.json")
+
+    with Path("trace.json").open(encoding="utf-8") as fh:
+        events = json.load(fh)["traceEvents"]
+    assert {"log.load", "request.stream"} <= {event["name"] for event in events}
+
+
 def test_show_short(chatcli):
     result = chatcli("chat -q", input="What is your name?")
     result = chatcli("show -s")
@@ -241,12 +484,75 @@ def test_reinit_keeps_history(chatcli):
     assert "What is your name?" in result.output
 
 
-def test_logfile_upgrade(chatcli):
+def write_pre_0_4_log():
     with Path(".chatcli.log").open("w", encoding="utf-8") as fh:
         fh.write(json.dumps({"messages": [], "usage": {"request_tokens": 100}}) + "\n")
         fh.write(json.dumps({"messages": [], "usage": {"total_tokens": 0}}) + "\n")
-    chatcli("show")
+
+
+def test_logfile_upgrade(chatcli):
+    write_pre_0_4_log()
+    with pytest.raises(OutdatedLogError):
+        chatcli("show")
+    assert not Path(".chatcli.log.bak.0_3").exists()
+
+    chatcli("migrate")
     assert Path(".chatcli.log.bak.0_3").exists()
+    assert not Path(".chatcli.log.upgrading").exists()
+    data = last_conversation_data(chatcli)
+    assert data["usage"] == {"total_tokens": 0}
+
+
+def test_logfile_upgrade_resumes(chatcli):
+    write_pre_0_4_log()
+    with Path(".chatcli.log.upgrading").open("w", encoding="utf-8") as fh:
+        fh.write(json.dumps({"version": "0.4"}) + "\n")
+        fh.write(json.dumps({"messages": [], "usage": {"total_tokens": 7}}) + "\n")
+        fh.write('{"messages": [], "usa')
+
+    chatcli("migrate")
+    lines = Path(".chatcli.log").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[1])["usage"] == {"total_tokens": 7}
+    assert json.loads(lines[2])["usage"] == {"total_tokens": 0}
+
+
+def test_logfile_upgrade_resumes_after_header(chatcli):
+    write_pre_0_4_log()
+    Path(".chatcli.log.upgrading").write_text(
+        json.dumps({"version": "0.4"}) + "\n", encoding="utf-8"
+    )
+
+    chatcli("migrate")
+    lines = Path(".chatcli.log").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[0]) == {"version": "0.4"}
+    assert json.loads(lines[1])["usage"] == {"prompt_tokens": 100}
+
+
+def test_logfile_upgrade_keeps_time_order(chatcli):
+    created = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    with Path(".chatcli.log").open("w", encoding="utf-8") as fh:
+        for question, completion in [
+            ("First?", None),
+            ("Second?", {"created": created.timestamp()}),
+            ("Third?", None),
+        ]:
+            messages = [{"role": "user", "content": question}]
+            entry = {"messages": messages, "usage": None, "completion": completion}
+            fh.write(json.dumps(entry) + "\n")
+
+    chatcli("migrate")
+    lines = Path(".chatcli.log").read_text(encoding="utf-8").splitlines()[1:]
+    assert [json.loads(line)["timestamp"] for line in lines] == [
+        None,
+        created.isoformat(),
+        created.isoformat(),
+    ]
+    result = chatcli("log --since 2019-12-31")
+    assert "Third?" in result.output
+    assert "Second?" in result.output
+    assert "First?" not in result.output
 
 
 def test_answer(chatcli):
@@ -304,11 +610,201 @@ def test_drop(chatcli):
     assert last_message(chatcli) == "What is your name?"
 
 
+def test_migrate_to_sqlite(chatcli):
+    chatcli("chat --quick -p default", input="What is your name?")
+    chatcli("tag test_tag")
+    chatcli("chat --quick -c", input="What is your quest?")
+    chatcli("migrate --to sqlite")
+
+    result = chatcli("log --log .chatcli.db")
+    assert result.output == chatcli("log").output
+
+    result = chatcli("log --log .chatcli.db -s name")
+    assert "2: What is your name?" in result.output
+    assert "What is your quest?" not in result.output
+
+    result = chatcli("log --log .chatcli.db -t test_tag")
+    assert "What is your quest?" in result.output
+
+    result = chatcli("usage --log .chatcli.db")
+    assert "Tokens: 82" in result.output
+
+
+def test_sqlite_log_roundtrip(chatcli):
+    chatcli("chat --quick", input="What is your name?")
+    chatcli("migrate --to sqlite")
+    chatcli("chat --quick -c --log .chatcli.db", input="What is your quest?")
+    chatcli("migrate --to jsonl --log .chatcli.db -o roundtrip.log")
+
+    result = chatcli("show -l --log roundtrip.log")
+    assert "What is your name?" in result.output
+    assert "WHAT IS YOUR QUEST?" in result.output
+
+
+def test_migrate_in_batches(chatcli, mocker):
+    mocker.patch("chatcli_gpt.log.MIGRATE_BATCH", 2)
+    for question in ["What is your name?", "What is your quest?", "Why?"]:
+        chatcli("chat --quick", input=question)
+    chatcli("migrate --to sqlite")
+    mocker.patch("chatcli_gpt.sqlite_log.FIRST_BATCH", 2)
+    assert chatcli("log --log .chatcli.db").output == chatcli("log").output
+
+
+def test_sqlite_log_loads_entries_in_batches(chatcli, mocker):
+    for question in ["What is your name?", "What is your quest?", "Why?"]:
+        chatcli("chat --quick", input=question)
+    chatcli("migrate --to sqlite")
+
+    statements = []
+    connect = sqlite3.connect
+
+    def traced_connect(*args, **kwargs):
+        db = connect(*args, **kwargs)
+        db.set_trace_callback(statements.append)
+        return db
+
+    mocker.patch("chatcli_gpt.sqlite_log.sqlite3.connect", traced_connect)
+    chatcli("log --log .chatcli.db")
+    # The count, the entries, then their messages, tags, usage and metrics.
+    assert len([sql for sql in statements if sql.startswith("SELECT")]) == 6
+    assert not any("CREATE" in sql for sql in statements)
+
+
+def test_migrate_existing_output(chatcli):
+    chatcli("migrate --to sqlite")
+    chatcli("migrate --to sqlite", expected_exit_code=1)
+
+
+def test_stats(chatcli):
+    chatcli("chat --quick", input="What is your name?")
+    chatcli("chat --quick -m name_is_alice", input="What is your name?")
+
+    metrics = last_conversation_data(chatcli)["metrics"]
+    assert metrics["retries"] == 0
+    assert metrics["ttft"] <= metrics["duration"]
+
+    result = chatcli("stats")
+    assert "gpt-3.5-turbo-1106 (1 requests, 0 retries)" in result.output
+    assert "name_is_alice (1 requests, 0 retries)" in result.output
+    assert "openai (2 requests, 0 retries)" in result.output
+    assert "tokens/sec" in result.output
+
+    chatcli("migrate --to sqlite")
+    assert chatcli("stats --log .chatcli.db").output == result.output
+
+    result = chatcli("stats --until 2000-01-01")
+    assert "No request metrics recorded." in result.output
+
+
+def test_tree(chatcli):
+    chatcli("chat --quick", input="What is your name?")
+    chatcli("chat --quick -c", input="What is your quest?")
+    chatcli("chat --quick -c 2", input="What is your favourite colour?")
+    chatcli("tag mytag")
+
+    result = chatcli("tree")
+    assert result.output.splitlines() == [
+        "4: What is your name?",
+        "├─ 3: What is your quest?",
+        "└─ 2: What is your favourite colour?",
+        "   1: What is your favourite colour? mytag",
+    ]
+    assert chatcli("tree 3").output == result.output
+
+
+def test_log_threads(chatcli):
+    chatcli("chat --quick", input="What is your name?")
+    chatcli("chat --quick -c", input="What is your quest?")
+    chatcli("chat --quick -c 2", input="What is your favourite colour?")
+
+    result = chatcli("log --threads -l 2")
+    assert result.output.splitlines() == [
+        "   2: What is your quest?",
+        "   1: What is your favourite colour?",
+    ]
+
+
+def test_thread_index_rebuilt(chatcli):
+    log_path = Path(".chatcli.log")
+    Path(".chatcli.log.threads").unlink()
+    chatcli("chat --quick", input="What is your name?")
+    chatcli("chat --quick -c", input="What is your quest?")
+    assert chatcli("tree").output.splitlines() == [
+        "2: What is your name?",
+        "1: What is your quest?",
+    ]
+
+    lines = log_path.read_text().splitlines(keepends=True)
+    log_path.write_text("".join(lines[:-1]))
+    assert chatcli("tree").output.splitlines() == ["1: What is your name?"]
+
+
 def last_message(chatcli):
     data = last_conversation_data(chatcli)
     return data["messages"][-1]["content"]
 
 
+def logged_entries():
+    with Path(".chatcli.log").open(encoding="utf-8") as fh:
+        return [json.loads(line) for line in fh][1:]
+
+
 def last_conversation_data(chatcli):
     result = chatcli("show --json")
     return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize("log_option", ["", " --log .chatcli.db"])
+def test_log_query(chatcli, log_option):
+    chatcli("chat --quick -p default --model gpt-4", input="What is your name?")
+    chatcli("tag test_tag")
+    chatcli("chat --quick -p default", input="What is your quest?")
+    chatcli("chat --quick -c", input="What is your name again?")
+    if log_option:
+        chatcli("migrate --to sqlite")
+
+    def log(query):
+        result = chatcli(f"log --query '{query}'" + log_option)
+        return [line.split(":")[0].strip() for line in result.output.splitlines()]
+
+    assert log("tokens>0") == ["4", "2", "1"]
+    assert log('model:gpt-4* "your name"') == ["4", "3"]
+    assert log("since:2020 your name tag:test_tag") == ["3"]
+    assert log("until:2020") == []
+
+    result = chatcli("show --query 'quest tokens<100'" + log_option)
+    assert result.output == "WHAT IS YOUR QUEST?\n"
+
+    result = chatcli("log --query since:soon" + log_option, expected_exit_code=2)
+    assert "Invalid date: soon" in result.output
+
+
+@pytest.mark.parametrize("log_option", ["", " --log .chatcli.db"])
+def test_since_until(chatcli, log_option):
+    # After the entries written by init, so the log stays in time order.
+    now = datetime.now(tz=timezone.utc)
+    with patch("chatcli_gpt.log.datetime") as dt:
+        dt.now.return_value = now + timedelta(days=10)
+        chatcli("chat --quick", input="What is your name?")
+        chatcli("tag old_tag")
+        dt.now.return_value = now + timedelta(days=40)
+        chatcli("chat --quick", input="What is your quest?")
+        chatcli("tag new_tag")
+    if log_option:
+        chatcli("migrate --to sqlite")
+
+    def day(days):
+        return (now + timedelta(days=days)).strftime("%Y-%m-%d")
+
+    result = chatcli(f"log --since {day(20)} --until {day(50)}" + log_option)
+    assert "What is your quest?" in result.output
+    assert "What is your name?" not in result.output
+    # Offsets still count from the end of the log.
+    assert result.output.splitlines()[0].strip().startswith("2:")
+
+    result = chatcli(f"tags --until {day(20)}" + log_option)
+    assert "old_tag" in result.output
+    assert "new_tag" not in result.output
+
+    result = chatcli(f"usage --since {day(20)}" + log_option)
+    assert "Tokens: 41" in result.output
@@ -1,14 +1,22 @@
 import asyncio
 from io import StringIO
+import httpx
 import pytest
 from chatcli_gpt.conversation import (
     Conversation,
+    RequestMetrics,
+    message_tokens,
     stream_request,
     accumulate_streaming_response,
+    warm_up,
 )
-import openai  # noqa: F401
+import openai
+from openai._client import AsyncOpenAI as RealAsyncOpenAI
 
-from .conftest import to_chunks
+from .conftest import ByteEncoding, to_chunks, tool_call_chunks
+
+# Before the fixture that blocks HTTP requests replaces it.
+ASYNC_SEND = httpx.AsyncClient.send
 
 
 def test_find_recent_message():
@@ -63,6 +71,73 @@ def test_stream_interrupt(mocker):
     assert buffer.getvalue() == "a quick brown "
 
 
+def test_stream_counts_client_retries(mocker):
+    # The real client, with its own retries, over a fake transport.
+    mocker.patch("openai.AsyncOpenAI", RealAsyncOpenAI)
+    mocker.patch("httpx.AsyncClient.send", ASYNC_SEND)
+    responses = iter(
+        [
+            httpx.Response(429, headers={"retry-after-ms": "1"}),
+            httpx.Response(
+                200,
+                headers={"content-type": "text/event-stream"},
+                content="".join(
+                    f"data: {chunk.to_json(indent=None)}\n\n"
+                    for chunk in to_chunks("gpt-4", ["Hello"])
+                )
+                + "data: [DONE]\n\n",
+            ),
+        ]
+    )
+
+    def http_client(**kwargs):
+        transport = httpx.MockTransport(lambda _request: next(responses))
+        return httpx.AsyncClient(transport=transport, **kwargs)
+
+    mocker.patch("openai.DefaultAsyncHttpxClient", http_client)
+    metrics = RequestMetrics()
+
+    result = asyncio.run(stream_request([], "gpt-4", None, metrics))
+
+    assert result.choices[0].message.content == "Hello"
+    assert metrics.to_dict(completion_tokens=1)["retries"] == 1
+
+
+@pytest.mark.asyncio()
+async def test_warm_up(mocker):
+    mocker.patch("chatcli_gpt.conversation.get_encoding", return_value=ByteEncoding())
+    client = mocker.Mock()
+    retrieve = client.with_options.return_value.models.retrieve = mocker.AsyncMock()
+    mocker.patch("openai.AsyncOpenAI", return_value=client)
+    message_tokens.cache_clear()
+
+    await warm_up("gpt-4", [{"role": "user", "content": "Hello"}])
+
+    retrieve.assert_awaited_once_with("gpt-4")
+    assert message_tokens.cache_info().currsize == 1
+
+
+@pytest.mark.asyncio()
+async def test_accumulate_streaming_tool_calls():
+    calls = [
+        ("call_1", "search", '{"query": "weather"}'),
+        ("call_2", "pyeval", '{"code": "6 * 7"}'),
+    ]
+    result = await accumulate_streaming_response(
+        async_gen(tool_call_chunks("gpt-4", calls))
+    )
+    message = result.choices[0].message
+    assert message.content == ""
+    assert [call.to_dict() for call in message.tool_calls] == [
+        {
+            "id": call_id,
+            "type": "function",
+            "function": {"name": name, "arguments": arguments},
+        }
+        for call_id, name, arguments in calls
+    ]
+
+
 @pytest.mark.asyncio()
 async def test_accumulate_streaming_response_empty_iterator():
     iterator = async_gen(to_chunks("test_model", []))
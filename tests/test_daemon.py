@@ -0,0 +1,154 @@
+import io
+import asyncio
+import json
+import os
+import sys
+import time
+import signal
+import socket
+import threading
+import subprocess
+from pathlib import Path
+import pytest
+from chatcli_gpt import client, daemon, log
+from chatcli_gpt.conversation import handle_sigint
+
+
+@pytest.fixture()
+def server(chatcli, tmp_path):
+    socket_path = tmp_path / "chatcli.sock"
+    process = subprocess.Popen(
+        [sys.executable, "-m", "chatcli_gpt", "serve", "--socket", str(socket_path)],
+        env={**os.environ, "PYTHONPATH": str(Path(__file__).parents[1])},
+    )
+    for _ in range(100):
+        if socket_path.exists():
+            break
+        time.sleep(0.05)
+    yield socket_path
+    process.terminate()
+    process.wait()
+
+
+def forward(socket_path, argv, stdin=""):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr("os.isatty", lambda _fd: False)
+        monkeypatch.setattr("sys.stdin", io.StringIO(stdin))
+        return client.forward(argv, socket_path)
+
+
+def test_forward_commands(server, capsys):
+    assert forward(server, ["add", "--role", "user"], "What is your name?") == 0
+    assert forward(server, ["add", "-c", "--role", "user"], "What is your quest?") == 0
+    assert forward(server, ["log", "-l", "2"]) == 0
+    output = capsys.readouterr().out
+    assert "2: What is your name?" in output
+    assert "1: What is your quest?" in output
+
+
+def test_entries_written_before_command_returns(server):
+    log_path = Path(".chatcli.log")
+    lines = len(log_path.read_text().splitlines())
+    assert forward(server, ["add", "--role", "user"], "What is your name?") == 0
+    assert len(log_path.read_text().splitlines()) == lines + 1
+
+
+def test_forward_exit_code(server, capsys):
+    assert forward(server, ["show", "--tag", "does_not_exist"]) == 1
+    assert "Matching conversation not found" in capsys.readouterr().err
+
+
+def test_no_daemon(tmp_path):
+    assert client.forward(["log"], tmp_path / "missing.sock") is None
+
+
+def test_streaming_commands_run_in_process(server):
+    assert forward(server, ["mapreduce", "Summarize"], "text") is None
+    assert forward(server, ["--profile", "mapreduce", "Summarize"], "text") is None
+
+
+def test_command_name():
+    assert daemon.command_name(["log", "-l", "1"]) == "log"
+    assert daemon.command_name(["--profile", "mapreduce", "x"]) == "mapreduce"
+    # Options before a command name belong to the default chat command.
+    assert daemon.command_name(["--log-file", "x", "mapreduce"]) == "chat"
+    assert daemon.command_name(["What is your name?"]) == "chat"
+    assert daemon.command_name([]) == "chat"
+
+
+def test_different_settings_run_in_process(server, monkeypatch):
+    monkeypatch.setenv("CHATCLI_TOOLS", "0")
+    assert forward(server, ["log"]) is None
+    # The client's own settings don't matter.
+    monkeypatch.delenv("CHATCLI_TOOLS")
+    monkeypatch.setenv("CHATCLI_DAEMON", "1")
+    assert forward(server, ["log"]) == 0
+
+
+def test_log_cache_reads_appended_entries(chatcli):
+    cache = log.LogCache()
+    log_path = Path(".chatcli.log")
+    entries = len(cache.entries(log_path))
+    chatcli("chat --quick", input="What is your name?")
+    assert len(cache.entries(log_path)) == entries + 1
+
+
+def test_prompt_does_not_block_other_commands(server, capsys):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(str(server))
+        channel = sock.makefile("rw", encoding="utf-8")
+        client.send(
+            channel,
+            argv=["chat"],
+            cwd=str(Path.cwd()),
+            settings=client.settings_digest(),
+            stdin_isatty=True,
+            stdout_isatty=False,
+        )
+        assert json.loads(channel.readline()) == {"accepted": True}
+        client.send(channel, stdin=None)
+        while "prompt" not in json.loads(channel.readline()):
+            pass
+
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(forward(server, ["log", "-l", "1"])),
+            daemon=True,
+        )
+        thread.start()
+        thread.join(timeout=10)
+        assert result == [0]
+
+        client.send(channel, input=None)
+        while "exit" not in json.loads(channel.readline()):
+            pass
+
+
+def test_client_forwards_interrupt():
+    local, remote = socket.socketpair()
+    with local, remote, client.forward_interrupts(local):
+        os.kill(os.getpid(), signal.SIGINT)
+        assert json.loads(remote.makefile().readline()) == {"interrupt": True}
+        # A second Ctrl-C exits as usual.
+        with pytest.raises(KeyboardInterrupt):
+            os.kill(os.getpid(), signal.SIGINT)
+
+
+def test_session_interrupt_cancels_answer(monkeypatch):
+    request = {"stdin": None, "stdin_isatty": False, "stdout_isatty": False}
+    session = daemon.Session(io.BytesIO(b'{"interrupt": true}\n'), None, request)
+    monkeypatch.setattr(daemon._local, "session", session, raising=False)
+
+    async def answer():
+        task = asyncio.ensure_future(asyncio.sleep(10))
+        with handle_sigint(task) as sigint:
+            listener = threading.Thread(target=session.listen)
+            listener.start()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+        listener.join()
+        return sigint.interrupted
+
+    assert asyncio.run(answer())
+    # The client has gone, so prompts get no more input.
+    assert session.replies.get_nowait() is None
@@ -0,0 +1,98 @@
+from pathlib import Path
+import pytest
+from chatcli_gpt import files
+
+from .conftest import ByteEncoding
+
+
+@pytest.fixture()
+def project(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / ".git").mkdir()
+    (tmp_path / ".gitignore").write_text("*.log\nbuild/\n!keep.log\n")
+    (tmp_path / "src" / "pkg").mkdir(parents=True)
+    (tmp_path / "src" / "main.py").write_text("print('main')\n")
+    (tmp_path / "src" / "pkg" / "util.py").write_text("print('util')\n")
+    (tmp_path / "src" / "pkg" / ".gitignore").write_text("/generated.py\n")
+    (tmp_path / "src" / "pkg" / "generated.py").write_text("print('generated')\n")
+    (tmp_path / "src" / "debug.log").write_text("debug\n")
+    (tmp_path / "src" / "keep.log").write_text("keep\n")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out.py").write_text("print('out')\n")
+    return tmp_path
+
+
+def test_expand_directory_honours_gitignore(project):  # noqa: ARG001
+    assert [str(path) for path in files.expand_paths(["."])] == [
+        ".gitignore",
+        "src/keep.log",
+        "src/main.py",
+        "src/pkg/.gitignore",
+        "src/pkg/util.py",
+    ]
+
+
+def test_expand_glob(project):  # noqa: ARG001
+    paths = files.expand_paths(["src/main.py", "**/*.py"])
+    assert [str(path) for path in paths] == ["src/main.py", "src/pkg/util.py"]
+
+
+def test_expand_explicit_ignored_file(project):  # noqa: ARG001
+    assert files.expand_paths(["build/out.py"]) == [Path("build/out.py")]
+
+
+def test_expand_no_match(project):  # noqa: ARG001
+    with pytest.raises(ValueError, match="No files match"):
+        files.expand_paths(["*.rs"])
+
+
+def test_collect_skips_binary_and_duplicates(project):
+    (project / "image.png").write_bytes(b"\x89PNG\0\0")
+    (project / "copy.py").write_text("print('main')\n")
+
+    contents, skipped = files.collect_files(
+        ["src/main.py", "copy.py", "image.png"], "gpt-4"
+    )
+
+    assert [file.name for file in contents] == ["src/main.py"]
+    assert skipped == [("copy.py", "duplicate"), ("image.png", "binary")]
+
+
+def test_collect_skips_broken_symlink(project):
+    (project / "src" / "dangling.py").symlink_to(project / "missing.py")
+
+    contents, skipped = files.collect_files(["src"], "gpt-4")
+
+    assert [file.name for file in contents] == [
+        "src/keep.log",
+        "src/main.py",
+        "src/pkg/.gitignore",
+        "src/pkg/util.py",
+    ]
+    assert skipped == [("src/dangling.py", "No such file or directory")]
+
+
+def test_collect_truncates_lowest_priority_files(project):
+    (project / "big.txt").write_text("x" * 1000)
+    (project / "other.txt").write_text("y" * 1000)
+
+    contents, skipped = files.collect_files(
+        ["src/main.py", "big.txt", "other.txt"], "gpt-4", max_tokens=500
+    )
+
+    assert contents[0].text == "print('main')\n"
+    assert contents[1].truncated
+    assert contents[1].text.startswith("x" * (500 - len("print('main')\n")))
+    assert skipped == [("other.txt", "over the token budget")]
+
+
+def test_token_budget_uses_context_length(chatcli):  # noqa: ARG001
+    assert files.token_budget("gpt-4") == 4096
+
+
+def test_fit_to_budget_drops_when_little_room():
+    encoding = ByteEncoding()
+    contents = [files.FileContent("a", "a" * 50, 50), files.FileContent("b", "b", 1)]
+    kept, dropped = files.fit_to_budget(contents, 20, encoding)
+    assert [file.name for file in kept] == ["b"]
+    assert dropped == [("a", "over the token budget")]
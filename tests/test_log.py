@@ -0,0 +1,127 @@
+import json
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+import pytest
+from chatcli_gpt import log
+from chatcli_gpt.conversation import Conversation
+from chatcli_gpt.log import LogWriter, append_entries, conversation_log, write_log
+
+
+@pytest.fixture()
+def log_file(tmp_path):
+    path = tmp_path / ".chatcli.log"
+    path.write_text(json.dumps({"version": "0.4"}) + "\n", encoding="utf-8")
+    return path
+
+
+def conversation(content):
+    return Conversation({"messages": [{"role": "user", "content": content}]})
+
+
+def test_write_log_fsync_always(log_file, monkeypatch):
+    monkeypatch.setenv("CHATCLI_DURABILITY", "always")
+    with mock.patch("os.fsync") as fsync:
+        write_log(log_file, conversation("hello"))
+    assert fsync.call_count == 1
+
+
+def test_write_log_fsync_none(log_file, monkeypatch):
+    monkeypatch.setenv("CHATCLI_DURABILITY", "none")
+    with mock.patch("os.fsync") as fsync:
+        write_log(log_file, conversation("hello"))
+    assert fsync.call_count == 0
+
+
+def test_invalid_durability(log_file, monkeypatch):
+    monkeypatch.setenv("CHATCLI_DURABILITY", "sometimes")
+    with pytest.raises(ValueError, match="CHATCLI_DURABILITY"):
+        write_log(log_file, conversation("hello"))
+
+
+def test_log_writer_group_commit(log_file, monkeypatch):
+    monkeypatch.setenv("CHATCLI_DURABILITY", "batch")
+    with mock.patch(
+        "chatcli_gpt.log.append_entries", side_effect=append_entries
+    ) as append, mock.patch("os.fsync") as fsync:
+        with LogWriter(log_file, max_entries=3, max_delay=60) as writer:
+            for idx in range(5):
+                writer.write(conversation(f"message {idx}"))
+            assert append.call_count == 1
+        assert append.call_count == 2
+    assert fsync.call_count == 2
+
+    contents = [c.messages[0]["content"] for c in conversation_log(log_file)]
+    assert contents == [f"message {idx}" for idx in range(5)]
+
+
+def test_time_range_reads_few_lines(log_file, monkeypatch):
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    append_entries(
+        log_file,
+        (
+            {
+                "messages": [{"role": "user", "content": f"message {idx}"}],
+                "timestamp": (start + timedelta(hours=idx)).isoformat(),
+            }
+            for idx in range(1000)
+        ),
+    )
+    line_time = mock.Mock(side_effect=log.line_time)
+    monkeypatch.setattr("chatcli_gpt.log.line_time", line_time)
+
+    lines, newer = log.log_lines(
+        log_file, start + timedelta(hours=100), start + timedelta(hours=199, minutes=30)
+    )
+    assert [json.loads(line)["messages"][0]["content"] for line in lines] == [
+        f"message {idx}" for idx in range(100, 200)
+    ]
+    assert newer == 800
+    assert line_time.call_count < 30
+
+    conversations = conversation_log(log_file, since=start + timedelta(hours=998))
+    assert [c.messages[0]["content"] for c in conversations] == [
+        "message 998",
+        "message 999",
+    ]
+    assert conversation_log(log_file, until=start) == []
+
+
+def test_log_writer_flushes_after_delay(log_file):
+    writer = LogWriter(log_file, max_delay=0.05)
+    writer.write(conversation("hello"))
+    assert conversation_log(log_file) == []
+    for _ in range(100):
+        if conversation_log(log_file):
+            break
+        time.sleep(0.01)
+    assert [c.messages[0]["content"] for c in conversation_log(log_file)] == ["hello"]
+
+
+def test_batch_fsync_on_timer(log_file, monkeypatch):
+    monkeypatch.setenv("CHATCLI_DURABILITY", "batch")
+    monkeypatch.setattr("chatcli_gpt.log.FSYNC_DELAY", 0.05)
+    with mock.patch("os.fsync") as fsync:
+        write_log(log_file, conversation("hello"))
+        write_log(log_file, conversation("again"))
+        for _ in range(100):
+            if fsync.called:
+                break
+            time.sleep(0.01)
+        time.sleep(0.1)
+    assert fsync.call_count == 1
+
+
+def test_shared_writers_group_commit(log_file, monkeypatch):
+    monkeypatch.setattr("chatcli_gpt.log.GROUP_COMMIT_DELAY", 60)
+    monkeypatch.setattr("chatcli_gpt.log.shared_writers", log.SharedWriters())
+    log.shared_writers.enabled = True
+    with mock.patch(
+        "chatcli_gpt.log.append_entries", side_effect=append_entries
+    ) as append:
+        write_log(log_file, conversation("one"))
+        write_log(log_file, conversation("two"))
+        assert append.call_count == 0
+        # Reading the log commits the pending entries first.
+        assert len(conversation_log(log_file)) == 2
+        assert append.call_count == 1
@@ -0,0 +1,113 @@
+import os
+import json
+from pathlib import Path
+from chatcli_gpt import models
+from chatcli_gpt.models import ModelRegistry
+
+
+def registry(*ids):
+    return ModelRegistry([{"id": model_id} for model_id in ids])
+
+
+def test_find_first_match_in_catalog_order():
+    catalog = registry("gpt-4-1106-preview", "gpt-3.5-turbo", "gpt-4")
+    assert catalog.find("gpt-4") == "gpt-4-1106-preview"
+    assert catalog.find("3.5") == "gpt-3.5-turbo"
+    assert catalog.find("4") == "gpt-4-1106-preview"
+    assert catalog.find("claude") is None
+
+
+def test_with_prefix():
+    catalog = registry("openrouter/anthropic/claude-2", "openrouter/openai/gpt-4", "x")
+    assert catalog.with_prefix("openrouter/a") == ["openrouter/anthropic/claude-2"]
+    assert len(catalog.with_prefix("openrouter/")) == 2
+
+
+def write_cache(ids):
+    models.MODEL_CACHE.write_text(json.dumps([{"id": model_id} for model_id in ids]))
+
+
+def test_registry_reloads_when_cache_changes(chatcli):  # noqa: ARG001
+    write_cache(["first-model"])
+    assert models.registry().find("first") == "first-model"
+    assert models.registry() is models.registry()
+
+    write_cache(["second-model", "another-model"])
+    assert models.registry().find("second") == "second-model"
+
+
+def test_fetch_ttl_skips_fresh_cache(chatcli, mocker, monkeypatch):
+    fetch = mocker.patch("chatcli_gpt.models.fetch_provider_models")
+    monkeypatch.setenv("OPENROUTER_API_KEY", "key")
+
+    chatcli("models fetch openrouter --ttl 3600")
+    assert not fetch.called
+
+    old = os.stat(models.MODEL_CACHE).st_mtime - 7200
+    os.utime(models.MODEL_CACHE, (old, old))
+    fetch.return_value = [{"id": "openrouter/new-model", "provider": "openrouter"}]
+    chatcli("models fetch openrouter --ttl 3600")
+    assert "openrouter/new-model" in chatcli("models").output.split()
+    assert not list(Path().glob("*.tmp"))
+
+
+def test_fetch_all_keeps_unreachable_providers(chatcli, mocker, monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "key")
+    monkeypatch.setenv("OPENROUTER_API_KEY", "key")
+    monkeypatch.setenv("CHATCLI_LOCAL_API_BASE", "http://localhost:8080/v1")
+    write_cache(["openrouter/old-model", "local/old-model"])
+
+    async def fetch(name):
+        if name == "openrouter":
+            raise TimeoutError
+        return [models.catalog_entry(name, {"id": "new-model", "max_model_len": 4096})]
+
+    mocker.patch("chatcli_gpt.models.fetch_provider_models", side_effect=fetch)
+    result = chatcli("models fetch --all")
+
+    assert "openrouter: Could not fetch models" in result.output
+    available = {model["id"]: model for model in models.registry().models}
+    assert "openrouter/old-model" in available
+    assert "local/old-model" not in available
+    assert available["local/new-model"]["context_length"] == 4096
+    assert available["local/new-model"]["pricing"] == {"prompt": 0, "completion": 0}
+    assert available["new-model"]["provider"] == "openai"
+
+
+def test_fetch_all_without_providers(chatcli, monkeypatch):
+    for provider in models.PROVIDERS.values():
+        monkeypatch.delenv(provider["setting"], raising=False)
+    result = chatcli("models fetch --all", expected_exit_code=1)
+    assert result.output == (
+        "No provider is configured: set OPENAI_API_KEY, OPENROUTER_API_KEY"
+        " or CHATCLI_LOCAL_API_BASE.\n"
+    )
+
+
+def test_local_provider():
+    assert models.provider("local/llama") == "local"
+    assert models.api_model_name("local/llama") == "llama"
+    assert (
+        models.api_model_name("openrouter/anthropic/claude-2") == "anthropic/claude-2"
+    )
+
+
+def test_supports_tools(chatcli, monkeypatch):  # noqa: ARG001
+    models.MODEL_CACHE.write_text(
+        json.dumps(
+            [
+                {"id": "openrouter/with-tools", "supported_parameters": ["tools"]},
+                {"id": "openrouter/without-tools", "supported_parameters": []},
+                {"id": "local/model"},
+            ]
+        )
+    )
+    assert models.supports_tools("gpt-4")
+    assert models.supports_tools("openrouter/with-tools")
+    assert not models.supports_tools("openrouter/without-tools")
+    assert not models.supports_tools("local/model")
+
+    monkeypatch.setenv("CHATCLI_TOOLS", "1")
+    assert models.supports_tools("local/model")
+    monkeypatch.setenv("CHATCLI_TOOLS", "0")
+    assert not models.supports_tools("gpt-4")
@@ -1,6 +1,15 @@
+import sys
+import base64
+import asyncio
+import subprocess
+import threading
 from pathlib import Path
+from importlib.metadata import EntryPoint
 from unittest import mock
+import pytest
 from click.testing import CliRunner
+from chatcli_gpt import plugin_cache, plugins
+from chatcli_gpt.plugins import execute
 from chatcli_gpt.plugins import evaluate_plugins, format_block
 
 
@@ -40,7 +49,7 @@ def test_recursive_function():
 
 
 @mock.patch(
-    "chatcli_gpt.plugins.duckduckgo_search.ddg",
+    "chatcli_gpt.plugins.search.duckduckgo_search.ddg",
     return_value='[{"content": "Some guy"}]',
 )
 def test_simple_search(mock_ddg):
@@ -50,7 +59,46 @@ def test_simple_search(mock_ddg):
     assert mock_ddg.call_args.args[0] == "Who is the president of the USA?"
 
 
-@mock.patch("chatcli_gpt.plugins.wolframalpha")
+@mock.patch(
+    "chatcli_gpt.plugins.search.duckduckgo_search.ddg",
+    return_value='[{"content": "Some guy"}]',
+)
+def test_search_is_cached(mock_ddg):
+    first = evaluate_plugins('SEARCH("Who is the president?")', ["search"])
+    assert "cached" not in first
+
+    # Duplicate queries in one response are searched for once.
+    second = evaluate_plugins(
+        'SEARCH("who is  the President?")\nSEARCH("Who is the president?")',
+        ["search"],
+    )
+    assert mock_ddg.call_count == 1
+    assert second.startswith("RESULT (cached just now, may be out of date):")
+    assert second.count("RESULT") == 1
+
+
+@mock.patch("chatcli_gpt.plugins.search.duckduckgo_search.ddg", return_value="[]")
+def test_search_cache_expires(mock_ddg, monkeypatch):
+    monkeypatch.setitem(plugin_cache.TTLS, "search", 0)
+    evaluate_plugins('SEARCH("query")', ["search"])
+    evaluate_plugins('SEARCH("query")', ["search"])
+    assert mock_ddg.call_count == 2
+
+
+def test_cache_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr("chatcli_gpt.plugin_cache.MAX_ENTRIES", 2)
+    calls = []
+
+    def run(query):
+        calls.append(query)
+        return {"result": query.upper()}
+
+    for query in ["a", "b", "a", "c", "a", "b"]:
+        plugin_cache.cached("search", query, run)
+    assert calls == ["a", "b", "c", "b"]
+
+
+@mock.patch("chatcli_gpt.plugins.wolfram.wolframalpha")
 @mock.patch("os.environ", {"WOLFRAM_ALPHA_API_KEY": "TRUE"})
 def test_wolfram(mock_wolfram):
     next(mock_wolfram.Client().query().results).text = "Paris"
@@ -65,6 +113,145 @@ def test_bash():
     )
 
 
+def test_bash_streams_output():
+    chunks = []
+    assert evaluate_plugins(
+        block("echo one; echo two >&2", "bash"), ["bash"], output=chunks.append
+    ) == result("one", "two")
+    assert "".join(sorted(chunks)) == "one\ntwo\n"
+
+
+@mock.patch("chatcli_gpt.plugins.execute.EXEC_TIMEOUT", 0.5)
+def test_bash_timeout():
+    output = execute.exec_bash("echo started; sleep 10 & wait")
+    assert output == {"result": "started", "error": "Timed out after 0.5 seconds."}
+
+
+@mock.patch("chatcli_gpt.plugins.execute.EXEC_OUTPUT_BYTES", 20)
+def test_output_keeps_head_and_tail():
+    output = execute.exec_bash("seq 1 1000")
+    assert output["result"].startswith("1\n2\n3\n4\n5\n")
+    assert "bytes left out" in output["result"]
+    assert output["result"].endswith("...\n\n999\n1000")
+
+
+@mock.patch("chatcli_gpt.plugins.execute.EXEC_MEMORY_BYTES", 512 * 1024**2)
+def test_python_memory_limit():
+    assert "MemoryError" in evaluate_plugins(
+        block("x = bytearray(1024**3)"), ["pyeval"]
+    )
+
+
+@mock.patch("chatcli_gpt.plugins.execute.EXEC_CPU_SECONDS", 7)
+def test_bash_cpu_limit():
+    assert execute.exec_bash("ulimit -t")["result"] == "7"
+
+
+@mock.patch("chatcli_gpt.plugins.execute.EXEC_MEMORY_BYTES", 512 * 1024**2)
+def test_limits_apply_to_child_processes():
+    for _ in range(10):
+        assert execute.exec_bash('bash -c "ulimit -v"')["result"] == str(512 * 1024)
+
+
+@pytest.mark.asyncio()
+async def test_plugin_starts_while_answer_streams(monkeypatch):
+    started = threading.Event()
+
+    def search(query):
+        started.set()
+        return {"result": query}
+
+    monkeypatch.setattr("chatcli_gpt.plugins.search.exec_duckduckgo", search)
+    runner = plugins.PluginRunner(["search"])
+    for token in ['Let me look. SEARCH("a', 'b")', "\nStill ", "writing"]:
+        runner.feed(token)
+
+    assert await asyncio.to_thread(started.wait, 5)
+    answer = 'Let me look. SEARCH("ab")\nStill writing'
+    assert await runner.results(answer) == result("ab")
+
+
+@pytest.mark.asyncio()
+async def test_plugin_output_waits_for_answer():
+    chunks = []
+    runner = plugins.PluginRunner(["bash"], output=chunks.append)
+    runner.feed(block("echo hi", "bash"))
+    await asyncio.gather(*runner.tasks["bash"])
+    assert chunks == []
+
+    assert await runner.results(block("echo hi", "bash") + "Done.") == result("hi")
+    assert chunks == ["hi\n"]
+
+
+@pytest.mark.asyncio()
+async def test_text_without_blocks_is_not_searched_again(monkeypatch):
+    monkeypatch.setattr(
+        "chatcli_gpt.plugins.search.exec_duckduckgo", lambda query: {"result": query}
+    )
+    runner = plugins.PluginRunner(["search", "pyeval"])
+    for token in ["Some prose.\n", "A SEARCH( that never closes.\n", "More.\n"]:
+        runner.feed(token)
+    # Only the end of the text could still hold the start of an opening.
+    assert runner.positions == {
+        "search": len(runner.text) - len("SEARCH(") + 1,
+        "pyeval": len(runner.text) - len("EVALUATE:") + 1,
+    }
+    assert runner.unfinished == {"search": [14], "pyeval": []}
+
+    runner.feed("EVALUATE:\n\n```python\nprint(")
+    runner.feed("1 + 1)\n")
+    assert runner.unfinished["pyeval"] == [47]
+    runner.feed('```\nSEARCH("x")\n')
+    assert runner.unfinished["pyeval"] == []
+    assert runner.tasks["search"] and runner.tasks["pyeval"]
+    assert await runner.results(runner.text) == result("x") + "\n" + result(
+        2,
+    )
+
+
+@pytest.mark.asyncio()
+async def test_call_tools_invalid_arguments(monkeypatch):
+    def search(query):
+        raise ValueError("search failed")
+
+    monkeypatch.setattr("chatcli_gpt.plugins.search.exec_duckduckgo", search)
+    runner = plugins.PluginRunner(["search"])
+
+    def call(name, arguments):
+        return {"id": "call_1", "function": {"name": name, "arguments": arguments}}
+
+    messages = await runner.call_tools(
+        [call("search", "{"), call("search", "{}"), call("other", "{}")]
+    )
+    assert [message["content"] for message in messages] == [
+        format_block(
+            {
+                "error": "Invalid arguments for search: Expecting property name"
+                " enclosed in double quotes: line 1 column 2 (char 1)"
+            }
+        ),
+        format_block({"error": "Invalid arguments for search: missing query"}),
+        format_block({"error": "There is no tool called 'other'."}),
+    ]
+    # The plugin's own errors aren't mistaken for invalid arguments.
+    with pytest.raises(ValueError, match="search failed"):
+        await runner.call_tools([call("search", '{"query": "x"}')])
+
+
+def test_plugin_opening():
+    assert [plugin.opening() for plugin in plugins.PLUGINS.values()] == [
+        "EVALUATE:",
+        "EVALUATE:",
+        "SEARCH(",
+        "WOLFRAM(",
+        "SAVE(",
+        "IMAGE(",
+    ]
+    assert plugins.Plugin("x", "m:f", "", {}, pattern=r"ab?c").opening() == "a"
+    assert plugins.Plugin("x", "m:f", "", {}, pattern=r"a+b").opening() == "a"
+    assert plugins.Plugin("x", "m:f", "", {}, pattern=r"a|b").opening() == ""
+
+
 def test_multiple_blocks():
     assert evaluate_plugins(
         block("print(3 + 4)") + block("import math; math.sqrt(4)"), ["pyeval"]
@@ -100,3 +287,80 @@ def result(result_text, error=""):
 
 def block(code, block_type="python", block_header="EVALUATE:"):
     return f"{block_header}\n```{block_type}\n{code}\n```\n"
+
+
+def test_plugins_import_lazily():
+    code = (
+        "import sys, chatcli_gpt.plugins as plugins;"
+        "plugins.tool_definitions(['search', 'wolfram', 'image']);"
+        "print(sorted({'duckduckgo_search', 'wolframalpha', 'requests'} & set(sys.modules)))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert output.stdout == "[]\n"
+
+
+async def shout(arguments, _output=None):
+    return {"result": arguments["text"].upper()}
+
+
+SHOUT = plugins.Plugin(
+    "shout",
+    "tests.test_plugins:shout",
+    "Shout some text.",
+    {"text": "The text to shout."},
+    pattern=r"SHOUT\((.*?)\)",
+    quoted=("text",),
+    is_async=True,
+    concurrency=1,
+)
+
+
+def test_installed_plugin(monkeypatch):
+    entry_point = EntryPoint(
+        name="shout", value="tests.test_plugins:SHOUT", group="chatcli_gpt.plugins"
+    )
+    monkeypatch.setattr(
+        "chatcli_gpt.plugins.entry_points",
+        lambda group: [entry_point] if group == "chatcli_gpt.plugins" else [],
+    )
+    plugins.get_plugin.cache_clear()
+    try:
+        assert plugins.get_plugin("shout") == SHOUT
+        assert plugins.get_plugin("whisper") is None
+        assert evaluate_plugins('SHOUT("hi")\nSHOUT("there")', ["shout"]) == result(
+            "HI"
+        ) + "\n" + result("THERE")
+    finally:
+        plugins.get_plugin.cache_clear()
+
+
+def test_images_generate_concurrently(mocker, monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr("chatcli_gpt.plugins.image.IMAGE_COUNT", 2)
+    monkeypatch.setattr("chatcli_gpt.plugins.image.CHUNK_CHARS", 4)
+    started = []
+
+    async def generate(prompt, n, **_kwargs):
+        started.append(prompt)
+        # Both requests are made before either finishes.
+        while len(started) < 2:
+            await asyncio.sleep(0.01)
+        data = base64.b64encode(prompt.encode()).decode()
+        return mock.Mock(data=[mock.Mock(b64_json=data)] * n)
+
+    client = mock.Mock()
+    client.images.generate = mock.AsyncMock(side_effect=generate)
+    client.close = mock.AsyncMock()
+    mocker.patch("openai.AsyncOpenAI", return_value=client)
+
+    output = evaluate_plugins(
+        'IMAGE("cat.png")\n```\nA cat\n```\nIMAGE(dog.png)\n```\nA dog\n```\n',
+        ["image"],
+    )
+    assert output == result("Saved to: cat-1.png, cat-2.png") + "\n" + result(
+        "Saved to: dog-1.png, dog-2.png"
+    )
+    assert (tmp_path / "cat-2.png").read_text() == "A cat\n"
+    assert client.images.generate.call_args.kwargs["response_format"] == "b64_json"
@@ -0,0 +1,80 @@
+import json
+from datetime import datetime, timezone
+import pytest
+from chatcli_gpt.conversation import Conversation
+from chatcli_gpt.log import line_may_match
+from chatcli_gpt.query import Query, QueryError, parse_period
+
+
+def local(*args):
+    return datetime(*args).astimezone()
+
+
+def test_parse():
+    query = Query.parse(
+        'model:gpt-4* tag:work since:2024-01 until:2024-02-15 tokens>=100 "a phrase" word'
+    )
+    assert query == Query(
+        models=["gpt-4*"],
+        tags=["work"],
+        since=local(2024, 1, 1),
+        until=local(2024, 2, 16),
+        comparisons=[("tokens", ">=", 100.0)],
+        phrases=["a phrase", "word"],
+    )
+
+
+@pytest.mark.parametrize(
+    ("text", "start", "end"),
+    [
+        ("2023", local(2023, 1, 1), local(2024, 1, 1)),
+        ("2023-12", local(2023, 12, 1), local(2024, 1, 1)),
+        ("2023-12-31", local(2023, 12, 31), local(2024, 1, 1)),
+        ("2023-12-31T10:30", local(2023, 12, 31, 10, 30), local(2023, 12, 31, 10, 30)),
+    ],
+)
+def test_parse_period(text, start, end):
+    assert parse_period(text) == (start, end)
+
+
+@pytest.mark.parametrize("text", ["since:yesterday", 'tag:"unclosed', "cost>cheap"])
+def test_invalid_query(text):
+    with pytest.raises(QueryError):
+        Query.parse(text)
+
+
+ENTRY = {
+    "messages": [
+        {"role": "user", "content": 'Say "model": "gpt-4" in café'},
+        {"role": "assistant", "content": "OK"},
+    ],
+    "completion": {"choices": [{"text": "OK"}], "model": "gpt-3.5-turbo-0613"},
+    "usage": {"prompt_tokens": 10, "completion_tokens": 20, "total_tokens": 30},
+    "tags": ["work"],
+    "timestamp": datetime(2024, 1, 15, 12, tzinfo=timezone.utc).isoformat(),
+    "plugins": [],
+    "model": "gpt-3.5-turbo",
+    "metrics": None,
+}
+
+
+@pytest.mark.parametrize(
+    ("text", "expected"),
+    [
+        ("model:gpt-3.5*", True),
+        ("model:gpt-4*", False),
+        ("tag:work", True),
+        ("tag:play", False),
+        ("since:2024-01 until:2024-01", True),
+        ("since:2024-02", False),
+        ("tokens>20", True),
+        ("tokens<=20", False),
+        ('"in café"', True),
+        ("cafe", False),
+    ],
+)
+def test_line_matches_like_entry(text, expected):
+    query = Query.parse(text)
+    line = json.dumps(ENTRY).encode()
+    assert line_may_match(line, query) == expected
+    assert query.matches(Conversation(ENTRY)) == expected
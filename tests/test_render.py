@@ -0,0 +1,35 @@
+import io
+from rich.console import Console
+from chatcli_gpt import render
+
+
+def markdown_renderer():
+    console = Console(file=io.StringIO(), force_terminal=True, width=60)
+    return render.MarkdownRenderer(console)
+
+
+def test_finished_blocks_leave_the_live_region():
+    renderer = markdown_renderer()
+    with renderer:
+        for token in ["# Ti", "tle\n", "\nSome ", "text.\n\n- a", "\n- b"]:
+            renderer.write(token)
+        assert renderer.block == ["- a"]
+        assert renderer.line == "- b"
+    output = renderer.console.file.getvalue()
+    assert "Title" in output
+    assert "Some text." in output
+
+
+def test_code_fence_is_one_block():
+    renderer = markdown_renderer()
+    with renderer:
+        renderer.write("```python\nx = 1\n\ny = 2\n")
+        assert renderer.block == ["```python", "x = 1", "", "y = 2"]
+        renderer.write("```\n\nDone.")
+        assert renderer.block == []
+
+
+def test_plain_when_not_a_terminal(chatcli):
+    assert isinstance(render.answer_renderer(markdown=True), render.PlainRenderer)
+    result = chatcli("chat --quick --markdown", input="**What** is your name?")
+    assert "**WHAT** IS YOUR NAME?\n" in result.output